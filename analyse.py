@@ -1,162 +1,790 @@
-from db import get_habit, get_habits, get_events, get_habits_by_periodicity
-from datetime import datetime, timedelta
+from db import iter_habits_with_events, open_read_only, get_database_name
+from storage import get_backend, SQLiteBackend
+import instrumentation
+from streaks import period_days, cut_off_seconds, is_credible, advance_streak
+from parsing import parse_datetime
+from datetime import date, datetime, timedelta
 from collections import namedtuple
 from operator import attrgetter
+from functools import partial
+from itertools import chain
+from heapq import nsmallest
+from bisect import bisect_left
 
+# numpy is only imported once the numpy engine is used, it is slow to import
+np = None
 
-def _get_habit_streak(habit_name: str):
+StreakResult = namedtuple("StreakResult", "name streak max_streak")
+ComplianceResult = namedtuple("ComplianceResult", "name completed expected rate")
+MonthlyRollup = namedtuple("MonthlyRollup", "month events completed expected rate")
+
+
+def _import_numpy():
+    """Import numpy on first use.
+
+    :return: the numpy module or None if it is not installed
+    """
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+
+def set_streak_engine(name: str):
+    """Select the engine used to calculate habit streaks.
+
+    :params: name: python for the event by event loop or numpy for the
+        vectorized engine
+    :return: message showing the engine selected or the error encountered
+    """
+    global streak_engine
+    if name not in _STREAK_ENGINES:
+        return f'ERROR: Allowed streak engines are {"/".join(_STREAK_ENGINES)} NOT [{name}]'
+    if name == 'numpy' and _import_numpy() is None:
+        return 'ERROR: numpy is not installed, the numpy streak engine is unavailable'
+    streak_engine = name
+    return f'SUCCESS: Streak engine {name} selected'
+
+
+def get_streak_engine():
+    """Return the name of the engine used to calculate habit streaks."""
+    return streak_engine
+
+
+@instrumentation.timed('span')
+def _get_habit_streak(habit_name: str, backend=None):
     """Gets the current streak and highest streak for the current habit.
 
     :params: habit_name: target habit name whose streak details is requested
+    :params: backend: storage backend to read from, the process backend when
+        omitted
     :return: returns a namedtuple containing the current streak and highest streak
         the requested habit
            """
-    habit_response = get_habit(habit_name)
+    backend = backend or get_backend()
+    habit_response = backend.get_habit(habit_name)
     if 'ERROR' in habit_response:
         return habit_response
     elif not (habit_response.habit_status == 'ACTIVE'):
         return f'ERROR: Habit {habit_name} is {habit_response.habit_status}. Only \
             ACTIVE habits are analysed'
     else:
-        habit_events_response = get_events(habit_name)
-        if 'ERROR' in habit_events_response:
-            return habit_events_response
-        else:
-            next_date_days_increment = 1
-            if habit_response.periodicity == 'Weekly':
-                next_date_days_increment = 7
-            habit_startdate = datetime.fromisoformat(habit_response.start_date)
-            '''If the habit cut_off_style is not IGNORE, that means a specific
-            time is required for this habit'''
-            if not (habit_response.cut_off_style == 'IGNORE'):
-                cut_off_time_parts = habit_response.cut_off_time.split(':')
-                if len(cut_off_time_parts) == 3:
-                    habit_startdate = datetime(habit_startdate.year,
-                                               habit_startdate.month,
-                                               habit_startdate.day,
-                                               int(cut_off_time_parts[0]),
-                                               int(cut_off_time_parts[1]),
-                                               int(cut_off_time_parts[2]))
-            # exclude events that occurred before the habit start date
-            valid_events = [x for x in habit_events_response if
-                            habit_startdate.date() <=
-                            datetime.fromisoformat(x.event_date).date()]
-            streak = 0
-            max_streak = 0
-            if valid_events:
-                # sorted the list for sequential analysis
-                valid_events = sorted(valid_events, key=attrgetter('event_date'))
-                for x in valid_events:
-                    event_credible_flag = 0
-                    event_datetime = datetime.fromisoformat(x.event_date)
-                    if habit_startdate.date() == event_datetime.date():
-                        if habit_response.cut_off_style == 'IGNORE':
-                            event_credible_flag = 1
-                        elif habit_response.cut_off_style == 'ON':
-                            if event_datetime.time() == habit_startdate.time():
-                                event_credible_flag = 1
-                        elif habit_response.cut_off_style == 'AFTER':
-                            if event_datetime.time() > habit_startdate.time():
-                                event_credible_flag = 1
-                        elif habit_response.cut_off_style == 'BEFORE':
-                            if event_datetime.time() < habit_startdate.time():
-                                event_credible_flag = 1
-                        else:
-                            return f'Unknown cut_off_style  {habit_response.cut_off_style}.'
-
-                        if event_credible_flag:
-                            streak += 1
-                            max_streak = max(max_streak, streak)
-                        else:
-                            # start new streak
-                            streak = 0
-
-                        habit_startdate += timedelta(days=next_date_days_increment)
-                    else:
-                        # streak breaks reset streak,max_streak,habit_startdate
-                        streak = 0
-                        event_datetime += timedelta(days=next_date_days_increment)
-                        habit_startdate = datetime(event_datetime.year,
-                                                   event_datetime.month,
-                                                   event_datetime.day,
-                                                   habit_startdate.hour,
-                                                   habit_startdate.minute,
-                                                   habit_startdate.second)
-
-                streak_data = namedtuple("Habit", "name streak max_streak")
-                return streak_data(habit_name, streak, max_streak)
+        return _STREAK_ENGINES[streak_engine](habit_name, habit_response, backend=backend)
+
+
+def _python_habit_streak(habit_name: str, habit_response, habit_events_response=None, backend=None):
+    """Calculate the streaks of a habit by walking its events one at a time.
+
+    :params: habit_name: target habit name whose streak details is requested
+    :params: habit_response: namedtuple of the habit
+    :params: habit_events_response: events of the habit when already loaded,
+        they are retrieved from the backend otherwise
+    :params: backend: storage backend to read from, the process backend when
+        omitted
+    :return: returns a namedtuple containing the current streak and highest streak
+        the requested habit
+    """
+    if habit_events_response is None:
+        with instrumentation.span('fetch_events'):
+            habit_events_response = (backend or get_backend()).get_events(habit_name)
+    if isinstance(habit_events_response, str):
+        return habit_events_response
+
+    next_date_days_increment = 1
+    if habit_response.periodicity == 'Weekly':
+        next_date_days_increment = 7
+    habit_startdate = parse_datetime(habit_response.start_date)
+    '''If the habit cut_off_style is not IGNORE, that means a specific
+    time is required for this habit'''
+    if not (habit_response.cut_off_style == 'IGNORE'):
+        cut_off_time_parts = habit_response.cut_off_time.split(':')
+        if len(cut_off_time_parts) == 3:
+            habit_startdate = datetime(habit_startdate.year,
+                                       habit_startdate.month,
+                                       habit_startdate.day,
+                                       int(cut_off_time_parts[0]),
+                                       int(cut_off_time_parts[1]),
+                                       int(cut_off_time_parts[2]))
+    # exclude events that occurred before the habit start date
+    valid_events = [x for x in habit_events_response if
+                    habit_startdate.date() <=
+                    parse_datetime(x.event_date).date()]
+    streak = 0
+    max_streak = 0
+    if valid_events:
+        # sorted the list for sequential analysis
+        valid_events = sorted(valid_events, key=attrgetter('event_date'))
+        for x in valid_events:
+            event_credible_flag = 0
+            event_datetime = parse_datetime(x.event_date)
+            if habit_startdate.date() == event_datetime.date():
+                if habit_response.cut_off_style == 'IGNORE':
+                    event_credible_flag = 1
+                elif habit_response.cut_off_style == 'ON':
+                    if event_datetime.time() == habit_startdate.time():
+                        event_credible_flag = 1
+                elif habit_response.cut_off_style == 'AFTER':
+                    if event_datetime.time() > habit_startdate.time():
+                        event_credible_flag = 1
+                elif habit_response.cut_off_style == 'BEFORE':
+                    if event_datetime.time() < habit_startdate.time():
+                        event_credible_flag = 1
+                else:
+                    return f'Unknown cut_off_style  {habit_response.cut_off_style}.'
+
+                if event_credible_flag:
+                    streak += 1
+                    max_streak = max(max_streak, streak)
+                else:
+                    # start new streak
+                    streak = 0
+
+                habit_startdate += timedelta(days=next_date_days_increment)
             else:
-                return f'There are no events to analyze for habit {habit_name}'
+                # streak breaks reset streak,max_streak,habit_startdate
+                streak = 0
+                event_datetime += timedelta(days=next_date_days_increment)
+                habit_startdate = datetime(event_datetime.year,
+                                           event_datetime.month,
+                                           event_datetime.day,
+                                           habit_startdate.hour,
+                                           habit_startdate.minute,
+                                           habit_startdate.second)
+
+        return StreakResult(habit_name, streak, max_streak)
+    else:
+        return f'There are no events to analyze for habit {habit_name}'
+
+
+def _numpy_habit_streak(habit_name: str, habit_response, habit_events_response=None, backend=None):
+    """Calculate the streaks of a habit with vectorized numpy operations.
+
+    Every event is compared to the day after the previous event (or to the start
+    date for the first one), so the streak is the length of the runs of events
+    that land on their expected day and satisfy the cut off style.
+
+    :params: habit_name: target habit name whose streak details is requested
+    :params: habit_response: namedtuple of the habit
+    :params: habit_events_response: events of the habit with their event_day
+        and event_epoch when already loaded, or an array of (event_day,
+        event_epoch) rows. They are retrieved from the backend otherwise
+    :params: backend: storage backend to read from, the process backend when
+        omitted
+    :return: returns a namedtuple containing the current streak and highest streak
+        the requested habit
+    """
+    np = _import_numpy()
+    if habit_events_response is None:
+        with instrumentation.span('fetch_events'):
+            habit_events_response = (backend or get_backend()).get_event_days(habit_name)
+        if isinstance(habit_events_response, str):
+            return habit_events_response
+    elif not isinstance(habit_events_response, np.ndarray):
+        habit_events_response = [(x.event_day, x.event_epoch) for x in habit_events_response]
+
+    next_date_days_increment = period_days(habit_response.periodicity)
+    start_day = parse_datetime(habit_response.start_date).toordinal()
+    cut_off = cut_off_seconds(habit_response.start_date, habit_response.cut_off_style,
+                              habit_response.cut_off_time)
+
+    event_days = np.array(habit_events_response, dtype=np.int64).reshape(-1, 2)
+    # exclude events that occurred before the habit start date
+    event_days = event_days[event_days[:, 0] >= start_day]
+    if not len(event_days):
+        return f'There are no events to analyze for habit {habit_name}'
+
+    days = event_days[:, 0]
+    seconds = event_days[:, 1] % 86400
+    if habit_response.cut_off_style == 'IGNORE':
+        credible = np.ones(len(days), dtype=bool)
+    elif habit_response.cut_off_style == 'ON':
+        credible = seconds == cut_off
+    elif habit_response.cut_off_style == 'AFTER':
+        credible = seconds > cut_off
+    elif habit_response.cut_off_style == 'BEFORE':
+        credible = seconds < cut_off
+    else:
+        return f'Unknown cut_off_style  {habit_response.cut_off_style}.'
+
+    expected_days = np.empty_like(days)
+    expected_days[0] = start_day
+    expected_days[1:] = days[:-1] + next_date_days_increment
+    kept = credible & (days == expected_days)
+
+    positions = np.arange(len(days))
+    last_break = np.maximum.accumulate(np.where(kept, -1, positions))
+    run_lengths = positions - last_break
+
+    return StreakResult(habit_name, int(run_lengths[-1]), int(run_lengths.max()))
 
 
-def get_all_habits():
+_STREAK_ENGINES = {'python': _python_habit_streak, 'numpy': _numpy_habit_streak}
+streak_engine = 'python'
+
+
+def get_all_habits(backend=None):
     """Retrieve all the habits existing in the sqlite3 database.
 
+    :params: backend: storage backend to read from, the process backend when
+        omitted
     :return: Returns a namedtuple list of all the habits existing in the
         database or a message showing no habit was found if empty
     """
-    return get_habits()
+    return (backend or get_backend()).get_habits()
 
 
-def get_habits_periodically(frequency: str):
+def get_habits_periodically(frequency: str, backend=None):
     """Retrieve all habits existing in the database by their periodicity.
 
     :params: frequency: this is the expected rate of carrying out habit -
         Daily or Weekly
+    :params: backend: storage backend to read from, the process backend when
+        omitted
     :return: Returns a namedtuple list of all the habits marching period
         existing in the database or a message showing no habit was found
     """
-    return get_habits_by_periodicity(frequency)
+    return (backend or get_backend()).get_habits_by_periodicity(frequency)
 
 
-def calculate_counter(habit_name: str):
+@instrumentation.timed('span')
+def calculate_counter(habit_name: str, backend=None, since=None, until=None):
     """
     Calculate the number of times a habit was consecutively undertaken.
 
+    With since or until only the events of that window are read, through the
+    (habit_id, event_date) index on sqlite3, and the streaks are counted as if
+    the habit started with the window.
+
     :params: habit_name: is the named habit that we want to estimate compliance
+    :params: backend: storage backend to read from, the process backend when
+        omitted
+    :params: since: optional first day of the window - YYYY-MM-DD or a date,
+        the habit start date when omitted
+    :params: until: optional last day of the window - YYYY-MM-DD or a date,
+        today when omitted
     :return: namedtuple of three items-habit name, current number of times
     habit was consecutively undertaken (streak) and the maximum streak ever
     attained for the habit
     """
-    return _get_habit_streak(habit_name)
+    backend = backend or get_backend()
+    if since or until:
+        habit_response = backend.get_habit(habit_name)
+        if 'ERROR' in habit_response:
+            return habit_response
+        elif not (habit_response.habit_status == 'ACTIVE'):
+            return _get_habit_streak(habit_name, backend)
+        window = _window(habit_response, since, until)
+        if isinstance(window, str):
+            return window
+        return _windowed_habit_streak(habit_name, habit_response, backend, *window)
 
+    result, data_version = read_counter(habit_name, backend)
+    if data_version is not None:
+        store_counter(result, data_version, backend)
+    return result
 
-def calculate_all_counters():
+
+def read_counter(habit_name: str, backend=None):
+    """
+    Calculate the streaks of a habit without writing to the storage.
+
+    The stored streak state is returned when there is one, the streaks are
+    recalculated from the events otherwise, without holding the writer.
+
+    :params: habit_name: is the named habit that we want to estimate compliance
+    :params: backend: storage backend to read from, the process backend when
+        omitted
+    :return: tuple of the counter namedtuple or the error message, and the
+        data version of the habit the counter was calculated from when it
+        should be stored with store_counter, None otherwise
+    """
+    backend = backend or get_backend()
+    habit_response = backend.get_habit(habit_name)
+    if 'ERROR' in habit_response:
+        return habit_response, None
+    elif not (habit_response.habit_status == 'ACTIVE'):
+        return _get_habit_streak(habit_name, backend), None
+
+    # streaks are kept up to date by save_event, only recompute when the
+    # stored state was invalidated by an edit or was never calculated
+    state = backend.get_streak_state(habit_name)
+    if 'ERROR' not in state:
+        instrumentation.count('streak_cache_hit')
+        return StreakResult(habit_name, state[1], state[2]), None
+    instrumentation.count('streak_cache_miss')
+
+    data_version = backend.get_data_version(habit_name)
+    result = _get_habit_streak(habit_name, backend)
+    if isinstance(result, str) or isinstance(data_version, str):
+        return result, None
+    return result, data_version
+
+
+def store_counter(counter, data_version, backend=None):
+    """
+    Store the streaks returned by read_counter as the streak state of the habit.
+
+    Nothing is stored when the habit or its events changed since the counter
+    was calculated, the next read recalculates it.
+
+    :params: counter: namedtuple returned by read_counter
+    :params: data_version: data version returned by read_counter
+    :params: backend: storage backend to write to, the process backend when
+        omitted
+    :return: True if the streak state was stored
+    """
+    backend = backend or get_backend()
+    with backend.transaction():
+        if backend.get_data_version(counter.name) != data_version:
+            return False
+        backend.save_streak_state(counter.name, counter.streak, counter.max_streak)
+    return True
+
+
+def _day(value):
+    """Return the day ordinal of a date, datetime or YYYY-MM-DD string."""
+    if hasattr(value, 'toordinal'):
+        return value.toordinal()
+    return datetime.fromisoformat(value[:10]).toordinal()
+
+
+def _window(habit_response, since=None, until=None):
+    """Return the first and last day ordinals of an analysis window.
+
+    :params: habit_response: namedtuple of the habit
+    :params: since: first day of the window, the habit start date when omitted
+    :params: until: last day of the window, today when omitted
+    :return: (first, last) inclusive day ordinals, the first day being no
+        earlier than the habit start date, or the error message
+    """
+    start_day = parse_datetime(habit_response.start_date).toordinal()
+    try:
+        first = _day(since) if since else start_day
+        last = _day(until) if until else datetime.now().toordinal()
+    except (TypeError, ValueError):
+        return f'ERROR: Window dates are YYYY-MM-DD NOT [{since}] and [{until}]'
+    if first > last:
+        return f'ERROR: Window starts [{since}] after it ends [{until}]'
+    return max(first, start_day), last
+
+
+def _windowed_habit_streak(habit_name: str, habit_response, backend, first: int, last: int):
+    """Calculate the streaks of a habit from the events of a window only.
+
+    The first event of the window is expected on the habit start date when the
+    window starts with the habit, any event can start the streak otherwise.
+
+    :params: habit_name: target habit name whose streak details is requested
+    :params: habit_response: namedtuple of the habit
+    :params: backend: storage backend to read from
+    :params: first: first day ordinal of the window
+    :params: last: last day ordinal of the window
+    :return: returns a namedtuple containing the current streak and highest streak
+        of the requested habit in the window
+    """
+    days = backend.get_event_days(habit_name, date.fromordinal(first).isoformat(),
+                                  date.fromordinal(last).isoformat())
+    if isinstance(days, str) or not days:
+        return f'There are no events to analyze for habit {habit_name}'
+    periodicity = habit_response.periodicity
+    start_day = parse_datetime(habit_response.start_date).toordinal()
+    cut_off = cut_off_seconds(habit_response.start_date, habit_response.cut_off_style,
+                              habit_response.cut_off_time)
+    last_day = (start_day if first == start_day else days[0][0]) - period_days(periodicity)
+    streak = max_streak = 0
+    for event_day, event_epoch in days:
+        last_day, streak, max_streak = advance_streak(last_day, streak, max_streak, event_day, event_epoch % 86400,
+                                                      periodicity, cut_off, habit_response.cut_off_style)
+    return StreakResult(habit_name, streak, max_streak)
+
+
+def _month(day: int):
+    """Return the YYYY-MM month of a day ordinal."""
+    return date.fromordinal(day).isoformat()[:7]
+
+
+def _month_rollups(habit_response, backend, first: int, last: int):
+    """Retrieve the monthly rollups of the months from first to last.
+
+    The rollups kept by the backend are used when it has them, they are built
+    from the events of the window otherwise.
+
+    :params: habit_response: namedtuple of the habit
+    :params: backend: storage backend to read from
+    :params: first: first day ordinal of the window
+    :params: last: last day ordinal of the window
+    :return: list of (month, events, days, credible) tuples like
+        db.get_rollups or the error message
+    """
+    get_rollups = getattr(backend, 'get_rollups', None)
+    if get_rollups is not None:
+        return get_rollups(habit_response.name, _month(first), _month(last))
+
+    since = date.fromordinal(first).replace(day=1)
+    until = (date.fromordinal(last).replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    days = backend.get_event_days(habit_response.name, since.isoformat(), until.isoformat())
+    if isinstance(days, str):
+        return []
+    cut_off = cut_off_seconds(habit_response.start_date, habit_response.cut_off_style,
+                              habit_response.cut_off_time)
+    rollups = {}
+    for event_day, event_epoch in days:
+        day = date.fromordinal(event_day)
+        events, mask, credible = rollups.get(_month(event_day), (0, 0, 0))
+        bit = 1 << (day.day - 1)
+        if is_credible(habit_response.cut_off_style, event_epoch % 86400, cut_off):
+            credible |= bit
+        rollups[_month(event_day)] = (events + 1, mask | bit, credible)
+    return [(month,) + rollups[month] for month in sorted(rollups)]
+
+
+def _completed_periods(habit_response, rollups, first: int, last: int):
+    """Check which periods of a habit have a credible event.
+
+    Periods start on the habit start date and every period_days after it. A
+    period counts once its start is in the window and no later than today,
+    and is completed when an event satisfying the cut off style lands in it.
+
+    :params: habit_response: namedtuple of the habit
+    :params: rollups: monthly rollups returned by _month_rollups
+    :params: first: first day ordinal of the window
+    :params: last: last day ordinal of the window
+    :return: generator of (period start day ordinal, completed) pairs
+    """
+    credible = []
+    for month, _, _, mask in rollups:
+        month_day = date.fromisoformat(month + '-01').toordinal()
+        credible.extend(month_day + x for x in range(mask.bit_length()) if mask >> x & 1)
+
+    period = period_days(habit_response.periodicity)
+    start_day = parse_datetime(habit_response.start_date).toordinal()
+    first = max(first, start_day)
+    last = min(last, datetime.now().toordinal())
+    # periods start on the first day aligned with the start date in the window
+    for period_day in range(start_day + (first - start_day + period - 1) // period * period, last + 1, period):
+        position = bisect_left(credible, period_day)
+        yield period_day, position < len(credible) and credible[position] < min(period_day + period, last + 1)
+
+
+def _active_habit(habit_name: str, backend):
+    """Return the habit when it can be analysed, the error message otherwise."""
+    habit_response = backend.get_habit(habit_name)
+    if 'ERROR' in habit_response:
+        return habit_response
+    elif not (habit_response.habit_status == 'ACTIVE'):
+        return f'ERROR: Habit {habit_name} is {habit_response.habit_status}. Only ACTIVE habits are analysed'
+    return habit_response
+
+
+@instrumentation.timed('span')
+def compliance_rate(habit_name: str, since=None, until=None, backend=None):
+    """
+    Calculate the share of the periods of a habit that were completed.
+
+    The periods are read from the monthly rollups, so the cost grows with the
+    months of the window, not with the history of the habit.
+
+    :params: habit_name: is the named habit that we want to estimate compliance
+    :params: since: optional first day of the window - YYYY-MM-DD or a date,
+        the habit start date when omitted
+    :params: until: optional last day of the window - YYYY-MM-DD or a date,
+        today when omitted
+    :params: backend: storage backend to read from, the process backend when
+        omitted
+    :return: namedtuple of the habit name, the number of periods completed,
+        the number of periods expected and their ratio, or the error message
+    """
+    backend = backend or get_backend()
+    habit_response = _active_habit(habit_name, backend)
+    if isinstance(habit_response, str):
+        return habit_response
+    window = _window(habit_response, since, until)
+    if isinstance(window, str):
+        return window
+    rollups = _month_rollups(habit_response, backend, *window)
+    if isinstance(rollups, str):
+        return rollups
+    periods = [completed for _, completed in _completed_periods(habit_response, rollups, *window)]
+    completed = sum(periods)
+    return ComplianceResult(habit_name, completed, len(periods), completed / len(periods) if periods else 0.0)
+
+
+@instrumentation.timed('span')
+def monthly_rollup(habit_name: str, since=None, until=None, backend=None):
+    """
+    Summarise the events and compliance of a habit month by month.
+
+    Every month overlapping the window is reported whole, from the habit start
+    date to today at most.
+
+    :params: habit_name: is the named habit that we want to estimate compliance
+    :params: since: optional day in the first month - YYYY-MM-DD or a date,
+        the habit start date when omitted
+    :params: until: optional day in the last month - YYYY-MM-DD or a date,
+        today when omitted
+    :params: backend: storage backend to read from, the process backend when
+        omitted
+    :return: namedtuple list of the month YYYY-MM, the number of events, the
+        periods completed, the periods expected and their ratio, oldest month
+        first, or the error message
+    """
+    backend = backend or get_backend()
+    habit_response = _active_habit(habit_name, backend)
+    if isinstance(habit_response, str):
+        return habit_response
+    window = _window(habit_response, since, until)
+    if isinstance(window, str):
+        return window
+    first = date.fromordinal(window[0]).replace(day=1).toordinal()
+    last = (date.fromordinal(window[1]).replace(day=28) + timedelta(days=4)).replace(day=1).toordinal() - 1
+    rollups = _month_rollups(habit_response, backend, first, last)
+    if isinstance(rollups, str):
+        return rollups
+
+    months = {}
+    month = date.fromordinal(first)
+    while month.toordinal() <= last:
+        months[month.isoformat()[:7]] = [0, 0, 0]
+        month = (month + timedelta(days=31)).replace(day=1)
+    for month, events, _, _ in rollups:
+        months[month][0] = events
+    for period_day, completed in _completed_periods(habit_response, rollups, first, last):
+        counts = months[_month(period_day)]
+        counts[1] += completed
+        counts[2] += 1
+    return [MonthlyRollup(month, events, completed, expected, completed / expected if expected else 0.0)
+            for month, (events, completed, expected) in months.items()]
+
+
+def _counters(habits_with_events, engine: str):
+    """Calculate the counters of habits streamed with their events.
+
+    :params: habits_with_events: iterable of (habit, events) pairs
+    :params: engine: name of the streak engine to use
+    :return: generator of the counters of the habits that could be analysed
+    """
+    engine = _STREAK_ENGINES[engine]
+    if instrumentation.enabled:
+        # fetching the events of each habit and computing its streaks are timed apart
+        habits_with_events = instrumentation.timed_iter('fetch_events', habits_with_events)
+        engine = instrumentation.timed('span', 'compute_streaks')(engine)
+    for habit, habit_events in habits_with_events:
+        res = engine(habit.name, habit, habit_events)
+        # Just skip the habit details
+        if not isinstance(res, str):
+            yield res
+
+
+_worker_connection = None
+
+
+def _init_counter_worker(database: str):
+    """Open the read-only connection used by a counter worker process."""
+    global _worker_connection
+    _worker_connection = open_read_only(database)
+
+
+def _counters_for_habits(engine: str, habit_names):
+    """Calculate the counters of a chunk of habits inside a worker process.
+
+    :params: engine: name of the streak engine to use
+    :params: habit_names: names of the habits of the chunk
+    :return: namedtuple list of the counters of the chunk
+    """
+    return list(_counters(iter_habits_with_events(habit_names, _worker_connection), engine))
+
+
+def _calculate_all_counters_in_parallel(workers: int, chunk_size: int):
+    """Spread the habits over worker processes and merge their counters.
+
+    :params: workers: number of worker processes
+    :params: chunk_size: number of habits handed to a worker at a time
+    :return: namedtuple list of the counters in the same order as the serial
+        calculation or a message showing there is no habit to analyze
+    """
+    all_habits = get_backend().get_habits()
+    if isinstance(all_habits, str):
+        return "There is no habit to analyze at the moment"
+
+    # imported here, process pools are slow to import and rarely used
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    names = [x.name for x in all_habits]
+    chunks = [names[x:x + chunk_size] for x in range(0, len(names), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                             initializer=_init_counter_worker, initargs=(get_database_name(),)) as executor:
+        # map keeps the order of the chunks, so the merged list is deterministic
+        results = executor.map(partial(_counters_for_habits, streak_engine), chunks)
+        return [x for chunk in results for x in chunk]
+
+
+@instrumentation.timed('span')
+def calculate_all_counters(workers=None, chunk_size=1000, backend=None):
     """
     Calculate the number of times all habits were consecutively undertaken.
 
+    :params: workers: number of processes the habits are spread over. When
+        omitted or 1, the counters are calculated in the current process.
+        Only a SQLite database file can be shared with worker processes
+    :params: chunk_size: number of habits handed to a worker process at a time
+    :params: backend: storage backend to read from, the process backend when
+        omitted
     :return: namedtuple list of three items-habit name, current number of
     times habit was consecutively undertaken (streak) and the maximum streak
     ever attained for the habit
     """
-    all_habits = get_habits()
-    if all_habits:
-        my_counters = []
-        for x in all_habits:
-            res = _get_habit_streak(x.name)
-            # Just skip the habit details
-            if not isinstance(res, str):
-                my_counters.append(res)
+    backend = backend or get_backend()
+    if workers and workers > 1 and isinstance(backend, SQLiteBackend) and \
+            get_database_name() not in ('', ':memory:'):
+        return _calculate_all_counters_in_parallel(workers, chunk_size)
 
-        return my_counters
-    else:
+    # one ordered query streams every habit with its events, so only the
+    # events of the habit being analysed are held in memory
+    habits_with_events = backend.iter_habits_with_events()
+    with instrumentation.span('fetch_events'):
+        first_habit = next(habits_with_events, None)
+    if first_habit is None:
         return "There is no habit to analyze at the moment"
+    return list(_counters(chain((first_habit,), habits_with_events), streak_engine))
+
+
+def load_snapshot(path: str):
+    """Load a snapshot written by snapshot.export_snapshot.
+
+    The snapshot can be passed as the backend of the other analyse functions,
+    which then run on this consistent copy without touching the database.
+
+    :params: path: .parquet or .npz snapshot file
+    :return: the snapshot or a message showing the error encountered
+    """
+    # imported here, only offline analytics need the columnar formats
+    from snapshot import read_snapshot
+    return read_snapshot(path)
+
+
+@instrumentation.timed('span')
+def calculate_snapshot_counters(snapshot, periodicity=None):
+    """
+    Calculate the counters of all ACTIVE habits of a snapshot.
+
+    With the numpy engine the streaks are calculated straight from the
+    columns of the snapshot, without building a namedtuple per event.
+
+    :params: snapshot: snapshot returned by load_snapshot, or its file name
+    :params: periodicity: optional periodicity - Daily or Weekly, of the
+        habits to analyse
+    :return: namedtuple list of three items-habit name, streak and maximum
+    streak or a message showing the error encountered
+    """
+    if isinstance(snapshot, str):
+        snapshot = load_snapshot(snapshot)
+        if not hasattr(snapshot, 'iter_habit_days'):
+            return snapshot
+    if streak_engine == 'numpy':
+        habits_with_events = snapshot.iter_habit_days(periodicity)
+    else:
+        habits_with_events = snapshot.iter_habits_with_events(periodicity=periodicity)
+    counters = list(_counters(habits_with_events, streak_engine))
+    return counters or "There is no habit to analyze at the moment"
 
 
-def habit_with_longest_streak():
+def iter_counters(periodicity=None, backend=None):
+    """
+    Calculate the counters of all habits one habit at a time.
+
+    :params: periodicity: optional periodicity - Daily or Weekly, of the
+        habits to analyse
+    :params: backend: storage backend to read from, the process backend when
+        omitted
+    :return: generator of namedtuples of three items-habit name, streak and
+    maximum streak, in the order of get_all_habits
+    """
+    return _counters((backend or get_backend()).iter_habits_with_events(periodicity=periodicity), streak_engine)
+
+
+_TIE_BREAKS = {
+    # equal streaks are ordered by habit name
+    'name': lambda by, other: lambda x: (-getattr(x, by), x.name),
+    # equal streaks are ordered by the other streak, then by habit name
+    'other': lambda by, other: lambda x: (-getattr(x, by), -getattr(x, other), x.name),
+    # equal streaks keep the order the habits are listed in
+    'first': lambda by, other: lambda x: -getattr(x, by),
+}
+
+
+def _top_counters(counters, k: int, by: str, tie_break: str):
+    """Keep the k best counters with a bounded heap.
+
+    :params: counters: iterable of counters, it is consumed once
+    :params: k: number of counters to keep
+    :params: by: max_streak or streak, the field counters are ranked by
+    :params: tie_break: name/other/first, how equal streaks are ordered
+    :return: list of at most k counters, best first
+    """
+    other = 'streak' if by == 'max_streak' else 'max_streak'
+    return nsmallest(k, counters, key=_TIE_BREAKS[tie_break](by, other))
+
+
+def top_streaks(k=10, by='max_streak', periodicity=None, tie_break='name', backend=None):
+    """
+    Get the habits with the longest streaks.
+
+    The counters are streamed through a heap holding at most k of them, so
+    leaderboards cost O(N log k) time and O(k) memory over N habits.
+
+    :params: k: number of habits to return
+    :params: by: max_streak to rank by the highest streak ever attained or
+        streak to rank by the current streak
+    :params: periodicity: optional periodicity - Daily or Weekly, of the
+        habits to rank
+    :params: tie_break: how habits with equal streaks are ordered - name
+        (alphabetically), other (by the other streak, then by name) or first
+        (in the order habits are listed)
+    :params: backend: storage backend to read from, the process backend when
+        omitted
+    :return: namedtuple list of at most k counters, longest streak first, or
+        an error message
+    """
+    if by not in ('max_streak', 'streak'):
+        return f'ERROR: Allowed rankings are max_streak or streak NOT [{by}]'
+    if tie_break not in _TIE_BREAKS:
+        return f'ERROR: Allowed tie breaks are {"/".join(_TIE_BREAKS)} NOT [{tie_break}]'
+    if periodicity and periodicity.capitalize() not in ('Daily', 'Weekly'):
+        return f'ERROR: Allowed periodicity are Daily or Weekly NOT [{periodicity}]'
+    try:
+        k = int(k)
+    except (TypeError, ValueError):
+        return f'ERROR: Number of habits has to be a whole number NOT [{k}]'
+    if k < 1:
+        return 'ERROR: At least one habit has to be requested'
+
+    return _top_counters(iter_counters(periodicity, backend), k, by, tie_break)
+
+
+def habit_with_longest_streak(workers=None, chunk_size=1000, backend=None):
     """
     Get the habit with the longest streak.
 
+    :params: workers: number of processes the habits are spread over
+    :params: chunk_size: number of habits handed to a worker process at a time
+    :params: backend: storage backend to read from, the process backend when
+        omitted
     :return: namedtuple of the habit with the longest streak
     """
-    all_counters = calculate_all_counters()
-    max_value = 0
-    index = -1
-    if all_counters:
-        for x in all_counters:
-            if x.max_streak > max_value:
-                max_value = x.max_streak
-                index = all_counters.index(x)
-        return all_counters[index]
+    if workers and workers > 1:
+        all_counters = calculate_all_counters(workers, chunk_size, backend)
+        if isinstance(all_counters, str):
+            return all_counters
+        longest = _top_counters(all_counters, 1, 'max_streak', 'first')
+    else:
+        longest = top_streaks(1, tie_break='first', backend=backend)
+
+    if longest:
+        return longest[0]
     else:
         return "There is no habit to analyze at the moment"
@@ -0,0 +1,215 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import db
+import analyse
+from counter import Counter
+
+# every write goes through one thread so they queue instead of contending for
+# the sqlite3 writer lock, reads run side by side on their own bounded pool
+_writer_executor = None
+_reader_executor = None
+_readers = 4
+
+
+def configure_executors(readers=4):
+    """Set the number of threads running database reads and analytics.
+
+    :params: readers: maximum number of reads running at the same time
+    """
+    global _readers
+    shutdown_executors()
+    _readers = max(int(readers), 1)
+
+
+def shutdown_executors():
+    """Stop the executor threads, waiting for the queued work to finish."""
+    global _writer_executor, _reader_executor
+    for executor in (_writer_executor, _reader_executor):
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=False)
+    _writer_executor = None
+    _reader_executor = None
+
+
+def _get_writer_executor():
+    """Return the single thread executor running the writes."""
+    global _writer_executor
+    if _writer_executor is None:
+        _writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='htp-writer')
+    return _writer_executor
+
+
+def _get_reader_executor():
+    """Return the bounded executor running the reads and analytics."""
+    global _reader_executor
+    if _reader_executor is None:
+        _reader_executor = ThreadPoolExecutor(max_workers=_readers, thread_name_prefix='htp-reader')
+    return _reader_executor
+
+
+async def _run(executor, function, *args, timeout=None, **kwargs):
+    """Run a blocking call on an executor without blocking the event loop.
+
+    Cancelling the awaiting task, or reaching the timeout, drops the call
+    if it has not started yet; a call already running completes in its
+    thread and its result is discarded.
+
+    :params: executor: executor the call runs on
+    :params: function: blocking function to call
+    :params: timeout: optional seconds to wait before asyncio.TimeoutError
+    :return: the result of the call
+    """
+    future = asyncio.get_running_loop().run_in_executor(executor, partial(function, *args, **kwargs))
+    return await asyncio.wait_for(future, timeout)
+
+
+def _read(function, *args, timeout=None, **kwargs):
+    """Schedule a read on the reader executor."""
+    return _run(_get_reader_executor(), function, *args, timeout=timeout, **kwargs)
+
+
+def _write(function, *args, timeout=None, **kwargs):
+    """Schedule a write on the single writer executor."""
+    return _run(_get_writer_executor(), function, *args, timeout=timeout, **kwargs)
+
+
+async def get_habits(timeout=None):
+    """Retrieve all the ACTIVE habits. See db.get_habits."""
+    return await _read(db.get_habits, timeout=timeout)
+
+
+async def get_habit(name: str, timeout=None):
+    """Retrieve the habit with the name. See db.get_habit."""
+    return await _read(db.get_habit, name, timeout=timeout)
+
+
+async def get_events(name: str, timeout=None):
+    """Retrieve the events of the habit ordered by date. See db.get_events."""
+    return await _read(db.get_events, name, timeout=timeout)
+
+
+async def save_event(name: str, event_date="", timeout=None):
+    """Save a new habit event. See db.save_event."""
+    return await _write(db.save_event, name, event_date, timeout=timeout)
+
+
+async def save_events_bulk(events, chunk_size=500, timeout=None):
+    """Save many habit events in one transaction. See db.save_events_bulk."""
+    return await _write(db.save_events_bulk, events, chunk_size, timeout=timeout)
+
+
+async def calculate_counter(habit_name: str, timeout=None, backend=None):
+    """Calculate the streaks of the habit. See analyse.calculate_counter.
+
+    The streaks are calculated on a reader thread, only storing them as the
+    streak state of the habit is handed to the writer.
+    """
+    counter, data_version = await _read(analyse.read_counter, habit_name, backend, timeout=timeout)
+    if data_version is not None:
+        await _write(analyse.store_counter, counter, data_version, backend, timeout=timeout)
+    return counter
+
+
+async def calculate_all_counters(workers=None, chunk_size=1000, timeout=None):
+    """Calculate the streaks of all the habits. See analyse.calculate_all_counters."""
+    return await _read(analyse.calculate_all_counters, workers, chunk_size, timeout=timeout)
+
+
+async def habit_with_longest_streak(timeout=None):
+    """Get the habit with the longest streak. See analyse.habit_with_longest_streak."""
+    return await _read(analyse.habit_with_longest_streak, timeout=timeout)
+
+
+async def top_streaks(k=10, by='max_streak', periodicity=None, tie_break='name', timeout=None):
+    """Get the habits with the longest streaks. See analyse.top_streaks."""
+    return await _read(analyse.top_streaks, k, by, periodicity, tie_break, timeout=timeout)
+
+
+class AsyncCounter:
+    """Counter whose database work runs off the asyncio event loop."""
+
+    def __init__(self, name: str, description="", start_date="",
+                 periodicity="Daily", cut_off_style="IGNORE",
+                 cut_off_time="00:00:00", habit_status="ACTIVE", timeout=None, backend=None):
+        """Initialize the async counter class.
+
+        :params: name to habit_status: same as the Counter class
+        :params: timeout: optional seconds every call waits before raising
+            asyncio.TimeoutError
+        :params: backend: storage backend of the habit, see the Counter class
+        """
+        self.counter = Counter(name, description, start_date, periodicity,
+                               cut_off_style, cut_off_time, habit_status, backend)
+        self.timeout = timeout
+
+    @property
+    def name(self):
+        """Name of the habit."""
+        return self.counter.name
+
+    @property
+    def streak(self):
+        """Streak assigned by the last calculate_streak."""
+        return self.counter.streak
+
+    @property
+    def highest_streak(self):
+        """Highest streak assigned by the last calculate_streak."""
+        return self.counter.highest_streak
+
+    def __str__(self):
+        """Display habit name, streak and highest streak for the habit."""
+        return self.counter.__str__()
+
+    async def add_habit(self):
+        """Save a new habit to the sqlite3 database."""
+        return await _write(self.counter.add_habit, timeout=self.timeout)
+
+    async def update_my_habit(self, description='', start_date='', periodicity='', cut_off_style='',
+                              cut_off_time=''):
+        """Update a habit in the sqlite3 database."""
+        return await _write(self.counter.update_my_habit, description, start_date, periodicity,
+                            cut_off_style, cut_off_time, timeout=self.timeout)
+
+    async def stop_my_habit(self):
+        """Deactivate the current habit."""
+        return await _write(self.counter.stop_my_habit, timeout=self.timeout)
+
+    async def delete_my_habit_plus_events(self):
+        """Delete the current habit plus all associated habit events."""
+        return await _write(self.counter.delete_my_habit_plus_events, timeout=self.timeout)
+
+    async def add_event(self, event_date: str = ''):
+        """Save a new event carried out for the habit."""
+        return await _write(self.counter.add_event, event_date, timeout=self.timeout)
+
+    async def add_events(self, event_dates):
+        """Save many events carried out for the habit in a single transaction."""
+        return await _write(self.counter.add_events, event_dates, timeout=self.timeout)
+
+    async def get_events(self):
+        """Retrieve all events for the current habit."""
+        return await _read(self.counter.get_events, timeout=self.timeout)
+
+    async def get_event(self, event_date: str):
+        """Retrieve the events for the current habit matching the given date."""
+        return await _read(self.counter.get_event, event_date, timeout=self.timeout)
+
+    async def update_my_event(self, event_id: str, habit_name='', event_date=''):
+        """Update an event for the current habit."""
+        return await _write(self.counter.update_my_event, event_id, habit_name, event_date,
+                            timeout=self.timeout)
+
+    async def delete_my_event(self, event_id: str):
+        """Delete an event for the current habit."""
+        return await _write(self.counter.delete_my_event, event_id, timeout=self.timeout)
+
+    async def calculate_streak(self):
+        """Assign the calculated streak count and the highest streak."""
+        res = await calculate_counter(self.counter.name, self.timeout, self.counter.backend)
+        if isinstance(res, str):
+            return res
+        self.counter.streak = res.streak
+        self.counter.highest_streak = res.max_streak
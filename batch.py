@@ -0,0 +1,254 @@
+import argparse
+import csv
+import json
+import sys
+from collections import deque
+
+import db
+from analyse import calculate_counter, calculate_snapshot_counters, iter_counters, load_snapshot
+from connection import PROFILES
+
+# Exit codes of the batch commands, usage errors exit with 2 through argparse
+EXIT_OK = 0
+EXIT_FAILED = 1
+
+_EVENT_FIELDS = ['event_id', 'habit_name', 'event_date']
+_STREAK_FIELDS = ['name', 'streak', 'max_streak']
+
+
+def _is_error(result):
+    """Check if a db or analyse result is an error message or exception args."""
+    return (isinstance(result, str) and 'ERROR' in result) or \
+        (isinstance(result, tuple) and not hasattr(result, '_asdict'))
+
+
+def _open_input(path: str):
+    """Open the input file, - reads from stdin."""
+    if path == '-':
+        return sys.stdin
+    return open(path, newline='', encoding='utf-8')
+
+
+def _open_output(path: str):
+    """Open the output file, - writes to stdout."""
+    if path == '-':
+        return sys.stdout
+    return open(path, 'w', newline='', encoding='utf-8')
+
+
+def _read_events(stream, file_format: str, habit: str, lines: deque, errors: list):
+    """Stream (name, event_date) pairs out of a CSV or JSONL input.
+
+    :params: stream: file object the events are read from
+    :params: file_format: csv - with a header naming habit_name and event_date
+        columns, or jsonl - one object with the same keys per line
+    :params: habit: habit name used when the input has no habit_name
+    :params: lines: line number of every event yielded, consumed in order
+    :params: errors: receives (line, message) of the lines that can't be read
+    :return: generator of (name, event_date) pairs
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        rows = ((reader.line_num, x) for x in reader)
+    else:
+        rows = ((number, x) for number, x in enumerate(stream, 1) if x.strip())
+
+    for number, row in rows:
+        if file_format == 'jsonl':
+            try:
+                row = json.loads(row)
+            except ValueError as ex:
+                errors.append((number, f'ERROR: {ex.args}'))
+                continue
+            if not isinstance(row, dict):
+                errors.append((number, 'ERROR: Line is not a JSON object'))
+                continue
+        name, event_date = row.get('habit_name') or habit or '', row.get('event_date') or ''
+        if not isinstance(name, str) or not isinstance(event_date, str):
+            errors.append((number, 'ERROR: habit_name and event_date have to be text'))
+            continue
+        lines.append(number)
+        yield name.strip(), event_date.strip()
+
+
+def import_events(arguments):
+    """Save the events of a CSV or JSONL input in one transaction."""
+    lines = deque()
+    errors = []
+    failed = 0
+
+    def report(position, message):
+        nonlocal failed
+        if position is None:
+            # the transaction was rolled back, the earlier results are void
+            print(message, file=sys.stderr)
+            return
+        number = lines.popleft()
+        if 'ERROR' in message:
+            failed += 1
+            print(f'line {number}: {message}', file=sys.stderr)
+
+    stream = _open_input(arguments.input)
+    try:
+        result = db.save_events_bulk(_read_events(stream, arguments.format, arguments.habit, lines, errors),
+                                     arguments.chunk_size, report)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    for number, message in errors:
+        print(f'line {number}: {message}', file=sys.stderr)
+    if _is_error(result):
+        print(f'ERROR: {result}', file=sys.stderr)
+        return EXIT_FAILED
+    print(result)
+    return EXIT_FAILED if failed or errors else EXIT_OK
+
+
+def _write_rows(output, file_format: str, fields, rows):
+    """Write the rows one at a time as CSV or JSONL."""
+    if file_format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow(row)
+    else:
+        for row in rows:
+            output.write(json.dumps(row._asdict()) + '\n')
+
+
+def export(arguments):
+    """Write the events of one or all the habits as CSV or JSONL."""
+    output = _open_output(arguments.output)
+    try:
+        _write_rows(output, arguments.format, _EVENT_FIELDS, db.iter_events(arguments.habit))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return EXIT_OK
+
+
+def streaks(arguments):
+    """Write the streak of one or all the ACTIVE habits as CSV or JSONL."""
+    backend = None
+    if arguments.snapshot:
+        backend = load_snapshot(arguments.snapshot)
+        if _is_error(backend):
+            print(backend, file=sys.stderr)
+            return EXIT_FAILED
+    if arguments.habit:
+        result = calculate_counter(arguments.habit, backend)
+        if _is_error(result):
+            print(result, file=sys.stderr)
+            return EXIT_FAILED
+        counters = [result]
+    elif backend is not None:
+        counters = calculate_snapshot_counters(backend, arguments.periodicity)
+        counters = [] if isinstance(counters, str) else counters
+    else:
+        counters = iter_counters(arguments.periodicity)
+    output = _open_output(arguments.output)
+    try:
+        _write_rows(output, arguments.format, _STREAK_FIELDS, counters)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return EXIT_OK
+
+
+def snapshot(arguments):
+    """Write every habit and event into a columnar snapshot file."""
+    from snapshot import export_snapshot
+    result = export_snapshot(arguments.output, arguments.format)
+    if _is_error(result):
+        print(result, file=sys.stderr)
+        return EXIT_FAILED
+    print(result)
+    return EXIT_OK
+
+
+def add_habit(arguments):
+    """Save a new habit."""
+    result = db.save_habit(arguments.name, arguments.description, arguments.start_date, arguments.periodicity,
+                           arguments.cut_off_style, arguments.cut_off_time)
+    if _is_error(result):
+        print(result, file=sys.stderr)
+        return EXIT_FAILED
+    print(result)
+    return EXIT_OK
+
+
+def _parser():
+    """Build the parser of the batch commands."""
+    parser = argparse.ArgumentParser(prog='main.py', description='Habit Tracker Plus batch commands. '
+                                     'Run without a command for the interactive menu.')
+    parser.add_argument('--database', default='main.db', help='database file name (default main.db)')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default=None,
+                        help='storage profile, SQLite defaults when omitted')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('import-events', help='save events read from a CSV or JSONL file')
+    command.add_argument('input', nargs='?', default='-', help='file to read, - or omitted for stdin')
+    command.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    command.add_argument('--habit', default='', help='habit of the events without a habit_name')
+    command.add_argument('--chunk-size', type=int, default=500, help='events inserted together')
+    command.set_defaults(run=import_events)
+
+    command = commands.add_parser('export', help='write events as CSV or JSONL')
+    command.add_argument('--habit', default=None, help='only export the events of this habit')
+    command.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    command.add_argument('--output', default='-', help='file to write, - or omitted for stdout')
+    command.set_defaults(run=export)
+
+    command = commands.add_parser('streaks', help='write habit streaks as CSV or JSONL')
+    which = command.add_mutually_exclusive_group(required=True)
+    which.add_argument('--all', action='store_true', help='every ACTIVE habit')
+    which.add_argument('--habit', help='a single habit')
+    command.add_argument('--periodicity', choices=['Daily', 'Weekly'], default=None)
+    command.add_argument('--format', choices=['csv', 'jsonl'], default='jsonl')
+    command.add_argument('--output', default='-', help='file to write, - or omitted for stdout')
+    command.add_argument('--snapshot', help='calculate from this snapshot file instead of the database')
+    command.set_defaults(run=streaks)
+
+    command = commands.add_parser('snapshot', help='write habits and events into a columnar snapshot file')
+    command.add_argument('output', help='file to write, the suffix of the format is added when missing')
+    command.add_argument('--format', choices=['parquet', 'npz'], default=None,
+                         help='parquet when pyarrow is installed, npz otherwise')
+    command.set_defaults(run=snapshot)
+
+    command = commands.add_parser('add-habit', help='save a new habit')
+    command.add_argument('name')
+    command.add_argument('--description', default='')
+    command.add_argument('--start-date', default='', help='eg 2024-01-31 05:19:03 AM, now when omitted')
+    command.add_argument('--periodicity', choices=['Daily', 'Weekly'], default='Daily')
+    command.add_argument('--cut-off-style', choices=['IGNORE', 'ON', 'BEFORE', 'AFTER'], default='IGNORE')
+    command.add_argument('--cut-off-time', default='00:00:00', help='eg 05:19:03 AM')
+    command.set_defaults(run=add_habit)
+    return parser
+
+
+def main(argv=None):
+    """Run a batch command.
+
+    :params: argv: command line arguments, sys.argv[1:] when omitted
+    :return: exit code - 0 on success, 1 when anything failed
+    """
+    arguments = _parser().parse_args(argv)
+    result = db.create_data_storage(arguments.database, profile=arguments.profile)
+    if _is_error(result):
+        print(result, file=sys.stderr)
+        return EXIT_FAILED
+    try:
+        return arguments.run(arguments)
+    except BrokenPipeError:
+        # the reader of the output went away, eg piped into head
+        sys.stderr.close()
+        return EXIT_FAILED
+    except OSError as ex:
+        print(f'ERROR: {ex}', file=sys.stderr)
+        return EXIT_FAILED
+    finally:
+        db.close_data_storage()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""Compare the append-only event log with the sqlite3 events table.
+
+Run from the project folder: python -m benchmarks.bench_eventlog [habits] [events]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import analyse
+import db
+from benchmarks.generators import generate_events, generate_habits
+from eventlog import EventLogBackend
+from storage import SQLiteBackend
+
+
+def _time(label: str, function):
+    began = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - began
+    print(f'{label:<40} {seconds * 1000:10.1f}ms')
+    return seconds
+
+
+def _run(label: str, backend, habits, events):
+    for habit in habits:
+        backend.save_habit(habit.name, habit.description, habit.start_date, habit.periodicity)
+    _time(f'{label}: save_events_bulk', lambda: backend.save_events_bulk(events))
+    _time(f'{label}: get_events of every habit', lambda: [backend.get_events(x.name) for x in habits])
+    _time(f'{label}: calculate_all_counters', lambda: analyse.calculate_all_counters(backend=backend))
+
+
+def main(habits=200, events=200):
+    folder = tempfile.mkdtemp()
+    created = list(generate_habits(habits, 0))
+    generated = [(habit.name, x) for habit in created for x in generate_events(habit, events, 0)]
+    print(f'{habits} habits x {events} events')
+    try:
+        db.create_data_storage(os.path.join(folder, 'sqlite.db'), profile='ingest')
+        _run('sqlite', SQLiteBackend(), created, generated)
+        db.close_data_storage()
+
+        db.create_data_storage(os.path.join(folder, 'eventlog.db'), profile='ingest')
+        backend = EventLogBackend(os.path.join(folder, 'events.log'))
+        _run('eventlog', backend, created, generated)
+        backend.close()
+        _time('eventlog: reopen and index', lambda: EventLogBackend(os.path.join(folder, 'events.log')).close())
+        db.close_data_storage()
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
@@ -0,0 +1,120 @@
+"""Compare the size and speed of events keyed by habit name and by integer habit id.
+
+Run from the project folder: python -m benchmarks.bench_habit_ids [habits] [events per habit]
+
+The same synthetic data is written at schema version 6, where events carry the
+habit name, then the file is copied and migrated to the integer habit ids.
+"""
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+import db
+from benchmarks.generators import generate_events, generate_habits
+from migrations import migrate
+from parsing import event_time_columns
+
+# the queries as they ran before the migration, and as db.py runs them now
+_BY_NAME = {
+    'get_events': 'SELECT event_id, habit_name, event_date FROM events WHERE habit_name=? ORDER BY event_date',
+    'same day check': 'SELECT event_id, habit_name, event_date FROM events WHERE habit_name=? AND event_date >= ? '
+                      'AND event_date < ?',
+    'get_event': 'SELECT event_id, habit_name, event_date FROM events WHERE event_id=?',
+}
+_BY_ID = {
+    'get_events': f'SELECT {db._EVENT_COLUMNS} FROM {db._NAMED_EVENTS} WHERE name=? ORDER BY event_date',
+    'same day check': f'SELECT {db._EVENT_COLUMNS} FROM {db._NAMED_EVENTS} WHERE name=? AND event_date >= ? '
+                      'AND event_date < ?',
+    'get_event': f'SELECT {db._EVENT_COLUMNS} FROM {db._NAMED_EVENTS} WHERE event_id=?',
+}
+
+
+def _populate(name: str, habits, events: int):
+    """Create a schema version 6 database where events refer to the habit name."""
+    with sqlite3.connect(name) as conn:
+        migrate(conn, target=6)
+        conn.executemany(f'INSERT INTO habits ({db._HABIT_COLUMNS}) VALUES(?, ?, ?, ?, ?, ?, ?, ?)', habits)
+        for habit in habits:
+            conn.executemany('INSERT INTO events VALUES(?, ?, ?, ?, ?)',
+                             ((str(uuid.uuid4()), habit.name, x) + event_time_columns(x)
+                              for x in generate_events(habit, events)))
+    conn.close()
+
+
+def _sizes(name: str):
+    """Bytes used by the whole file and by every table and index."""
+    with sqlite3.connect(name) as conn:
+        objects = dict(conn.execute('SELECT name, sum(pgsize) FROM dbstat GROUP BY name'))
+    conn.close()
+    return os.path.getsize(name), objects
+
+
+def _time(conn, query: str, parameters):
+    """Best mean time of running the query with each of the parameters."""
+    best = float('inf')
+    for _ in range(3):
+        began = time.perf_counter()
+        for x in parameters:
+            conn.execute(query, x).fetchall()
+        best = min(best, (time.perf_counter() - began) / len(parameters))
+    return best
+
+
+def main(habits=200, events=1000):
+    folder = tempfile.mkdtemp()
+    by_name = os.path.join(folder, 'by_name.db')
+    by_id = os.path.join(folder, 'by_id.db')
+    created = list(generate_habits(habits))
+    try:
+        _populate(by_name, created, events)
+        shutil.copyfile(by_name, by_id)
+        with sqlite3.connect(by_id) as conn:
+            began = time.perf_counter()
+            migrate(conn)
+            migrated = time.perf_counter() - began
+            conn.execute('VACUUM')
+        conn.close()
+        with sqlite3.connect(by_name) as conn:
+            conn.execute('VACUUM')
+        conn.close()
+        print(f'{habits} habits x {events} events, migrated in {migrated:.2f}s\n')
+
+        (before, before_objects), (after, after_objects) = _sizes(by_name), _sizes(by_id)
+        print(f'{"size":<36} {"habit name":>12} {"habit id":>12}')
+        print(f'{"file":<36} {before:12d} {after:12d} {after / before - 1:+8.1%}')
+        for objects in (before_objects, after_objects):
+            for key in sorted(objects):
+                if key.startswith(('events', 'sqlite_autoindex_events')):
+                    column = f'{objects[key]:12d} {"":>12}' if objects is before_objects else \
+                        f'{"":>12} {objects[key]:12d}'
+                    print(f'  {key:<34} {column}')
+
+        generator = random.Random(0)
+        names = [(generator.choice(created).name,) for _ in range(500)]
+        days = [(name, '2020-03-01', '2020-03-02') for (name,) in names]
+        with sqlite3.connect(by_name) as conn:
+            ids = [x for x in conn.execute('SELECT event_id FROM events ORDER BY random() LIMIT 500')]
+        conn.close()
+        parameters = {'get_events': names, 'same day check': days, 'get_event': ids}
+
+        print(f'\n{"query, mean":<36} {"habit name":>12} {"habit id":>12}')
+        timings = {}
+        for label, name, queries in (('before', by_name, _BY_NAME), ('after', by_id, _BY_ID)):
+            with sqlite3.connect(name) as conn:
+                timings[label] = {x: _time(conn, queries[x], parameters[x]) for x in queries}
+            conn.close()
+        for query in _BY_NAME:
+            before_time, after_time = timings['before'][query], timings['after'][query]
+            print(f'{query:<36} {before_time * 1e6:10.1f}us {after_time * 1e6:10.1f}us '
+                  f'{after_time / before_time - 1:+8.1%}')
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
@@ -0,0 +1,48 @@
+"""Measure the overhead of the instrumentation on reads, disabled and enabled.
+
+Run from the project folder: python -m benchmarks.bench_instrumentation [calls] [events]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import db
+import instrumentation
+from benchmarks.generators import populate
+
+
+def _time(label: str, function, calls: int, baseline=None):
+    """Print the mean time of a call and its overhead against the baseline."""
+    best = float('inf')
+    for _ in range(5):
+        began = time.perf_counter()
+        for _ in range(calls):
+            function()
+        best = min(best, (time.perf_counter() - began) / calls)
+    overhead = f'{(best / baseline - 1):+8.1%}' if baseline else ''
+    print(f'{label:<36} {best * 1e6:10.2f}us {overhead}')
+    return best
+
+
+def main(calls=20000, events=10):
+    folder = tempfile.mkdtemp()
+    name = os.path.join(folder, 'bench_instrumentation.db')
+    habit = populate(name, 1, events)[0].name
+    db.create_data_storage(name)
+    query = f'SELECT {db._EVENT_COLUMNS} FROM {db._NAMED_EVENTS} WHERE name=? ORDER BY event_date'
+
+    print(f'_execute_read of {events} events, best mean of 5 x {calls} calls')
+    bare = _time('undecorated', lambda: db._execute_read.__wrapped__(query, (habit,)), calls)
+    _time('instrumentation disabled', lambda: db._execute_read(query, (habit,)), calls, bare)
+    instrumentation.enable(instrumentation.HistogramSink())
+    _time('enabled, in-memory histogram', lambda: db._execute_read(query, (habit,)), calls, bare)
+    instrumentation.disable()
+
+    db.close_data_storage()
+    os.remove(name)
+    os.rmdir(folder)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
@@ -0,0 +1,40 @@
+"""Report how calculate_all_counters scales from one to N worker processes.
+
+Run from the project folder: python -m benchmarks.bench_parallel [habits] [events per habit] [max workers]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import db
+from analyse import calculate_all_counters
+from benchmarks.bench_schema import _populate
+
+
+def main(habits=2000, events=365, max_workers=os.cpu_count()):
+    folder = tempfile.mkdtemp()
+    name = os.path.join(folder, 'bench_parallel.db')
+    _populate(name, habits, events)
+    db.create_data_storage(name)
+    print(f'{habits} habits x {events} events, {os.cpu_count()} cpus')
+
+    serial = None
+    workers = 1
+    while workers <= max_workers:
+        began = time.perf_counter()
+        counters = calculate_all_counters(workers=workers, chunk_size=max(habits // (workers * 4), 1))
+        elapsed = time.perf_counter() - began
+        if serial is None:
+            serial = (counters, elapsed)
+        assert counters == serial[0], 'parallel counters differ from the serial ones'
+        print(f'{workers:>3} workers {elapsed:8.3f}s  speed up x{serial[1] / elapsed:5.2f}')
+        workers *= 2
+
+    db.close_data_storage()
+    os.remove(name)
+    os.rmdir(folder)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:4]])
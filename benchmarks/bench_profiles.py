@@ -0,0 +1,78 @@
+"""Compare write throughput and read/write concurrency of the storage profiles.
+
+Run from the project folder: python -m benchmarks.bench_profiles [events] [seconds] [readers]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import db
+from connection import PROFILES
+
+
+def _event_dates(start: int):
+    """Generate consecutive daily event dates from the given day offset."""
+    day = datetime(2000, 1, 1, 7, 0, 0) + timedelta(days=start)
+    while True:
+        yield day.strftime("%Y-%m-%d %H:%M:%S")
+        day += timedelta(days=1)
+
+
+def _run_profile(folder: str, profile, events: int, seconds: float, readers: int):
+    """Measure one profile against a fresh database."""
+    name = os.path.join(folder, f'bench_{profile}.db')
+    db.create_data_storage(name, pool_size=readers, profile=profile)
+    db.save_habit('bench', '', '1999-12-31 07:00:00')
+
+    dates = _event_dates(0)
+    began = time.perf_counter()
+    for _ in range(events):
+        db.save_event('bench', next(dates))
+    writes_per_second = events / (time.perf_counter() - began)
+
+    stop = threading.Event()
+    counts = {'reads': 0, 'failed reads': 0, 'writes': 0}
+    lock = threading.Lock()
+
+    def read():
+        while not stop.is_set():
+            result = db.get_events('bench')
+            with lock:
+                counts['failed reads' if isinstance(result, str) else 'reads'] += 1
+
+    def write():
+        while not stop.is_set():
+            db.save_event('bench', next(dates))
+            with lock:
+                counts['writes'] += 1
+
+    threads = [threading.Thread(target=read) for _ in range(readers)] + [threading.Thread(target=write)]
+    for x in threads:
+        x.start()
+    time.sleep(seconds)
+    stop.set()
+    for x in threads:
+        x.join()
+
+    db.close_data_storage()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(name + suffix):
+            os.remove(name + suffix)
+    print(f'{str(profile):<10} {writes_per_second:10.0f} {counts["writes"] / seconds:12.0f} '
+          f'{counts["reads"] / seconds:12.0f} {counts["failed reads"]:8}')
+
+
+def main(events=500, seconds=3.0, readers=3):
+    folder = tempfile.mkdtemp()
+    print(f'{events} sequential writes, then {readers} readers and 1 writer for {seconds}s')
+    print(f'{"profile":<10} {"writes/s":>10} {"mixed w/s":>12} {"mixed r/s":>12} {"failed":>8}')
+    for profile in [None] + list(PROFILES):
+        _run_profile(folder, profile, events, seconds, readers)
+    os.rmdir(folder)
+
+
+if __name__ == '__main__':
+    main(*[cast(x) for cast, x in zip((int, float, int), sys.argv[1:4])])
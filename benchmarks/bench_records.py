@@ -0,0 +1,65 @@
+"""Compare loading habits and events into module level record types with building a namedtuple per call.
+
+Run from the project folder: python -m benchmarks.bench_records [events] [repeats]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+
+import db
+from benchmarks.bench_schema import _populate
+
+
+def _legacy_get_events(name: str):
+    """get_events as it was written before the record types were hoisted."""
+    query = f'SELECT {db._EVENT_COLUMNS} FROM {db._NAMED_EVENTS} WHERE name=? ORDER BY event_date'
+    result = db._execute_read(query, (name.upper(),))
+    habit_event = namedtuple("Event", ['event_id', 'habit_name', 'event_date'])
+    return [habit_event(x[0], x[1], x[2]) for x in result]
+
+
+def _legacy_get_habit(name: str):
+    """get_habit as it was written before the record types were hoisted."""
+    query = f"SELECT {db._HABIT_COLUMNS} FROM habits WHERE name=?"
+    result = db._execute_read(query, (name.upper(),))[0]
+    habit = namedtuple("Habit", ['name', 'description', 'entry_date', 'start_date', 'periodicity',
+                                 'cut_off_style', 'cut_off_time', 'habit_status'])
+    return habit(result[0], result[1], result[2], result[3], result[4], result[5], result[6], result[7])
+
+
+def _measure(label: str, function, repeats: int):
+    """Print the best time and the peak memory of loading the events."""
+    best = float('inf')
+    for _ in range(repeats):
+        began = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - began)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{label:<30} {best * 1000:9.2f}ms {peak / 1024 / 1024:8.2f}MiB peak')
+
+
+def main(events=100000, repeats=5):
+    folder = tempfile.mkdtemp()
+    name = os.path.join(folder, 'bench_records.db')
+    _populate(name, 1, events)
+    db.create_data_storage(name)
+    print(f'{events} events')
+
+    _measure('namedtuple per call', lambda: _legacy_get_events('HABIT 0'), repeats)
+    _measure('module level record', lambda: db.get_events('HABIT 0'), repeats)
+    _measure('namedtuple per call x1000', lambda: [_legacy_get_habit('HABIT 0') for _ in range(1000)], repeats)
+    _measure('module level record x1000', lambda: [db.get_habit('HABIT 0') for _ in range(1000)], repeats)
+
+    db.close_data_storage()
+    os.remove(name)
+    os.rmdir(folder)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
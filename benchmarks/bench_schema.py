@@ -0,0 +1,76 @@
+"""Compare get_events and calculate_all_counters before and after the schema migrations.
+
+Run from the project folder: python -m benchmarks.bench_schema [habits] [events per habit]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import db
+from analyse import calculate_all_counters
+from migrations import migrate
+
+
+def _populate(name: str, habits: int, events: int):
+    """Create a database at schema version 1 filled with synthetic habits and events."""
+    start = datetime(2020, 1, 1, 7, 0, 0)
+    with sqlite3.connect(name) as conn:
+        migrate(conn, target=1)
+        for x in range(habits):
+            habit_name = f'HABIT {x}'
+            conn.execute('INSERT INTO habits VALUES(?, ?, ?, ?, ?, ?, ?, ?)',
+                         (habit_name, '', start.strftime("%Y-%m-%d %H:%M:%S"),
+                          start.strftime("%Y-%m-%d %H:%M:%S"), 'Daily', 'IGNORE', '00:00:00', 'ACTIVE'))
+            conn.executemany('INSERT INTO events VALUES(?, ?, ?)',
+                             ((str(uuid.uuid4()), habit_name,
+                               (start + timedelta(days=y)).strftime("%Y-%m-%d %H:%M:%S"))
+                              for y in range(events)))
+    conn.close()
+
+
+def _time(label: str, function):
+    """Run the function once and print how long it took."""
+    began = time.perf_counter()
+    function()
+    print(f'{label:<40} {time.perf_counter() - began:8.3f}s')
+
+
+def _run(habits: int):
+    """Time the read paths against the currently opened database."""
+    _time('get_events for every habit', lambda: [db.get_events(f'HABIT {x}') for x in range(habits)])
+    _time('calculate_all_counters', calculate_all_counters)
+
+
+def _run_version_1(name: str, habits: int):
+    """Time get_events with the query it ran at schema version 1."""
+    query = 'SELECT event_id, habit_name, event_date FROM events WHERE habit_name=? ORDER BY event_date'
+    with sqlite3.connect(name) as conn:
+        _time('get_events for every habit', lambda: [conn.execute(query, (f'HABIT {x}',)).fetchall()
+                                                     for x in range(habits)])
+    conn.close()
+
+
+def main(habits=200, events=1000):
+    folder = tempfile.mkdtemp()
+    name = os.path.join(folder, 'bench_schema.db')
+    _populate(name, habits, events)
+    print(f'{habits} habits x {events} events')
+
+    print('schema version 1 (no indexes)')
+    _run_version_1(name, habits)
+
+    print('latest schema version')
+    db.create_data_storage(name)
+    _run(habits)
+
+    db.close_data_storage()
+    os.remove(name)
+    os.rmdir(folder)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
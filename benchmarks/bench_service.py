@@ -0,0 +1,91 @@
+"""Load test the HTTP service with keep-alive clients polling the streaks.
+
+Run from the project folder: python -m benchmarks.bench_service [habits] [events] [seconds] [clients]
+
+Half of the requests revalidate with If-None-Match like a polling dashboard,
+the other half fetch the full body. A writer adds an event every 500ms so
+ETags keep changing while the clients poll.
+"""
+import http.client
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from statistics import quantiles
+
+import db
+from benchmarks.bench_schema import _populate
+from service import create_service
+
+_PATHS = ['/streaks', '/streaks/longest', '/streaks/top?k=5', '/habits']
+
+
+def _client(port: int, paths, stop, latencies, statuses, seed: int):
+    """Send requests over one persistent connection until stopped."""
+    generator = random.Random(seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    etags = {}
+    while not stop.is_set():
+        path = generator.choice(paths)
+        headers = {}
+        if path in etags and generator.random() < 0.5:
+            headers['If-None-Match'] = etags[path]
+        began = time.perf_counter()
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - began)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        if response.getheader('ETag'):
+            etags[path] = response.getheader('ETag')
+    connection.close()
+
+
+def main(habits=200, events=50, seconds=5.0, clients=4):
+    folder = tempfile.mkdtemp()
+    name = os.path.join(folder, 'bench_service.db')
+    _populate(name, habits, events)
+    service = create_service(port=0, database=name, pool_size=clients)
+    port = service.server_address[1]
+    threading.Thread(target=service.serve_forever, daemon=True).start()
+
+    paths = _PATHS + [f'/habits/HABIT%20{x}/streak' for x in range(0, habits, max(habits // 20, 1))]
+    stop = threading.Event()
+    latencies, statuses = [], {}
+
+    def write():
+        day = datetime(2020, 1, 1, 7, 0, 0) + timedelta(days=events)
+        while not stop.wait(0.5):
+            db.save_event('HABIT 0', day.strftime("%Y-%m-%d %H:%M:%S"))
+            day += timedelta(days=1)
+
+    threads = [threading.Thread(target=_client, args=(port, paths, stop, latencies, statuses, x))
+               for x in range(clients)] + [threading.Thread(target=write)]
+    for x in threads:
+        x.start()
+    time.sleep(seconds)
+    stop.set()
+    for x in threads:
+        x.join()
+
+    service.shutdown()
+    service.server_close()
+    db.close_data_storage()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(name + suffix):
+            os.remove(name + suffix)
+    os.rmdir(folder)
+
+    percentiles = quantiles(latencies, n=100)
+    print(f'{habits} habits x {events} events, {clients} keep-alive clients for {seconds}s')
+    print(f'requests/s {len(latencies) / seconds:10.0f}')
+    print(f'p50 {percentiles[49] * 1000:8.2f} ms   p90 {percentiles[89] * 1000:8.2f} ms   '
+          f'p99 {percentiles[98] * 1000:8.2f} ms')
+    print('statuses', dict(sorted(statuses.items())))
+
+
+if __name__ == '__main__':
+    main(*[cast(x) for cast, x in zip((int, int, float, int), sys.argv[1:5])])
@@ -0,0 +1,67 @@
+"""Measure the import time of the entry points and the run time of short batch commands.
+
+Run from the project folder: python -m benchmarks.bench_startup [runs]
+
+Import times come from python -X importtime, each in a fresh interpreter. The
+batch commands run against a database whose schema is already up to date.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+
+_MODULES = ['main', 'batch', 'service', 'analyse', 'db']
+_COMMANDS = [['streaks', '--all'], ['export'], ['add-habit', 'bench']]
+
+
+def _import_times(module: str):
+    """Import the module in a fresh interpreter and return its -X importtime lines."""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               capture_output=True, text=True, check=True)
+    times = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), name.strip()))
+    return times
+
+
+def _import_time(module: str, runs: int):
+    """Median cumulative import time of the module, in microseconds."""
+    return median(next(x for x, name in reversed(_import_times(module)) if name == module) for _ in range(runs))
+
+
+def main(runs=5):
+    print(f'{"module":<10} {"import ms":>10}')
+    for module in _MODULES:
+        print(f'{module:<10} {_import_time(module, runs) / 1000:10.1f}')
+
+    print('\nslowest imports of main.py with a batch command')
+    times = _import_times('batch')
+    for cumulative, name in sorted(times, reverse=True)[1:9]:
+        print(f'  {name:<30} {cumulative / 1000:8.1f} ms')
+
+    folder = tempfile.mkdtemp()
+    name = os.path.join(folder, 'bench_startup.db')
+    print(f'\n{"command":<24} {"median ms":>10}')
+    for command in _COMMANDS:
+        elapsed = []
+        for x in range(runs):
+            arguments = command + [str(x)] if command[0] == 'add-habit' else command
+            began = time.perf_counter()
+            subprocess.run([sys.executable, 'main.py', '--database', name] + arguments,
+                           capture_output=True, check=False)
+            elapsed.append(time.perf_counter() - began)
+        print(f'{" ".join(command):<24} {median(elapsed) * 1000:10.1f}')
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(name + suffix):
+            os.remove(name + suffix)
+    os.rmdir(folder)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
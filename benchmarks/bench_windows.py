@@ -0,0 +1,63 @@
+"""Compare analytics over the whole history of habits with windowed analytics.
+
+Run from the project folder: python -m benchmarks.bench_windows [habits] [events per habit]
+
+Windows are the last 30, 90 and 365 days before the newest event of every
+habit. Compliance is
+timed with the monthly rollups and with the events of the window only.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import analyse
+import db
+from benchmarks.generators import populate
+from storage import SQLiteBackend
+
+
+class _WithoutRollups(SQLiteBackend):
+    """The sqlite3 storage, with compliance computed from the window events."""
+
+    get_rollups = None
+
+
+def _time(label: str, newest, function):
+    """Print the mean time of calling the function with every habit name and newest event day."""
+    began = time.perf_counter()
+    for name, day in newest:
+        function(name, day)
+    seconds = (time.perf_counter() - began) / len(newest)
+    print(f'{label:<40} {seconds * 1e6:10.1f}us')
+
+
+def main(habits=50, events=3650):
+    folder = tempfile.mkdtemp()
+    name = os.path.join(folder, 'bench_windows.db')
+    try:
+        populate(name, habits, events)
+        db.create_data_storage(name)
+        newest = [(x, date.fromisoformat(y[:10])) for x, y in
+                  db._execute_read(f'SELECT name, max(event_date) FROM {db._NAMED_EVENTS} GROUP BY name')]
+        print(f'{habits} habits x {events} events\n')
+
+        backend, without_rollups = SQLiteBackend(), _WithoutRollups()
+        _time('whole history: _get_habit_streak', newest, lambda x, day: analyse._get_habit_streak(x))
+        _time('whole history: compliance_rate', newest, lambda x, day: analyse.compliance_rate(x, until=day))
+        for days in (30, 90, 365):
+            _time(f'{days} days: calculate_counter', newest,
+                  lambda x, day: analyse.calculate_counter(x, backend, day - timedelta(days=days - 1), day))
+            _time(f'{days} days: compliance_rate', newest,
+                  lambda x, day: analyse.compliance_rate(x, day - timedelta(days=days - 1), day, backend))
+            _time(f'{days} days: compliance_rate without rollups', newest,
+                  lambda x, day: analyse.compliance_rate(x, day - timedelta(days=days - 1), day, without_rollups))
+        db.close_data_storage()
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
@@ -0,0 +1,80 @@
+"""Deterministic synthetic habits and events for the benchmarks.
+
+The same seed always produces the same habits and events, so results of
+different commits are measured against identical data.
+"""
+import random
+import sqlite3
+import uuid
+from datetime import datetime, timedelta
+
+import db
+from migrations import migrate
+from parsing import event_time_columns
+
+START = datetime(2020, 1, 1)
+_PERIODICITIES = ['Daily', 'Weekly']
+_CUT_OFF_STYLES = ['IGNORE', 'ON', 'BEFORE', 'AFTER']
+
+
+def generate_habits(count: int, seed=0):
+    """Generate habits with mixed periodicities and cut off styles.
+
+    :params: count: number of habits
+    :params: seed: seed of the random generator
+    :return: generator of db.Habit namedtuples, all ACTIVE
+    """
+    generator = random.Random(seed)
+    for x in range(count):
+        start = START + timedelta(days=generator.randint(0, 30), hours=generator.randint(5, 9))
+        cut_off_style = generator.choice(_CUT_OFF_STYLES)
+        cut_off_time = f'{generator.randint(6, 20):02}:00:00' if cut_off_style != 'IGNORE' else '00:00:00'
+        yield db.Habit(f'HABIT {x:06}', f'synthetic habit {x}', start.strftime("%Y-%m-%d %H:%M:%S"),
+                       start.strftime("%Y-%m-%d %H:%M:%S"), generator.choice(_PERIODICITIES), cut_off_style,
+                       cut_off_time, 'ACTIVE')
+
+
+def generate_events(habit, count: int, seed=0):
+    """Generate events of a habit, mostly one period apart with random gaps.
+
+    :params: habit: db.Habit the events belong to
+    :params: count: number of events
+    :params: seed: seed of the random generator, combined with the habit name
+    :return: generator of valid event dates - YYYY-MM-DD hh:mm:ss, oldest first
+    """
+    generator = random.Random(f'{seed}:{habit.name}')
+    period = 7 if habit.periodicity == 'Weekly' else 1
+    day = datetime.fromisoformat(habit.start_date).replace(hour=0, minute=0, second=0)
+    cut_off = int(habit.cut_off_time[:2]) * 3600
+    for _ in range(count):
+        # one event in ten breaks the streak by skipping a period
+        day += timedelta(days=period * (2 if generator.random() < 0.1 else 1))
+        if habit.cut_off_style == 'ON' and generator.random() < 0.8:
+            seconds = cut_off
+        else:
+            seconds = generator.randint(0, 86399)
+        yield (day + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def populate(name: str, habits: int, events: int, seed=0):
+    """Create a database at the latest schema version filled with synthetic data.
+
+    :params: name: database file name, it must not exist yet
+    :params: habits: number of habits
+    :params: events: number of events per habit
+    :params: seed: seed of the random generators
+    :return: list of the db.Habit namedtuples created
+    """
+    created = list(generate_habits(habits, seed))
+    with sqlite3.connect(name) as conn:
+        migrate(conn)
+        conn.executemany(f'INSERT INTO habits ({db._HABIT_COLUMNS}) VALUES(?, ?, ?, ?, ?, ?, ?, ?)', created)
+        for habit in created:
+            ids = random.Random(f'{seed}:{habit.name}:ids')
+            habit_id = conn.execute('SELECT habit_id FROM habits WHERE name=?', (habit.name,)).fetchone()[0]
+            conn.executemany('INSERT INTO events (event_id, habit_id, event_date, event_epoch, event_day) '
+                             'VALUES(?, ?, ?, ?, ?)',
+                             ((str(uuid.UUID(int=ids.getrandbits(128))), habit_id, x) + event_time_columns(x)
+                              for x in generate_events(habit, events, seed)))
+    conn.close()
+    return created
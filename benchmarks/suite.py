@@ -0,0 +1,217 @@
+"""Benchmark the main operations against deterministic synthetic data.
+
+Run from the project folder:
+
+    python -m benchmarks.suite --habits 1000 --events 100 --output baseline.json
+    python -m benchmarks.suite --habits 1000 --events 100 --compare baseline.json
+
+Every case reports its throughput, latency percentiles and the peak memory
+traced while it runs. --output writes the results as a JSON baseline and
+--compare exits with 1 when a case got slower than the threshold allows.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from statistics import quantiles
+
+import analyse
+import db
+from benchmarks.generators import populate
+
+
+def _save_event(habits, ops: int, seed: int):
+    """Append events newer than every stored one, spread over the habits."""
+    generator = random.Random(seed)
+    chosen = [generator.choice(habits).name for _ in range(ops)]
+    day = datetime(2100, 1, 1, 7, 0, 0)
+    return [lambda x=x, name=name: db.save_event(name, (day + timedelta(days=x)).strftime("%Y-%m-%d %H:%M:%S"))
+            for x, name in enumerate(chosen)]
+
+
+def _get_events(habits, ops: int, seed: int):
+    generator = random.Random(seed)
+    return [lambda name=generator.choice(habits).name: db.get_events(name) for _ in range(ops)]
+
+
+def _get_habit_streak(habits, ops: int, seed: int):
+    generator = random.Random(seed)
+    return [lambda name=generator.choice(habits).name: analyse._get_habit_streak(name) for _ in range(ops)]
+
+
+def _calculate_all_counters(habits, ops: int, seed: int):
+    return [analyse.calculate_all_counters] * ops
+
+
+def _habit_with_longest_streak(habits, ops: int, seed: int):
+    return [analyse.habit_with_longest_streak] * ops
+
+
+def _update_habit(habits, ops: int, seed: int):
+    """Alternate updates that keep and that invalidate the stored streaks."""
+    generator = random.Random(seed)
+    calls = []
+    for x in range(ops):
+        name = generator.choice(habits).name
+        if x % 2:
+            calls.append(lambda name=name, x=x: db.update_habit(name, cut_off_time=f'{x % 12 + 6:02}:00:00'))
+        else:
+            calls.append(lambda name=name, x=x: db.update_habit(name, description=f'updated {x}'))
+    return calls
+
+
+# name: (calls builder, True if every call covers the whole dataset). Reads run
+# before the writes so they all see the generated data.
+CASES = {
+    'get_events': (_get_events, False),
+    '_get_habit_streak': (_get_habit_streak, False),
+    'calculate_all_counters': (_calculate_all_counters, True),
+    'habit_with_longest_streak': (_habit_with_longest_streak, True),
+    'save_event': (_save_event, False),
+    'update_habit': (_update_habit, False),
+}
+
+
+def _summary(latencies):
+    """Throughput and latency percentiles of the calls."""
+    cuts = quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {'ops': len(latencies), 'throughput': len(latencies) / sum(latencies),
+            'p50_ms': cuts[49] * 1000, 'p90_ms': cuts[89] * 1000, 'p99_ms': cuts[98] * 1000}
+
+
+def _run_case(name: str, habits, ops: int, repeats: int, seed: int):
+    """Time every call of the case, then trace the peak memory of a few of them."""
+    build, whole_dataset = CASES[name]
+    calls = build(habits, repeats if whole_dataset else ops, seed)
+    latencies = []
+    for call in calls:
+        began = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - began)
+    result = _summary(latencies)
+
+    traced = build(habits, 1 if whole_dataset else min(ops, 20), seed + 1)
+    tracemalloc.start()
+    for call in traced:
+        call()
+    result['peak_mib'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return result
+
+
+def _commit():
+    """Commit the benchmark ran against, empty outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run(habits=1000, events=100, ops=200, repeats=3, seed=0, cases=None):
+    """Run the benchmark cases against a freshly generated database.
+
+    :params: habits: number of synthetic habits
+    :params: events: number of synthetic events per habit
+    :params: ops: number of calls of the per habit cases
+    :params: repeats: number of calls of the whole dataset cases
+    :params: seed: seed of the data generators and of the call order
+    :params: cases: names of the cases to run, all of them when omitted
+    :return: dictionary of the run settings and of the results per case
+    """
+    folder = tempfile.mkdtemp()
+    name = os.path.join(folder, 'bench_suite.db')
+    began = time.perf_counter()
+    created = populate(name, habits, events, seed)
+    generated = time.perf_counter() - began
+    db.create_data_storage(name)
+
+    results = {}
+    try:
+        for case in CASES:
+            if cases is None or case in cases:
+                results[case] = _run_case(case, created, ops, repeats, seed)
+                _print_result(case, results[case])
+    finally:
+        db.close_data_storage()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(name + suffix):
+                os.remove(name + suffix)
+        os.rmdir(folder)
+
+    meta = {'habits': habits, 'events': events, 'ops': ops, 'repeats': repeats, 'seed': seed,
+            'commit': _commit(), 'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+            'streak_engine': analyse.get_streak_engine(), 'generate_s': generated}
+    return {'meta': meta, 'results': results}
+
+
+def _print_result(case: str, result):
+    print(f'{case:<28} {result["throughput"]:12.1f}/s {result["p50_ms"]:10.3f} {result["p90_ms"]:10.3f} '
+          f'{result["p99_ms"]:10.3f} {result["peak_mib"]:9.2f}')
+
+
+def compare(baseline, current, threshold=0.2):
+    """Print the change of every case against the baseline.
+
+    :params: baseline: results of an earlier run, as returned by run
+    :params: current: results of this run
+    :params: threshold: relative increase of the median latency counted as a
+        regression
+    :return: list of the names of the cases that regressed
+    """
+    regressions = []
+    print(f'\n{"case":<28} {"p50 before":>12} {"p50 now":>12} {"change":>8}')
+    for case, result in current['results'].items():
+        before = baseline['results'].get(case)
+        if before is None:
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(case)
+            flag = '  REGRESSION'
+        print(f'{case:<28} {before["p50_ms"]:12.3f} {result["p50_ms"]:12.3f} {change:+8.1%}{flag}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description=__doc__.splitlines()[0])
+    parser.add_argument('--habits', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=100, help='events per habit')
+    parser.add_argument('--ops', type=int, default=200, help='calls of the per habit cases')
+    parser.add_argument('--repeats', type=int, default=3, help='calls of the whole dataset cases')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--case', action='append', choices=list(CASES), help='run only this case, repeatable')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON baseline to compare the results with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed p50 increase, 0.2 is 20%%')
+    arguments = parser.parse_args(argv)
+
+    baseline = None
+    if arguments.compare:
+        with open(arguments.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+
+    print(f'{arguments.habits} habits x {arguments.events} events, seed {arguments.seed}')
+    print(f'{"case":<28} {"throughput":>14} {"p50 ms":>10} {"p90 ms":>10} {"p99 ms":>10} {"peak MiB":>9}')
+    current = run(arguments.habits, arguments.events, arguments.ops, arguments.repeats, arguments.seed,
+                  arguments.case)
+
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as file:
+            json.dump(current, file, indent=2)
+    if baseline is not None:
+        return 1 if compare(baseline, current, arguments.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
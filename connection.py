@@ -0,0 +1,164 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from queue import LifoQueue, Empty, Full
+
+import instrumentation
+
+# PRAGMA settings applied to every connection of a storage profile. durable
+# keeps full fsyncs, balanced only syncs at WAL checkpoints and ingest leaves
+# flushing to the operating system for the fastest bulk loads.
+PROFILES = {
+    'durable': {'journal_mode': 'WAL', 'synchronous': 'FULL', 'cache_size': -2000,
+                'mmap_size': 0, 'temp_store': 'DEFAULT'},
+    'balanced': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -16000,
+                 'mmap_size': 64 * 1024 * 1024, 'temp_store': 'MEMORY'},
+    'ingest': {'journal_mode': 'WAL', 'synchronous': 'OFF', 'cache_size': -64000,
+               'mmap_size': 256 * 1024 * 1024, 'temp_store': 'MEMORY'},
+}
+
+
+class ConnectionPool:
+    """Long-lived sqlite3 connections shared by all the db functions.
+
+    Writes go through a single writer connection guarded by a lock, reads
+    borrow one of up to pool_size reader connections so they never queue
+    behind each other.
+    """
+
+    def __init__(self, name: str, pool_size=5, timeout=5.0, profile=None):
+        """Initialize the connection pool.
+
+        :params: name: database file name the connections are opened against
+        :params: pool_size: maximum number of idle reader connections kept open
+        :params: timeout: seconds a connection waits on a locked database
+        :params: profile: optional storage profile - durable/balanced/ingest.
+            SQLite defaults are kept when omitted
+        """
+        if profile is not None and profile not in PROFILES:
+            raise ValueError(f'Allowed storage profiles are {"/".join(PROFILES)} NOT [{profile}]')
+        self.name = name
+        self.profile = profile
+        self.pool_size = max(int(pool_size), 1)
+        self.timeout = timeout
+        self._readers = LifoQueue(maxsize=self.pool_size)
+        self._writer = None
+        self._write_lock = threading.RLock()
+        # nesting level of the writer transaction and the thread holding it
+        self._depth = 0
+        self._owner = None
+        self._closed = False
+        # every connection of an in-memory database is a separate database,
+        # so reads have to share the writer connection
+        self._shared = name == ':memory:' or name == ''
+
+    @instrumentation.timed('connect', 'sqlite3.connect')
+    def _connect(self):
+        """Open a new connection to the pool database."""
+        if self._closed:
+            raise sqlite3.ProgrammingError(f'Connection pool for {self.name} is closed')
+        conn = sqlite3.connect(self.name, timeout=self.timeout,
+                               check_same_thread=False)
+        if self.profile is not None:
+            settings = PROFILES[self.profile]
+            for pragma in ('synchronous', 'cache_size', 'mmap_size', 'temp_store'):
+                conn.execute(f'PRAGMA {pragma} = {settings[pragma]}')
+        return conn
+
+    def _get_writer(self):
+        """Return the writer connection, opening it on first use."""
+        if self._writer is None:
+            self._writer = self._connect()
+            if self.profile is not None:
+                # the journal mode is stored in the database file itself
+                self._writer.execute(f'PRAGMA journal_mode = {PROFILES[self.profile]["journal_mode"]}')
+        return self._writer
+
+    @contextmanager
+    def writer(self):
+        """Lend the writer connection inside a transaction.
+
+        The outermost block commits once when it ends. Blocks nested in it,
+        on the same thread, run inside savepoints so an error only undoes
+        their own changes.
+
+        :return: yields the writer connection; changes are rolled back if the
+            block raises
+        """
+        with self._write_lock:
+            conn = self._get_writer()
+            depth = self._depth
+            if depth == 0:
+                if conn.in_transaction:
+                    conn.commit()
+                conn.execute('BEGIN')
+                self._owner = threading.get_ident()
+            else:
+                conn.execute(f'SAVEPOINT level_{depth}')
+            self._depth += 1
+            try:
+                yield conn
+            except BaseException:
+                if depth == 0:
+                    conn.rollback()
+                else:
+                    conn.execute(f'ROLLBACK TO level_{depth}')
+                    conn.execute(f'RELEASE level_{depth}')
+                raise
+            else:
+                if depth == 0:
+                    conn.commit()
+                else:
+                    conn.execute(f'RELEASE level_{depth}')
+            finally:
+                self._depth -= 1
+                if depth == 0:
+                    self._owner = None
+
+    @contextmanager
+    def reader(self):
+        """Lend a reader connection and give it back to the pool afterwards.
+
+        Inside a writer block of the same thread the writer connection is lent
+        instead, so the reads see the uncommitted changes of the transaction.
+
+        :return: yields a connection to be used for SELECT statements only
+        """
+        if self._shared or self._owner == threading.get_ident():
+            with self._write_lock:
+                yield self._get_writer()
+            return
+
+        try:
+            conn = self._readers.get_nowait()
+        except Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._release(conn)
+
+    def _release(self, conn):
+        """Return a reader connection to the pool or close it if full."""
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._readers.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    def close(self):
+        """Close every connection held by the pool."""
+        self._closed = True
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except Empty:
+                break
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
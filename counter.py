@@ -1,5 +1,4 @@
-from db import (save_habit, save_event, get_habit, get_events, get_event, get_events_by_name_event_date, delete_event,
-                delete_events, delete_habit, update_habit, update_event)
+from storage import get_backend
 from analyse import calculate_counter
 
 
@@ -8,7 +7,7 @@ class Counter:
 
     def __init__(self, name: str, description="", start_date="",
                  periodicity="Daily", cut_off_style="IGNORE",
-                 cut_off_time="00:00:00", habit_status="ACTIVE"):
+                 cut_off_time="00:00:00", habit_status="ACTIVE", backend=None):
         """Initialize the counter class.
 
         :params: name: is the name of the habit
@@ -24,6 +23,8 @@ class Counter:
             omitted 00:00:00 is assumed.
         :params: habit_status: is the status of the habit. Values include
                 ACTIVE/COMPLETED. Only ACTIVE habits are analyzed.
+        :params: backend: storage backend of the habit. When omitted, the
+                backend selected for the process is used
         """
         self.name = name.upper()
         self.description = description
@@ -33,12 +34,17 @@ class Counter:
         self.cut_off_time = cut_off_time
         self.habit_status = habit_status
 
+        self.backend = backend
         self.streak = 0
         self.highest_streak = 0
 
+    def _storage(self):
+        """Return the storage backend of the habit."""
+        return self.backend or get_backend()
+
     def calculate_streak(self):
         """Assign the calculated streak count and the highest streak."""
-        res = calculate_counter(self.name)
+        res = calculate_counter(self.name, self.backend)
         if isinstance(res, str):
             return res
         else:
@@ -66,15 +72,15 @@ class Counter:
 
     def add_habit(self):
         """Save a new habit to the sqlite3 database."""
-        res = save_habit(self.name, self.description, self.start_date,
-                         self.periodicity, self.cut_off_style,
-                         self.cut_off_time, self.habit_status)
+        res = self._storage().save_habit(self.name, self.description, self.start_date,
+                                         self.periodicity, self.cut_off_style,
+                                         self.cut_off_time, self.habit_status)
         return res
 
     def update_my_habit(self, description='', start_date='', periodicity='', cut_off_style='', cut_off_time=''):
         """Update a habit in the sqlite3 database."""
 
-        res = update_habit(self.name, description, start_date, periodicity, cut_off_style, cut_off_time)
+        res = self._storage().update_habit(self.name, description, start_date, periodicity, cut_off_style, cut_off_time)
         if 'SUCCESS' in res:
             self.reset()
             return f'SUCCESS: Habit {self.name} changes have been saved!'
@@ -83,27 +89,28 @@ class Counter:
 
     def _get_habit(self, name: str):
         """Get a habit from the sqlite3 database."""
-        return get_habit(name)
+        return self._storage().get_habit(name)
 
     def stop_my_habit(self):
         """Deactivate the current habit."""
-        res = update_habit(self.name, '', '', '',
-                           '', '','COMPLETED')
+        res = self._storage().update_habit(self.name, '', '', '',
+                                           '', '', 'COMPLETED')
         if 'SUCCESS' in res:
             self.habit_status = 'COMPLETED'
 
     def delete_my_habit_plus_events(self):
-        """Delete the current habit plus all associated habit events."""
-
-        get_events_if_exist = self.get_events()
-        if isinstance(get_events_if_exist, list):
-            res = self.delete_habit_events()
-            if 'ERROR' in res:
-                return res
+        """Delete the current habit plus all associated habit events in one transaction."""
+
+        with self._storage().transaction():
+            get_events_if_exist = self.get_events()
+            if isinstance(get_events_if_exist, list):
+                res = self.delete_habit_events()
+                if 'ERROR' in res:
+                    return res
+                else:
+                    return self._storage().delete_habit(self.name)
             else:
-                return delete_habit(self.name)
-        else:
-            return delete_habit(self.name)
+                return self._storage().delete_habit(self.name)
 
     def add_event(self, event_date: str = ''):
         """
@@ -112,12 +119,24 @@ class Counter:
         :params: event_date: the date and time the event was performed. Current
                 system date is assumed if this parameter is omitted
         """
-        res = save_event(self.name, event_date)
+        res = self._storage().save_event(self.name, event_date)
         return res
 
+    def add_events(self, event_dates, on_result=None):
+        """
+        Save many events carried out for the habit in a single transaction.
+
+        :params: event_dates: iterable of dates and times the events were
+                performed. A generator is consumed in chunks
+        :params: on_result: optional callable receiving (position, message)
+                for every event instead of collecting the messages
+        :return: list with a message per event or a summary message
+        """
+        return self._storage().save_events_bulk(((self.name, x) for x in event_dates), on_result=on_result)
+
     def get_events(self):
         """Retrieve all events for the current habit."""
-        return get_events(self.name)
+        return self._storage().get_events(self.name)
 
     def get_event_by_event_id(self, event_id: str):
         """Retrieve all events for the current habit matching the given date
@@ -125,7 +144,7 @@ class Counter:
         :Params: event_id:id of habit event as a string
         :return: Returns a list of event(s) matching the event_id
         """
-        return get_event(event_id)
+        return self._storage().get_event(event_id)
 
     def get_event(self, event_date: str):
         """Retrieve all events for the current habit matching the given date
@@ -133,7 +152,7 @@ class Counter:
         :Params: event_date:date event occurred as a string
         :return: Returns a list of event(s) matching the habit name and event date
         """
-        return get_events_by_name_event_date(self.name, event_date)
+        return self._storage().get_events_by_name_event_date(self.name, event_date)
 
     def update_my_event(self, event_id: str, habit_name='', event_date=''):
         """Update an event for the current habit.
@@ -142,7 +161,7 @@ class Counter:
         :params: habit_name: name of the event habit
         :params: event_date: date when event occurred
         """
-        return update_event(event_id, habit_name, event_date)
+        return self._storage().update_event(event_id, habit_name, event_date)
 
     def delete_my_event(self, event_id: str):
         """Delete an event for the current habit.
@@ -150,9 +169,9 @@ class Counter:
         :params: event_id: unique uuid string identifying the event to be deleted
         :return: status of the deleted event or error encountered
         """
-        return delete_event(event_id)
+        return self._storage().delete_event(event_id)
 
     def delete_habit_events(self):
         """Delete all events for the current habit."""
 
-        return delete_events(self.name)
+        return self._storage().delete_events(self.name)
@@ -2,22 +2,86 @@ import sqlite3
 from datetime import datetime, timedelta
 from collections import namedtuple
 import uuid
+import atexit
+from pathlib import Path
+from contextlib import contextmanager
+from itertools import islice, groupby, chain
+from operator import itemgetter
+from connection import ConnectionPool, PROFILES
+from migrations import migrate, get_schema_version, SCHEMA_VERSION
+from streaks import advance_streak, cut_off_seconds
+import instrumentation
+from parsing import (convert_time_to_24hrs_format, event_date_range, event_time_columns, normalize_datetime,
+                     normalize_time, parse_datetime)
+from validation import STREAK_COLUMNS, validate_habit
 db_name = ''
-
-
-def create_data_storage(name="main.db"):
+_pool = None
+# events refer to their habit by habit_id, the name is joined from habits
+_EVENT_COLUMNS = 'event_id, name, event_date'
+_NAMED_EVENTS = 'events JOIN habits USING (habit_id)'
+_HABIT_ID = '(SELECT habit_id FROM habits WHERE name=?)'
+_HABIT_COLUMNS = 'name, description, entry_date, start_date, periodicity, cut_off_style, cut_off_time, habit_status'
+# SQLITE_MAX_VARIABLE_NUMBER of the builds before 3.32, newer ones allow more
+_MAX_VARIABLES = 999
+
+Habit = namedtuple("Habit", ['name', 'description', 'entry_date',
+                             'start_date', 'periodicity',
+                             'cut_off_style',
+                             'cut_off_time',
+                             'habit_status'])
+Event = namedtuple("Event", ['event_id', 'habit_name', 'event_date'])
+# events loaded for analysis also carry their integer date columns
+TimedEvent = namedtuple("TimedEvent", ['event_id', 'habit_name', 'event_date', 'event_day', 'event_epoch'])
+_INVALIDATE_STREAK = f'DELETE FROM streaks WHERE habit_id={_HABIT_ID}'
+
+
+def create_data_storage(name="main.db", pool_size=5, profile=None):
     """Create the sqlite3 database and tables if not existing yet.
 
     :params: name: database name to be used for the application
+    :params: pool_size: maximum number of reader connections kept open
+    :params: profile: optional storage profile - durable, balanced or ingest.
+        They all switch to WAL journaling so readers never block the writer
+        and trade fsyncs for write throughput in that order. SQLite defaults
+        are kept when omitted
     :return: message showing if database and tables were successfully created
     """
-    global db_name
+    global db_name, _pool
+    if profile is not None and profile not in PROFILES:
+        return f'ERROR: Allowed storage profiles are {"/".join(PROFILES)} NOT [{profile}]'
+    close_data_storage()
     db_name = name
+    _pool = ConnectionPool(name, pool_size, profile=profile)
     return _create_tables()
 
 
+def close_data_storage():
+    """Close all the connections held open for the current database."""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+atexit.register(close_data_storage)
+
+
+def get_database_name():
+    """Return the name of the database currently used by the application."""
+    return db_name
+
+
+def _get_pool():
+    """Return the connection pool of the current database, opening it if needed."""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(db_name)
+    return _pool
+
+
+@instrumentation.timed('query', instrumentation.query_label)
 def _execute_query(sql_query: str, parameters=()):
-    """Execute all other queries.
+    """Execute all other queries on the writer connection and commit them.
 
     :params: sql_query: sql query string to be executed
     :params: parameters: set of parameters needed by the sql query. if just one
@@ -25,72 +89,122 @@ def _execute_query(sql_query: str, parameters=()):
     :result: cursor for the connection is returned
     """
     try:
-        with sqlite3.connect(db_name) as conn:
+        with _get_pool().writer() as conn:
             cursor = conn.cursor()
             cursor.execute(sql_query, parameters)
-            conn.commit()
         return cursor
     except Exception as ex:
         return ex.args
 
 
-def _format_query_single_result(cursor):
+@instrumentation.timed('query', instrumentation.queries_label)
+def _execute_queries(queries):
+    """Execute several queries on the writer connection in one transaction.
+
+    :params: queries: list of (sql_query, parameters) pairs
+    :result: cursor of the last query or the error encountered
+    """
+    try:
+        with _get_pool().writer() as conn:
+            cursor = conn.cursor()
+            for sql_query, parameters in queries:
+                cursor.execute(sql_query, parameters)
+        return cursor
+    except Exception as ex:
+        return ex.args
+
+
+@contextmanager
+def transaction():
+    """Group every query of the block into a single transaction.
+
+    The changes are committed once when the outermost block ends and rolled
+    back if it raises. Nested blocks become savepoints, and reads inside the
+    block see its uncommitted changes. Other threads cannot write meanwhile.
+
+    :return: yields the connection the transaction runs on
+    """
+    with _get_pool().writer() as conn:
+        yield conn
+
+
+def _record_factory(record):
+    """Build a sqlite3 row factory returning rows as the given namedtuple type.
+
+    :params: record: namedtuple class the rows are turned into
+    :return: row factory to be set on a cursor
+    """
+    make = record._make
+    return lambda cursor, row: make(row)
+
+
+_HABIT_ROW = _record_factory(Habit)
+_EVENT_ROW = _record_factory(Event)
+
+
+@instrumentation.timed('read', instrumentation.query_label)
+def _execute_read(sql_query: str, parameters=(), row_factory=None):
+    """Execute a SELECT query on a pooled reader connection.
+
+    :params: sql_query: sql query string to be executed
+    :params: parameters: set of parameters needed by the sql query. if just one
+        parameter, add a trailing comma eg(one_parameter,)
+    :params: row_factory: optional sqlite3 row factory building the rows
+    :result: list of the rows found or the error encountered as a tuple
+    """
+    try:
+        with _get_pool().reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = row_factory
+            return cursor.execute(sql_query, parameters).fetchall()
+    except Exception as ex:
+        return ex.args
+
+
+def _format_query_single_result(rows):
     """Return single item from query.
 
-    :params: cursor: cursor from the sql connection.
+    :params: rows: rows returned by _execute_read.
     :return: returns single item found or error message if not found
     """
-    result = cursor.fetchone()
-    if result:
-        return result
+    if isinstance(rows, tuple):
+        return f"ERROR: {rows}"
+    if rows:
+        return rows[0]
     else:
         return "ERROR: Requested item NOT found!"
 
 
-def _format_query_results(cursor):
+def _format_query_results(rows):
     """Return multiple items from query.
 
-    :params: cursor: cursor from the sql connection.
+    :params: rows: rows returned by _execute_read.
     :return: returns list of multiple items found or error message if not found
     """
-    result = cursor.fetchall()
-    # print('Count of items: ' + len(result).__str__())
-    if result:
-        formatted_results = []
-        for row in result:
-            # formatted_results.append(", ".join([str(i) for i in row]))
-            formatted_results.append(row)
-        return formatted_results
+    if isinstance(rows, tuple):
+        return f"ERROR: {rows}"
+    if rows:
+        return rows
     else:
         return 'ERROR: Requested item(s) NOT found!'
 
 
 def _create_tables():
-    """Create the tables - habits and events, used by the counter app.
-
-    :return: returns status report of the table creation
-    """
-    query_habit = """CREATE TABLE IF NOT EXISTS habits (
-            name TEXT NOT NULL PRIMARY KEY,
-            description TEXT,
-            entry_date TEXT,
-            start_date TEXT,
-            periodicity TEXT,
-            cut_off_style TEXT,
-            cut_off_time TEXT,
-            habit_status TEXT
-            )
-            """
-    result_habit = _execute_query(query_habit)
-    query_events = """CREATE TABLE IF NOT EXISTS events (
-            event_id   TEXT NOT NULL PRIMARY KEY,
-            habit_name TEXT,
-            event_date TEXT,
-            FOREIGN KEY (habit_name) REFERENCES habits (name)
-            )
-            """
-    result_events = _execute_query(query_events)
-    return f"Habit Table Status: {result_habit}, Counter Table Status: {result_events}"
+    """Create or upgrade the tables - habits and events, used by the counter app.
+
+    :return: returns status report of the schema migration
+    """
+    try:
+        # an up to date database is only read, so opening it takes no write lock
+        with _get_pool().reader() as conn:
+            current = get_schema_version(conn) == SCHEMA_VERSION
+        applied = []
+        if not current:
+            with _get_pool().writer() as conn:
+                applied = migrate(conn)
+        return f"Schema Version: {SCHEMA_VERSION}, Migrations Applied: {applied}"
+    except Exception as ex:
+        return ex.args
 
 
 def _convert_time_to_24hrs_format(value: str):
@@ -99,19 +213,7 @@ def _convert_time_to_24hrs_format(value: str):
     :params: value: datetime value. Input format is YYYY-MM-DD hh:mm:ss AM
     :return: returns datetime string value in equivalent 24hrs format
     """
-    value = value.lower()
-    pm_add_twelve_hours = 0
-
-    if 'pm' in value:
-        pm_add_twelve_hours = 12
-        value = value.replace("pm", "")
-    elif 'am' in value:
-        value = value.replace("am", "")
-
-    value = value.rstrip()
-    value = value.lstrip()
-
-    return value, pm_add_twelve_hours
+    return convert_time_to_24hrs_format(value)
 
 
 def _is_valid_datetime(value: str):
@@ -120,17 +222,7 @@ def _is_valid_datetime(value: str):
     :params: value: datetime value. Input format is YYYY-MM-DD hh:mm:ss AM
     :return: returns valid datetime string - YYYY-MM-DD hh:mm:ss or the error
     """
-    value, patch_to_24hrs = _convert_time_to_24hrs_format(value)
-
-    try:
-        check_date = datetime.fromisoformat(value)
-        valid_datetime = datetime(check_date.year, check_date.month,
-                                  check_date.day,
-                                  check_date.hour + patch_to_24hrs,
-                                  check_date.minute, check_date.second)
-        return valid_datetime.strftime("%Y-%m-%d %H:%M:%S")
-    except Exception as ex:
-        return f"ERROR: {ex.args}. Sample Date is 2024-01-31 05:19:03 AM"
+    return normalize_datetime(value)
 
 
 def _is_valid_time(value: str):
@@ -139,76 +231,7 @@ def _is_valid_time(value: str):
     :params: value: time value. Input format is hh:mm:ss A
     :return: returns valid time string - hh:mm:ss or the error message
     """
-    value, patch_to_24hrs = _convert_time_to_24hrs_format(value)
-
-    try:
-        check_time = datetime.fromisoformat("1111-01-01 " + value)
-        valid_time = datetime(check_time.year, check_time.month,
-                              check_time.day,
-                              check_time.hour + patch_to_24hrs,
-                              check_time.minute, check_time.second)
-        return valid_time.strftime("%H:%M:%S")
-    except Exception as ex:
-        return f"ERROR: {ex.args}. Sample Time is 05:19:03 AM"
-
-
-def _validate_habit(name: str, description="", start_date="", periodicity="",
-                    cut_off_style="", cut_off_time="", habit_status=""):
-    """Validate the fields for a habit.
-
-    :params: name: is the name of the habit
-    :params: description: is the description of the habit
-    :params: start_date: is the datetime the app starts analyzing events for
-                        the habit.
-    :params: periodicity: is the expected frequency for the habit - Daily
-                        or Weekly.
-    :params: cut_off_style: this shows if the time the habit is undertaken
-        is significant. Values include IGNORE/ON/BEFORE/AFTER.
-    :params: cut_off_time: is the threshold time for the habit.
-    :params: habit_status: is the status of the habit. Values include
-            ACTIVE/COMPLETED.
-    :return: returns a habit with a list of all its valid properties -
-        [name, description, start_date, periodicity, cut_off_style,
-        cut_off_time, habit_status] or an error stating any invalid property
-        value encountered
-    """
-    if not name:
-        return 'ERROR: habit name is required'
-    else:
-        name = name.upper()
-
-    if start_date:
-        result = _is_valid_datetime(start_date)
-        if 'ERROR' in result:
-            return result
-        else:
-            start_date = result
-
-    if periodicity:
-        periodicity = periodicity.capitalize()
-        if not (periodicity == 'Daily' or periodicity == 'Weekly'):
-            return f'ERROR: Allowed periodicity are Daily or Weekly NOT [{periodicity}]'
-
-    if cut_off_style:
-        cut_off_style = cut_off_style.upper()
-        if not (cut_off_style == 'IGNORE' or cut_off_style == 'ON' or
-                cut_off_style == 'BEFORE' or cut_off_style == 'AFTER'):
-            return f'ERROR: Allowed cut_off_style are IGNORE/ON/BEFORE/AFTER not [{cut_off_style}]'
-
-    if cut_off_time:
-        result = _is_valid_time(cut_off_time)
-        if 'ERROR' in result:
-            return result
-        else:
-            cut_off_time = result
-
-    if habit_status:
-        habit_status = habit_status.upper()
-        if not (habit_status == 'ACTIVE' or habit_status == 'COMPLETED'):
-            return f'ERROR:Allowed habit_status are ACTIVE/COMPLETED not [{habit_status}]'
-
-    return [name, description, start_date, periodicity, cut_off_style,
-            cut_off_time, habit_status]
+    return normalize_time(value)
 
 
 def save_habit(name: str, description: str, start_date="", periodicity="Daily",
@@ -231,7 +254,7 @@ def save_habit(name: str, description: str, start_date="", periodicity="Daily",
             ACTIVE/COMPLETED. Only ACTIVE habits are analyzed.
     :result: A message indicating the success or error encountered is returned
     """
-    result = _validate_habit(name, description, start_date, periodicity,
+    result = validate_habit(name, description, start_date, periodicity,
                              cut_off_style, cut_off_time, habit_status)
     if isinstance(result, str):
         return result
@@ -244,12 +267,15 @@ def save_habit(name: str, description: str, start_date="", periodicity="Daily",
 
         entry_date = current_date
         try:
-            query = 'INSERT INTO habits VALUES(?, ?, ?, ?, ?, ?, ?, ?)'
+            query = f'INSERT INTO habits ({_HABIT_COLUMNS}) VALUES(?, ?, ?, ?, ?, ?, ?, ?)'
             parameters = (name, description, entry_date, start_date,
                           periodicity, cut_off_style, cut_off_time,
                           habit_status)
 
-            _execute_query(query, parameters)
+            created = _execute_query(query, parameters)
+            if isinstance(created, tuple):
+                # eg the habit already exists
+                return created
 
             return 'Habit {} successfully created!'.format(name)
         except Exception as ex:
@@ -262,19 +288,8 @@ def get_habits():
     :return: Returns a namedtuple list of all the habits existing in the
         database or a message showing no habit was found if empty
     """
-    query = "SELECT * FROM habits where habit_status = 'ACTIVE' ORDER BY periodicity, name ASC"
-    result = _format_query_results(_execute_query(query))
-    if 'ERROR' in result:
-        return result
-    else:
-        habit = namedtuple("Habit", ['name', 'description', 'entry_date',
-                                             'start_date', 'periodicity',
-                                             'cut_off_style',
-                                             'cut_off_time',
-                                             'habit_status'])
-
-        return [habit(x[0], x[1], x[2], x[3], x[4], x[5], x[6], x[7])
-                for x in result]
+    query = f"SELECT {_HABIT_COLUMNS} FROM habits where habit_status = 'ACTIVE' ORDER BY periodicity, name ASC"
+    return _format_query_results(_execute_read(query, (), _HABIT_ROW))
 
 
 def get_habit(name: str):
@@ -284,21 +299,9 @@ def get_habit(name: str):
     :return: Returns the namedtuple of the habit with the supplied name if it
     exists in the database or an error message if not found
     """
-    query = "SELECT * FROM habits WHERE name=?"
+    query = f"SELECT {_HABIT_COLUMNS} FROM habits WHERE name=?"
     parameter = (name.upper(),)
-    result = _format_query_single_result(_execute_query(query, parameter))
-    if 'ERROR' in result:
-        return result
-    else:
-        habit = namedtuple("Habit", ['name', 'description', 'entry_date',
-                                             'start_date', 'periodicity',
-                                             'cut_off_style',
-                                             'cut_off_time',
-                                             'habit_status'])
-        current_habit = habit(result[0], result[1], result[2], result[3],
-                              result[4], result[5], result[6], result[7])
-
-        return current_habit
+    return _format_query_single_result(_execute_read(query, parameter, _HABIT_ROW))
 
 
 def get_habits_by_periodicity(frequency: str):
@@ -309,20 +312,92 @@ def get_habits_by_periodicity(frequency: str):
     :return: Returns a namedtuple list of all the habits marching period
         existing in the database or a message showing no habit was found
     """
-    query = "SELECT * FROM habits where periodicity=? and habit_status = 'ACTIVE' ORDER BY name ASC"
+    query = f"SELECT {_HABIT_COLUMNS} FROM habits where periodicity=? and habit_status = 'ACTIVE' ORDER BY name ASC"
     parameter = (frequency.capitalize(),)
-    result = _format_query_results(_execute_query(query, parameter))
-    if 'ERROR' in result:
-        return result
+    return _format_query_results(_execute_read(query, parameter, _HABIT_ROW))
+
+
+def get_data_version(name: str):
+    """Retrieve how many times a habit and its events were changed.
+
+    :params: name: name of the habit
+    :return: tuple of the habit entry date and data version, which change
+        whenever the habit or one of its events is written, or an error message
+        if the habit is not found
+    """
+    query = 'SELECT entry_date, data_version FROM habits WHERE name=?'
+    return _format_query_single_result(_execute_read(query, (name.upper(),)))
+
+
+def get_data_versions():
+    """Retrieve the data version of every habit.
+
+    :return: list of tuples of habit name, entry date and data version ordered
+        by name, or an error message
+    """
+    query = 'SELECT name, entry_date, data_version FROM habits ORDER BY name'
+    rows = _execute_read(query)
+    if isinstance(rows, tuple):
+        return f"ERROR: {rows}"
+    return rows
+
+
+def open_read_only(name: str):
+    """Open a connection that can only read the named database.
+
+    :params: name: database file name
+    :return: a new sqlite3 connection, to be closed by the caller
+    """
+    return sqlite3.connect(Path(name).resolve().as_uri() + '?mode=ro', uri=True)
+
+
+def iter_habits_with_events(names=None, conn=None, periodicity=None):
+    """Stream every ACTIVE habit together with its events, one habit at a time.
+
+    A single query returns the habits in the same order as get_habits with
+    the events of each habit ordered by date, so only the events of the habit
+    being consumed are held in memory.
+
+    :params: names: optional list of the habit names to restrict the query to
+    :params: conn: optional connection to query instead of a pooled one
+    :params: periodicity: optional periodicity - Daily or Weekly, of the
+        habits to restrict the query to
+    :return: Returns a generator of (habit, events) pairs - the namedtuple of
+        the habit and a list of its namedtuple events, which also carry the
+        event_day and event_epoch columns
+    """
+    conditions = ["habit_status = 'ACTIVE'"]
+    parameters = []
+    if names is not None:
+        conditions.append(f"name IN ({', '.join('?' * len(names))})")
+        parameters.extend(names)
+    if periodicity:
+        conditions.append('periodicity=?')
+        parameters.append(periodicity.capitalize())
+    # habit_id in the ORDER BY lets the (habit_id, event_date) index return the
+    # events of each habit in order, without sorting them in a temporary b-tree
+    query = f"""SELECT {_HABIT_COLUMNS}, event_id, name, event_date, event_day, event_epoch
+            FROM habits LEFT JOIN events USING (habit_id)
+            WHERE {' AND '.join(conditions)} ORDER BY periodicity, name, habit_id, event_date"""
+
+    if conn is not None:
+        yield from _group_habit_rows(conn.execute(query, parameters))
     else:
-        habit = namedtuple("Habit", ['name', 'description', 'entry_date',
-                                             'start_date', 'periodicity',
-                                             'cut_off_style',
-                                             'cut_off_time',
-                                             'habit_status'])
+        with _get_pool().reader() as conn:
+            yield from _group_habit_rows(conn.execute(query, parameters))
+
 
-        return [habit(x[0], x[1], x[2], x[3], x[4], x[5], x[6], x[7])
-                for x in result]
+def _group_habit_rows(cursor):
+    """Group the rows of iter_habits_with_events by habit.
+
+    :params: cursor: cursor over the habits joined with their events
+    :return: generator of (habit, events) pairs
+    """
+    make_habit = Habit._make
+    make_event = TimedEvent._make
+    for _, rows in groupby(cursor, key=itemgetter(0)):
+        first = next(rows)
+        yield make_habit(first[:8]), [make_event(x[8:]) for x in chain((first,), rows) if x[8] is not None]
 
 
 def update_habit(name: str, description="", start_date="", periodicity="",
@@ -342,44 +417,36 @@ def update_habit(name: str, description="", start_date="", periodicity="",
             ACTIVE/COMPLETED. Only ACTIVE habits are analyzed.
     :result: A message indicating the success or error encountered is returned
     """
-    if_exist = get_habit(name)
-    if 'ERROR' in if_exist:
-        return f'ERROR: Habit {name} does not exist!'
-    else:
-        result = _validate_habit(name, description, start_date, periodicity,
-                                 cut_off_style, cut_off_time, habit_status)
-        if isinstance(result, str):
-            return result
-        else:
-            name, description, start_date, periodicity, cut_off_style,  cut_off_time, habit_status = result
-
-        if description:
-            query = "UPDATE habits set description=? WHERE name=?"
-            parameters = (description, name)
-            _execute_query(query, parameters)
-        if start_date:
-            query = "UPDATE habits set start_date=? WHERE name=?"
-            parameters = (start_date, name)
-            _execute_query(query, parameters)
-        if periodicity:
-            query = "UPDATE habits set periodicity=? WHERE name=?"
-            parameters = (periodicity, name)
-            _execute_query(query, parameters)
-        if cut_off_style:
-            query = "UPDATE habits set cut_off_style=? WHERE name=?"
-            parameters = (cut_off_style, name)
-            _execute_query(query, parameters)
-        if cut_off_time:
-            query = "UPDATE habits set cut_off_time=? WHERE name=?"
-            parameters = (cut_off_time, name)
-            _execute_query(query, parameters)
-        if habit_status:
-            query = "UPDATE habits set habit_status=? WHERE name=?"
-            parameters = (habit_status, name)
-            _execute_query(query, parameters)
-
+    habit_name = name
+    result = validate_habit(name, description, start_date, periodicity,
+                             cut_off_style, cut_off_time, habit_status)
+    if isinstance(result, str):
+        return result
+    name, description, start_date, periodicity, cut_off_style, cut_off_time, habit_status = result
+
+    # only the supplied values are written, in a single statement
+    changes = {column: value for column, value in
+               [('description', description), ('start_date', start_date), ('periodicity', periodicity),
+                ('cut_off_style', cut_off_style), ('cut_off_time', cut_off_time), ('habit_status', habit_status)]
+               if value}
+    if not changes:
+        if 'ERROR' in get_habit(name):
+            return f'ERROR: Habit {habit_name} does not exist!'
         return f'SUCCESS: Habit {name} successfully updated!'
 
+    query = f"UPDATE habits SET {', '.join(f'{x}=?' for x in changes)} WHERE name=?"
+    parameters = tuple(changes.values()) + (name,)
+    try:
+        with _get_pool().writer() as conn:
+            if conn.execute(query, parameters).rowcount == 0:
+                return f'ERROR: Habit {habit_name} does not exist!'
+            if changes.keys() & STREAK_COLUMNS:
+                conn.execute(_INVALIDATE_STREAK, (name,))
+    except Exception as ex:
+        return ex.args
+
+    return f'SUCCESS: Habit {name} successfully updated!'
+
 
 def delete_habit(name: str):
     """Delete a specific habit with the given name existing in the database.
@@ -394,7 +461,11 @@ def delete_habit(name: str):
     else:
         query = "DELETE FROM habits WHERE name=?"
         parameter = (name.upper(),)
-        _execute_query(query, parameter)
+        # the streak and the events are found through the habit, so go first. The
+        # rollups go before the events so deleting them does not recount any month
+        _execute_queries([(_INVALIDATE_STREAK, parameter),
+                          (f'DELETE FROM rollups WHERE habit_id={_HABIT_ID}', parameter),
+                          (f'DELETE FROM events WHERE habit_id={_HABIT_ID}', parameter), (query, parameter)])
         return f'Habit {name} has been deleted!'
 
 
@@ -405,21 +476,17 @@ def _event_exists(name: str, event_date: str):
         :Params: event_date:date event occurred as a string
         :return: Returns a list of event(s) matching the habit name and event date
         """
-    get_existing_events = get_events(name)
-
-    if not isinstance(get_existing_events, str):
-        new_date = datetime.fromisoformat(event_date)
-        same_day_events = []
-        if isinstance(new_date, datetime):
-            # creates the last second of the previous day
-            date_before = datetime.fromisoformat((new_date - timedelta(days=1)).strftime("%Y-%m-%d") + ' 23:59:59')
-            # creates the first second of the next day
-            date_after = datetime.fromisoformat((new_date + timedelta(days=1)).strftime("%Y-%m-%d") + ' 00:00:00')
-
-            same_day_events = [x for x in get_existing_events if (datetime.fromisoformat(x.event_date) >= date_before
-                                                                  and datetime.fromisoformat(x.event_date) <= date_after)]
-            # the above ensures that the date only checks for yyyy-mm-dd
-        return same_day_events
+    new_date = parse_datetime(event_date)
+    # the range only checks for yyyy-mm-dd and is answered by the
+    # (habit_id, event_date) index instead of scanning all habit events
+    day_start = new_date.strftime("%Y-%m-%d")
+    day_end = (new_date + timedelta(days=1)).strftime("%Y-%m-%d")
+    query = f'SELECT {_EVENT_COLUMNS} FROM {_NAMED_EVENTS} WHERE name=? AND event_date >= ? AND event_date < ?'
+    parameters = (name.upper(), day_start, day_end)
+    result = _execute_read(query, parameters, _EVENT_ROW)
+    if isinstance(result, tuple):
+        return []
+    return result
 
 
 def get_events_by_name_event_date(name: str, event_date: str):
@@ -488,16 +555,176 @@ def save_event(name: str, event_date=""):
 
         check_event_exist = _check_event_exists_by_event_name_date(name, event_date)
         if 'SUCCESS' in check_event_exist:
-            query = "INSERT INTO events VALUES(?, ?, ?)"
+            query = "INSERT INTO events (event_id, event_date, event_epoch, event_day, habit_id) " \
+                    "SELECT ?, ?, ?, ?, habit_id FROM habits WHERE name=?"
             event_id = str(uuid.uuid4())
-            parameters = (event_id, name, event_date)
-
-            _execute_query(query, parameters)
+            parameters = (event_id, event_date) + event_time_columns(event_date) + (name,)
+
+            try:
+                with _get_pool().writer() as conn:
+                    conn.execute(query, parameters)
+                    _advance_streak_state(conn, name, event_date)
+            except Exception as ex:
+                return ex.args
             return 'Event for habit {} was successfully uploaded!'.format(name)
         else:
             return check_event_exist
 
 
+def _find_same_day_events(conn, rows):
+    """Find which (habit id, day) pairs of a batch already have an event.
+
+    :params: conn: connection the batch is being written with
+    :params: rows: list of (habit_id, event_date) pairs with valid datetimes
+    :return: set of (habit_id, YYYY-MM-DD) pairs already in the database
+    """
+    keys = list({(x[0], x[1][:10]) for x in rows})
+    found = set()
+    # every (habit_id, day) pair is probed through the (habit_id, event_date)
+    # index, in batches that bind fewer variables than SQLite allows
+    step = _MAX_VARIABLES // 2
+    for start in range(0, len(keys), step):
+        batch = keys[start:start + step]
+        query = 'WITH batch(habit_id, day) AS (VALUES {}) SELECT habit_id, day FROM batch WHERE EXISTS ' \
+                '(SELECT 1 FROM events WHERE events.habit_id = batch.habit_id AND events.event_date >= batch.day ' \
+                "AND events.event_date < date(batch.day, '+1 day'))".format(', '.join(['(?, ?)'] * len(batch)))
+        found.update(conn.execute(query, [x for key in batch for x in key]).fetchall())
+    return found
+
+
+def save_events_bulk(events, chunk_size=500, on_result=None):
+    """Save many habit events to the sqlite3 database in one transaction.
+
+    :params: events: iterable of (name, event_date) pairs. It may be a
+        generator; only chunk_size events are held in memory at a time
+    :params: chunk_size: number of events validated and inserted together
+    :params: on_result: optional callable receiving (position, message) for
+        every event. When given, the messages are not collected. The messages
+        are reported before the transaction commits, so when it is rolled back
+        on_result receives a final (None, message) notice cancelling them
+    :return: list with a message per event in the order given, a summary
+        message when on_result is used, or the error encountered
+    """
+    results = []
+    report = on_result if on_result else lambda position, message: results.append(message)
+    habits = {}
+    saved = 0
+    position = 0
+    events = iter(events)
+    try:
+        with _get_pool().writer() as conn:
+            while True:
+                chunk = list(islice(events, chunk_size))
+                if not chunk:
+                    break
+                messages = [None] * len(chunk)
+                valid_rows = []
+                for index, (name, event_date) in enumerate(chunk):
+                    if not name:
+                        messages[index] = 'ERROR: habit name for event is required'
+                        continue
+                    habit_name = name.upper()
+                    if habit_name not in habits:
+                        found = conn.execute('SELECT habit_id FROM habits WHERE name=?', (habit_name,)).fetchone()
+                        habits[habit_name] = found[0] if found else None
+                    if habits[habit_name] is None:
+                        messages[index] = f'ERROR: Habit {name} does not exist'
+                        continue
+                    if event_date:
+                        event_date = _is_valid_datetime(event_date)
+                        if 'ERROR' in event_date:
+                            messages[index] = event_date
+                            continue
+                    else:
+                        event_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    valid_rows.append((index, habit_name, habits[habit_name], event_date))
+
+                existing = _find_same_day_events(conn, [x[2:] for x in valid_rows]) if valid_rows else set()
+                new_rows = []
+                for index, habit_name, habit_id, event_date in valid_rows:
+                    day_key = (habit_id, event_date[:10])
+                    if day_key in existing:
+                        messages[index] = 'ERROR: Event Already Exists!'
+                    else:
+                        existing.add(day_key)
+                        new_rows.append((str(uuid.uuid4()), habit_id, event_date) + event_time_columns(event_date))
+                        messages[index] = 'Event for habit {} was successfully uploaded!'.format(habit_name)
+                conn.executemany('INSERT INTO events (event_id, habit_id, event_date, event_epoch, event_day) '
+                                 'VALUES(?, ?, ?, ?, ?)', new_rows)
+                conn.executemany('DELETE FROM streaks WHERE habit_id=?', {(x[1],) for x in new_rows})
+                saved += len(new_rows)
+
+                for message in messages:
+                    report(position, message)
+                    position += 1
+    except Exception as ex:
+        if on_result and position:
+            on_result(None, f'ERROR: Transaction rolled back, none of the {saved} events reported as uploaded '
+                            'were saved')
+        return ex.args
+
+    if on_result:
+        return f'SUCCESS: {saved} of {position} events were successfully uploaded!'
+    return results
+
+
+def get_streak_state(name: str):
+    """Retrieve the stored streak state of the habit.
+
+    :params: name: name of the habit whose streak state is requested
+    :return: Returns (last_day, streak, max_streak) of the habit or an error
+        message if the streak has not been calculated since the last change
+    """
+    query = 'SELECT last_day, streak, max_streak FROM streaks JOIN habits USING (habit_id) WHERE name=?'
+    return _format_query_single_result(_execute_read(query, (name.upper(),)))
+
+
+def save_streak_state(name: str, streak: int, max_streak: int):
+    """Store a freshly calculated streak of the habit.
+
+    :params: name: name of the habit the streak was calculated for
+    :params: streak: current streak of the habit
+    :params: max_streak: highest streak of the habit
+    :return: cursor of the query or the error encountered
+    """
+    # event_day grows with event_date, so the newest event found through the
+    # (habit_id, event_date) index carries the last day
+    query = 'INSERT OR REPLACE INTO streaks SELECT habit_id, (SELECT event_day FROM events ' \
+            'WHERE events.habit_id = habits.habit_id ORDER BY event_date DESC LIMIT 1), ?, ? FROM habits WHERE name=?'
+    return _execute_query(query, (streak, max_streak, name.upper()))
+
+
+def _advance_streak_state(conn, name: str, event_date: str):
+    """Update the stored streak of the habit with a newly saved event.
+
+    Events newer than every other event extend the stored streak in place,
+    older ones invalidate it so it is recalculated on the next request.
+
+    :params: conn: connection the event was saved with
+    :params: name: name of the habit the event belongs to
+    :params: event_date: valid datetime of the event - YYYY-MM-DD hh:mm:ss
+    """
+    query = """SELECT habit_id, last_day, streak, max_streak, start_date, periodicity, cut_off_style, cut_off_time
+            FROM streaks JOIN habits USING (habit_id) WHERE name=?"""
+    state = conn.execute(query, (name,)).fetchone()
+    if state is None:
+        return
+    habit_id, last_day, streak, max_streak, start_date, periodicity, cut_off_style, cut_off_time = state
+    event_epoch, event_day = event_time_columns(event_date)
+    if event_day < parse_datetime(start_date).toordinal():
+        # events before the habit start date are not analyzed
+        return
+    if event_day <= last_day:
+        conn.execute('DELETE FROM streaks WHERE habit_id=?', (habit_id,))
+        instrumentation.count('streak_cache_invalidate')
+        return
+    cut_off = cut_off_seconds(start_date, cut_off_style, cut_off_time)
+    new_state = advance_streak(last_day, streak, max_streak, event_day, event_epoch % 86400,
+                               periodicity, cut_off, cut_off_style)
+    conn.execute('UPDATE streaks SET last_day=?, streak=?, max_streak=? WHERE habit_id=?', new_state + (habit_id,))
+    instrumentation.count('streak_cache_advance')
+
+
 def get_event(event_id: str):
     """Retrieve a habit event with the event_id  existing in the database.
 
@@ -506,16 +733,9 @@ def get_event(event_id: str):
         existing in the database or a message showing no habit event was found
         matching the event_id
     """
-    query = "SELECT * FROM events WHERE event_id=?"
+    query = f"SELECT {_EVENT_COLUMNS} FROM {_NAMED_EVENTS} WHERE event_id=?"
     parameter = (event_id,)
-    result = _format_query_single_result(_execute_query(query, parameter))
-    if 'ERROR' in result:
-        return result
-    else:
-        habit_event = namedtuple("Event", ['event_id', 'habit_name', 'event_date'])
-        current_event = habit_event(result[0], result[1], result[2])
-
-        return current_event
+    return _format_query_single_result(_execute_read(query, parameter, _EVENT_ROW))
 
 
 def get_events(name: str):
@@ -526,15 +746,96 @@ def get_events(name: str):
         existing in the database or a message showing no habit event was found
         matching the habit name
     """
-    query = 'SELECT * FROM events WHERE habit_name=?'
+    query = f'SELECT {_EVENT_COLUMNS} FROM {_NAMED_EVENTS} WHERE name=? ORDER BY event_date'
     parameter = (name.upper(),)
-    result = _format_query_results(_execute_query(query, parameter))
-    if 'ERROR' in result:
+    result = _format_query_results(_execute_read(query, parameter, _EVENT_ROW))
+    if isinstance(result, str):
+        return f'ERROR: There are no events for habit {name.upper()} in our database'
+    else:
+        return result
+
+
+def iter_events(name=None):
+    """Stream the events of one or all the habits without loading them at once.
+
+    :params: name: optional name of the habit whose events are streamed, every
+        event is streamed when omitted
+    :return: Returns a generator of namedtuple events ordered by habit name and
+        event_date
+    """
+    if name:
+        query = f'SELECT {_EVENT_COLUMNS} FROM {_NAMED_EVENTS} WHERE name=? ORDER BY event_date'
+        parameters = (name.upper(),)
+    else:
+        query = f'SELECT {_EVENT_COLUMNS} FROM {_NAMED_EVENTS} ORDER BY name, event_date'
+        parameters = ()
+    with _get_pool().reader() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = _EVENT_ROW
+        yield from cursor.execute(query, parameters)
+
+
+def export_rows():
+    """Read every habit and event in one read transaction of the database.
+
+    Both queries see the same version of the database, so the rows are a
+    consistent copy even while events are being written.
+
+    :return: tuple of the namedtuple list of habits ordered by periodicity and
+        name, and the list of (name, event_epoch, event_id) rows of every event
+    """
+    with _get_pool().reader() as conn:
+        in_transaction = conn.in_transaction
+        if not in_transaction:
+            conn.execute('BEGIN')
+        try:
+            cursor = conn.cursor()
+            cursor.row_factory = _HABIT_ROW
+            habits = cursor.execute(f'SELECT {_HABIT_COLUMNS} FROM habits ORDER BY periodicity, name').fetchall()
+            rows = conn.execute(f'SELECT name, event_epoch, event_id FROM {_NAMED_EVENTS}').fetchall()
+        finally:
+            if not in_transaction:
+                conn.execute('COMMIT')
+    return habits, rows
+
+
+def get_event_days(name: str, since=None, until=None):
+    """Retrieve the integer day ordinal and epoch seconds of the habit events.
+
+    :params: name: name of the habit whose events are to be retrieve
+    :params: since: first day YYYY-MM-DD of the events, all of them when omitted
+    :params: until: last day YYYY-MM-DD of the events, all of them when omitted
+    :return: Returns a list of (event_day, event_epoch) tuples ordered by date
+        for the supplied habit name or a message showing no habit event was
+        found matching the habit name
+    """
+    query = f'SELECT event_day, event_epoch FROM {_NAMED_EVENTS} WHERE name=? AND event_date BETWEEN ? AND ? ' \
+            'ORDER BY event_date'
+    parameter = (name.upper(),) + event_date_range(since, until)
+    result = _format_query_results(_execute_read(query, parameter))
+    if isinstance(result, str):
         return f'ERROR: There are no events for habit {name.upper()} in our database'
     else:
-        habit_event = namedtuple("Event", ['event_id', 'habit_name', 'event_date'])
+        return result
+
 
-        return [habit_event(x[0], x[1], x[2]) for x in result]
+def get_rollups(name: str, since=None, until=None):
+    """Retrieve the monthly rollups of the habit events.
+
+    :params: name: name of the habit whose rollups are to be retrieved
+    :params: since: first month YYYY-MM, all of them when omitted
+    :params: until: last month YYYY-MM, all of them when omitted
+    :return: Returns a list of (month, events, days, credible) tuples ordered by
+        month, days and credible being bitmasks of the days of the month with
+        an event and with an event satisfying the cut off style, or the error
+        encountered
+    """
+    query = 'SELECT month, events, days, credible FROM rollups WHERE habit_id=' + _HABIT_ID + \
+            ' AND month BETWEEN ? AND ? ORDER BY month'
+    rows = _execute_read(query, (name.upper(), (since or '0000-00')[:7], (until or '9999-12')[:7]))
+    if isinstance(rows, tuple):
+        return f"ERROR: {rows}"
+    return rows
 
 
 def update_event(event_id: str, name, event_date):
@@ -556,10 +857,12 @@ def update_event(event_id: str, name, event_date):
             name, event_date = result
 
             check_event_exist = _check_event_exists_by_event_name_date(name, event_date)
-            if 'SUCCESS' in check_event_exist:  # event does not exist, so change the habit_name and event_date
-                query = "UPDATE events set habit_name=?, event_date=? WHERE event_id=?"
-                parameters = (name, event_date, event_id)
-                _execute_query(query, parameters)
+            if 'SUCCESS' in check_event_exist:  # event does not exist, so change the habit and event_date
+                query = f"UPDATE events set habit_id={_HABIT_ID}, event_date=?, event_epoch=?, event_day=? " \
+                        "WHERE event_id=?"
+                parameters = (name, event_date) + event_time_columns(event_date) + (event_id,)
+                _execute_queries([(query, parameters), (_INVALIDATE_STREAK, (if_exist.habit_name,)),
+                                  (_INVALIDATE_STREAK, (name,))])
             else:
                 return check_event_exist
 
@@ -580,7 +883,7 @@ def delete_event(event_id: str):
     else:
         query = "DELETE FROM events WHERE event_id=?"
         parameter = (event_id,)
-        _execute_query(query, parameter)
+        _execute_queries([(query, parameter), (_INVALIDATE_STREAK, (if_exist.habit_name,))])
         return f'event {event_id} has been deleted!'
 
 
@@ -596,7 +899,9 @@ def delete_events(name: str):
     if 'ERROR' in if_exist:
         return f'ERROR: event records for habit {name} does not exist!'
     else:
-        query = "DELETE FROM events WHERE habit_name=?"
+        query = f"DELETE FROM events WHERE habit_id={_HABIT_ID}"
         parameter = (name.upper(), )
-        return _execute_query(query, parameter)
-        # return f'event records for habit {name} have been deleted!'
+        result = _execute_queries([(query, parameter), (_INVALIDATE_STREAK, parameter)])
+        if isinstance(result, tuple):
+            return f'ERROR: {result}'
+        return f'event records for habit {name} have been deleted!'
@@ -0,0 +1,631 @@
+import mmap
+import os
+import struct
+import threading
+import uuid
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+
+import db
+from db import Event, TimedEvent
+from parsing import event_time_columns, format_epoch, format_uuid, normalize_datetime, parse_datetime
+from streaks import advance_streak, cut_off_seconds
+
+# Every record is habit id, flags, event epoch seconds and the 16 bytes of the
+# event uuid. The file starts with a header of the same size holding the magic
+# bytes, the format version, the record size and the number of records.
+RECORD = struct.Struct('<iIq16s')
+# the same record layout as numpy structured array fields
+RECORD_FIELDS = [('habit', '<i4'), ('flags', '<u4'), ('epoch', '<i8'), ('id', 'S16')]
+HEADER = struct.Struct('<8sIIQ8x')
+MAGIC = b'HTPELOG\x00'
+VERSION = 1
+TOMBSTONE = 1
+# the file grows by at least this many records at a time
+GROWTH = 4096
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def _day_epoch(day: str):
+    """Return the epoch seconds of the midnight starting the YYYY-MM-DD day."""
+    return (datetime.fromisoformat(day[:10]).toordinal() - _EPOCH_ORDINAL) * 86400
+
+
+class EventLog:
+    """Fixed-width append-only event records in a memory mapped file.
+
+    Records are only ever appended; deleting one sets its tombstone flag in
+    place. The index of each habit lists (epoch, record number) pairs sorted
+    by date, and is rebuilt by scanning the file when it is opened.
+    """
+
+    def __init__(self, path: str):
+        """Open the log, creating it if needed.
+
+        :params: path: file name of the log. The habit names are numbered in a
+            text file next to it, path + '.habits'
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        self._names_path = path + '.habits'
+        self._habit_ids = {}
+        self._names = []
+        if os.path.exists(self._names_path):
+            with open(self._names_path, encoding='utf-8') as file:
+                self._names = [x.rstrip('\n') for x in file]
+            self._habit_ids = {name: number for number, name in enumerate(self._names, 1)}
+        self._names_file = open(self._names_path, 'a', encoding='utf-8')
+        self._open()
+
+    def _open(self):
+        """Map the file and rebuild the indexes from its records."""
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) >= HEADER.size
+        self._file = open(self.path, 'r+b' if exists else 'w+b')
+        if not exists:
+            self._file.truncate(HEADER.size + RECORD.size * GROWTH)
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        if exists:
+            magic, version, record_size, self.count = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                raise ValueError(f'{self.path} is not a version {VERSION} event log')
+        else:
+            self.count = 0
+            HEADER.pack_into(self._mm, 0, MAGIC, VERSION, RECORD.size, 0)
+        self.capacity = (len(self._mm) - HEADER.size) // RECORD.size
+        self._build_indexes()
+
+    def _build_indexes(self):
+        """Scan every record once to index the live ones by habit and by event id."""
+        self._by_habit = {}
+        self._by_id = {}
+        try:
+            import numpy as np
+        except ImportError:
+            self._index_records()
+        else:
+            self._index_records_numpy(np)
+
+    def _index_records(self):
+        """Index the records one at a time, when numpy is not installed."""
+        self.tombstones = 0
+        view = memoryview(self._mm)[HEADER.size:HEADER.size + self.count * RECORD.size]
+        try:
+            for number, (habit_id, flags, epoch, event_id) in enumerate(RECORD.iter_unpack(view)):
+                if flags & TOMBSTONE:
+                    self.tombstones += 1
+                    continue
+                self._by_habit.setdefault(habit_id, []).append((epoch, number))
+                self._by_id[event_id] = number
+        finally:
+            view.release()
+        for positions in self._by_habit.values():
+            positions.sort()
+
+    def _index_records_numpy(self, np):
+        """Index the records with a structured numpy view of the map."""
+        records = np.frombuffer(self._mm, dtype=np.dtype(RECORD_FIELDS), count=self.count, offset=HEADER.size)
+        try:
+            dead = (records['flags'] & TOMBSTONE).astype(bool)
+            numbers = np.flatnonzero(~dead)
+            # fancy indexing copies the live records out of the map
+            live = records[numbers]
+        finally:
+            # the map can only be closed, to grow or compact it, once no array refers to it
+            del records
+        self.tombstones = int(dead.sum())
+        if not len(live):
+            return
+        ids = live['id'].tobytes()
+        self._by_id = dict(zip((ids[x:x + 16] for x in range(0, len(ids), 16)), numbers.tolist()))
+        order = np.lexsort((numbers, live['epoch'], live['habit']))
+        habits = live['habit'][order]
+        epochs = live['epoch'][order].tolist()
+        numbers = numbers[order].tolist()
+        bounds = np.flatnonzero(np.diff(habits)) + 1
+        for start, end in zip([0, *bounds.tolist()], [*bounds.tolist(), len(numbers)]):
+            self._by_habit[int(habits[start])] = list(zip(epochs[start:end], numbers[start:end]))
+
+    def _grow(self):
+        """Extend the file and remap it."""
+        self.capacity += max(GROWTH, self.capacity // 2)
+        self._mm.close()
+        self._file.truncate(HEADER.size + RECORD.size * self.capacity)
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+    def habit_id(self, name: str, create=False):
+        """Return the number of the habit in the log, 0 if it has none yet."""
+        habit_id = self._habit_ids.get(name, 0)
+        if not habit_id and create:
+            with self._lock:
+                self._names.append(name)
+                habit_id = self._habit_ids[name] = len(self._names)
+                self._names_file.write(name + '\n')
+                self._names_file.flush()
+        return habit_id
+
+    def append(self, habit_id: int, epoch: int, event_id: bytes):
+        """Append a record and index it.
+
+        :return: number of the new record
+        """
+        with self._lock:
+            if self.count == self.capacity:
+                self._grow()
+            number = self.count
+            RECORD.pack_into(self._mm, HEADER.size + number * RECORD.size, habit_id, 0, epoch, event_id)
+            self.count += 1
+            HEADER.pack_into(self._mm, 0, MAGIC, VERSION, RECORD.size, self.count)
+            insort(self._by_habit.setdefault(habit_id, []), (epoch, number))
+            self._by_id[event_id] = number
+            return number
+
+    def read(self, number: int):
+        """Return (habit id, flags, epoch, event id) of a record."""
+        return RECORD.unpack_from(self._mm, HEADER.size + number * RECORD.size)
+
+    def set_tombstone(self, number: int, dead=True):
+        """Mark a record as deleted, or alive again, and update the indexes."""
+        with self._lock:
+            habit_id, flags, epoch, event_id = self.read(number)
+            struct.pack_into('<I', self._mm, HEADER.size + number * RECORD.size + 4,
+                             flags | TOMBSTONE if dead else flags & ~TOMBSTONE)
+            positions = self._by_habit.setdefault(habit_id, [])
+            if dead:
+                positions.pop(bisect_left(positions, (epoch, number)))
+                del self._by_id[event_id]
+                self.tombstones += 1
+            else:
+                insort(positions, (epoch, number))
+                self._by_id[event_id] = number
+                self.tombstones -= 1
+
+    def find(self, event_id: bytes):
+        """Return the record number of a live event, None if there is none."""
+        return self._by_id.get(event_id)
+
+    def positions(self, habit_id: int):
+        """Return the (epoch, record number) pairs of the habit, oldest first."""
+        return self._by_habit.get(habit_id, [])
+
+    def compact(self):
+        """Rewrite the log without its tombstones.
+
+        The live records are copied to a new file which then replaces the log,
+        so a crash leaves either the old or the new log behind.
+        """
+        with self._lock:
+            live = [self.read(number) for positions in self._by_habit.values() for _, number in positions]
+            temporary = self.path + '.compact'
+            with open(temporary, 'wb') as file:
+                file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, len(live)))
+                file.write(b''.join(RECORD.pack(*x) for x in live))
+                file.write(b'\x00' * RECORD.size * GROWTH)
+            self._mm.close()
+            self._file.close()
+            os.replace(temporary, self.path)
+            self._open()
+
+    def flush(self):
+        """Write the mapped pages to disk."""
+        with self._lock:
+            self._mm.flush()
+
+    def close(self):
+        """Write the mapped pages to disk and close the files of the log."""
+        with self._lock:
+            self._mm.flush()
+            self._mm.close()
+            self._file.close()
+            self._names_file.close()
+
+
+class EventLogBackend:
+    """Habits in the sqlite3 database, events in an append-only EventLog.
+
+    Streak states are kept in memory only. The log is compacted once
+    tombstones make up more than compact_ratio of its records.
+    """
+
+    save_habit = staticmethod(db.save_habit)
+    get_habits = staticmethod(db.get_habits)
+    get_habit = staticmethod(db.get_habit)
+    get_habits_by_periodicity = staticmethod(db.get_habits_by_periodicity)
+
+    def __init__(self, path: str, compact_ratio=0.25):
+        """Initialize the event log backend.
+
+        :params: path: file name of the event log
+        :params: compact_ratio: share of deleted records that triggers a
+            compaction
+        """
+        self.log = EventLog(path)
+        self.compact_ratio = compact_ratio
+        self._streaks = {}
+        # events written per habit id, only ever growing so rolled back writes count too
+        self._versions = {}
+        self._undo = None
+
+    @contextmanager
+    def transaction(self):
+        """Group the changes of the block, undone if the block raises."""
+        with db.transaction() as conn, self.log._lock:
+            outermost = self._undo is None
+            if outermost:
+                self._undo = []
+            mark = len(self._undo)
+            try:
+                yield conn
+            except BaseException:
+                for undo in reversed(self._undo[mark:]):
+                    undo()
+                del self._undo[mark:]
+                raise
+            finally:
+                if outermost:
+                    self._undo = None
+        self._maybe_compact()
+
+    def _bump(self, habit_id: int):
+        """Count a change to the events of the habit in its data version."""
+        self._versions[habit_id] = self._versions.get(habit_id, 0) + 1
+
+    def _append(self, habit_id: int, epoch: int, event_id: bytes):
+        """Append a record, undone by the transaction if it rolls back.
+
+        :return: number of the new record
+        """
+        number = self.log.append(habit_id, epoch, event_id)
+        self._bump(habit_id)
+        if self._undo is not None:
+            self._undo.append(lambda: self.log.set_tombstone(number))
+        return number
+
+    def _delete(self, number: int):
+        """Tombstone a record, revived by the transaction if it rolls back."""
+        self.log.set_tombstone(number)
+        self._bump(self.log.read(number)[0])
+        if self._undo is not None:
+            self._undo.append(lambda: self.log.set_tombstone(number, False))
+
+    def _forget_streak(self, name: str):
+        """Drop the streak state of the habit, restored if the transaction rolls back."""
+        old = self._streaks.pop(name, None)
+        if old is not None and self._undo is not None:
+            self._undo.append(lambda: self._streaks.__setitem__(name, old))
+
+    def _set_streak(self, name: str, state):
+        """Store the streak state of the habit, restored if the transaction rolls back."""
+        old = self._streaks.get(name)
+        self._streaks[name] = state
+        if self._undo is not None:
+            self._undo.append(lambda: self._streaks.__setitem__(name, old) if old else self._streaks.pop(name))
+
+    def _maybe_compact(self):
+        """Compact the log when enough of it is made of tombstones."""
+        log = self.log
+        if self._undo is None and log.count >= GROWTH and log.tombstones > log.count * self.compact_ratio:
+            log.compact()
+
+    def _event(self, number: int, name: str):
+        """Build the Event of a record."""
+        _, _, epoch, event_id = self.log.read(number)
+        return Event(format_uuid(event_id), name, format_epoch(epoch))
+
+    def _day_positions(self, habit_id: int, epoch: int):
+        """Record positions of the habit on the same day as the epoch."""
+        positions = self.log.positions(habit_id)
+        day_start = epoch - epoch % 86400
+        start = bisect_left(positions, (day_start,))
+        end = bisect_left(positions, (day_start + 86400,), start)
+        return positions[start:end]
+
+    def _validate_event(self, name: str, event_date=""):
+        """Same checks as db._validate_event; returns [NAME, event_date, epoch]."""
+        if not name:
+            return 'ERROR: habit name for event is required'
+        if 'ERROR' in db.get_habit(name):
+            return f'ERROR: Habit {name} does not exist'
+        if event_date:
+            event_date = normalize_datetime(event_date)
+            if 'ERROR' in event_date:
+                return event_date
+        else:
+            event_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return [name.upper(), event_date, event_time_columns(event_date)[0]]
+
+    def _advance_streak_state(self, name: str, epoch: int):
+        """Same as db._advance_streak_state, on the streak states in memory."""
+        state = self._streaks.get(name)
+        if state is None:
+            return
+        habit = db.get_habit(name)
+        event_day = epoch // 86400 + _EPOCH_ORDINAL
+        if event_day < parse_datetime(habit.start_date).toordinal():
+            return
+        if state[0] is None or event_day <= state[0]:
+            self._forget_streak(name)
+            return
+        cut_off = cut_off_seconds(habit.start_date, habit.cut_off_style, habit.cut_off_time)
+        self._set_streak(name, advance_streak(*state, event_day, epoch % 86400, habit.periodicity, cut_off,
+                                              habit.cut_off_style))
+
+    def iter_habits_with_events(self, names=None, periodicity=None):
+        """Stream the ACTIVE habits with their events. See db.iter_habits_with_events.
+
+        :params: names: optional names of the habits to stream
+        :params: periodicity: optional periodicity - Daily or Weekly
+        :return: generator of (habit, TimedEvent list ordered by date) pairs
+        """
+        habits = db.get_habits()
+        if isinstance(habits, str):
+            return
+        for habit in habits:
+            if (names is not None and habit.name not in names) or \
+                    (periodicity and habit.periodicity != periodicity.capitalize()):
+                continue
+            with self.log._lock:
+                events = [TimedEvent(*self._event(number, habit.name), epoch // 86400 + _EPOCH_ORDINAL, epoch)
+                          for epoch, number in self.log.positions(self.log.habit_id(habit.name))]
+            yield habit, events
+
+    def update_habit(self, name: str, description="", start_date="", periodicity="",
+                     cut_off_style="", cut_off_time="", habit_status=""):
+        """Edit the fields of an existing habit. See db.update_habit.
+
+        Changing a field the streaks depend on drops the streak state in the
+        same transaction.
+
+        :params: name: name of the habit to be updated
+        :params: description, start_date, periodicity, cut_off_style,
+            cut_off_time, habit_status: new values, unchanged when empty
+        :return: message showing the habit was updated or the error message
+        """
+        with self.transaction():
+            result = db.update_habit(name, description, start_date, periodicity, cut_off_style, cut_off_time,
+                                     habit_status)
+            if 'SUCCESS' in result and (start_date or periodicity or cut_off_style or cut_off_time):
+                self._forget_streak(name.upper())
+        return result
+
+    def delete_habit(self, name: str):
+        """Delete a habit with its events and streak state. See db.delete_habit.
+
+        :params: name: name of the habit to be deleted
+        :return: message showing the habit was deleted or the error message
+        """
+        with self.transaction():
+            result = db.delete_habit(name)
+            if 'ERROR' not in result:
+                for _, number in list(self.log.positions(self.log.habit_id(name.upper()))):
+                    self._delete(number)
+                self._forget_streak(name.upper())
+        return result
+
+    def save_event(self, name: str, event_date=""):
+        """Append an event of a habit to the log. See db.save_event.
+
+        :params: name: name of the habit the event belongs to
+        :params: event_date: datetime the event occurred, now when omitted
+        :return: message showing the event was saved or the error message
+        """
+        with self.transaction():
+            result = self._validate_event(name, event_date)
+            if isinstance(result, str):
+                return result
+            name, event_date, epoch = result
+            habit_id = self.log.habit_id(name, create=True)
+            if self._day_positions(habit_id, epoch):
+                return 'ERROR: Event Already Exists!'
+            self._append(habit_id, epoch, uuid.uuid4().bytes)
+            self._advance_streak_state(name, epoch)
+        return 'Event for habit {} was successfully uploaded!'.format(name)
+
+    def save_events_bulk(self, events, chunk_size=500, on_result=None):
+        """Append many events in one transaction. See db.save_events_bulk.
+
+        :params: events: iterable of (habit name, event date) pairs
+        :params: chunk_size: number of events read from the iterable at a time
+        :params: on_result: optional callable receiving the position and the
+            message of every event
+        :return: list of the message of every event or, with on_result, a
+            summary message
+        """
+        results = []
+        report = on_result if on_result else lambda position, message: results.append(message)
+        saved = 0
+        position = 0
+        events = iter(events)
+        habits = {}
+        with self.transaction():
+            while True:
+                chunk = list(islice(events, chunk_size))
+                if not chunk:
+                    break
+                for name, event_date in chunk:
+                    if name and name.upper() not in habits:
+                        habits[name.upper()] = 'ERROR' not in db.get_habit(name)
+                    if not name:
+                        message = 'ERROR: habit name for event is required'
+                    elif not habits[name.upper()]:
+                        message = f'ERROR: Habit {name} does not exist'
+                    else:
+                        event_date = normalize_datetime(event_date) if event_date else \
+                            datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        if 'ERROR' in event_date:
+                            message = event_date
+                        else:
+                            epoch = event_time_columns(event_date)[0]
+                            habit_id = self.log.habit_id(name.upper(), create=True)
+                            if self._day_positions(habit_id, epoch):
+                                message = 'ERROR: Event Already Exists!'
+                            else:
+                                self._append(habit_id, epoch, uuid.uuid4().bytes)
+                                self._forget_streak(name.upper())
+                                saved += 1
+                                message = 'Event for habit {} was successfully uploaded!'.format(name.upper())
+                    report(position, message)
+                    position += 1
+        if on_result:
+            return f'SUCCESS: {saved} of {position} events were successfully uploaded!'
+        return results
+
+    def _find(self, event_id: str):
+        """Record number and habit name of a live event, None if not found."""
+        try:
+            number = self.log.find(uuid.UUID(event_id).bytes)
+        except ValueError:
+            return None
+        if number is None:
+            return None
+        return number, self.log._names[self.log.read(number)[0] - 1]
+
+    def get_event(self, event_id: str):
+        """Retrieve a live event by its id. See db.get_event.
+
+        :params: event_id: uuid of the event
+        :return: namedtuple of the event or a message showing it was not found
+        """
+        found = self._find(event_id)
+        if found is None:
+            return "ERROR: Requested item NOT found!"
+        return self._event(*found)
+
+    def get_events(self, name: str):
+        """Retrieve the events of a habit. See db.get_events.
+
+        :params: name: name of the habit
+        :return: namedtuple list of the events ordered by date or a message
+            showing there are none
+        """
+        with self.log._lock:
+            events = [self._event(number, name.upper())
+                      for _, number in self.log.positions(self.log.habit_id(name.upper()))]
+        if not events:
+            return f'ERROR: There are no events for habit {name.upper()} in our database'
+        return events
+
+    def get_event_days(self, name: str, since=None, until=None):
+        """Retrieve the day and epoch of the events of a habit. See db.get_event_days.
+
+        :params: name: name of the habit
+        :params: since: optional first day, YYYY-MM-DD, of the events
+        :params: until: optional last day, YYYY-MM-DD, of the events
+        :return: list of (event_day, event_epoch) ordered by date or a message
+            showing there are none
+        """
+        lowest = float('-inf') if since is None else _day_epoch(since)
+        highest = float('inf') if until is None else _day_epoch(until) + 86400
+        # writers insert into the positions in place, slice them under the lock
+        with self.log._lock:
+            positions = self.log.positions(self.log.habit_id(name.upper()))
+            positions = positions[bisect_left(positions, (lowest,)):bisect_left(positions, (highest,))]
+        if not positions:
+            return f'ERROR: There are no events for habit {name.upper()} in our database'
+        return [(epoch // 86400 + _EPOCH_ORDINAL, epoch) for epoch, _ in positions]
+
+    def get_events_by_name_event_date(self, name: str, event_date: str):
+        """Retrieve the events of a habit on the day of a date. See db.get_events_by_name_event_date.
+
+        :params: name: name of the habit
+        :params: event_date: datetime string, only its day is compared
+        :return: namedtuple list of the events of that day, empty if none
+        """
+        epoch = _day_epoch(event_date)
+        with self.log._lock:
+            return [self._event(number, name.upper())
+                    for _, number in self._day_positions(self.log.habit_id(name.upper()), epoch)]
+
+    def update_event(self, event_id: str, name, event_date):
+        """Move an event to another date or habit, keeping its id. See db.update_event.
+
+        :params: event_id: uuid of the event
+        :params: name: name of the habit the event belongs to afterwards
+        :params: event_date: new datetime of the event
+        :return: message showing the event was updated or the error message
+        """
+        with self.transaction():
+            found = self._find(event_id)
+            if found is None:
+                return f'ERROR: event with the id {event_id} does not exist!'
+            result = self._validate_event(name, event_date)
+            if isinstance(result, str):
+                return result
+            name, event_date, epoch = result
+            habit_id = self.log.habit_id(name, create=True)
+            if self._day_positions(habit_id, epoch):
+                return 'ERROR: Event Already Exists!'
+            # the event keeps its id, the old record becomes a tombstone
+            self._delete(found[0])
+            self._append(habit_id, epoch, uuid.UUID(event_id).bytes)
+            self._forget_streak(found[1])
+            self._forget_streak(name)
+        return f'event {event_id} for habit {name} has been updated!'
+
+    def delete_event(self, event_id: str):
+        """Tombstone an event. See db.delete_event.
+
+        :params: event_id: uuid of the event
+        :return: message showing the event was deleted or the error message
+        """
+        with self.transaction():
+            found = self._find(event_id)
+            if found is None:
+                return f'ERROR: event with the event_id {event_id} does not exist!'
+            self._delete(found[0])
+            self._forget_streak(found[1])
+        return f'event {event_id} has been deleted!'
+
+    def delete_events(self, name: str):
+        """Tombstone all the events of a habit. See db.delete_events.
+
+        :params: name: name of the habit
+        :return: message showing the events were deleted or the error message
+        """
+        with self.transaction():
+            positions = list(self.log.positions(self.log.habit_id(name.upper())))
+            if not positions:
+                return f'ERROR: event records for habit {name} does not exist!'
+            for _, number in positions:
+                self._delete(number)
+            self._forget_streak(name.upper())
+        return f'event records for habit {name} have been deleted!'
+
+    def get_streak_state(self, name: str):
+        """Retrieve the streak state of the habit kept in memory. See db.get_streak_state.
+
+        :params: name: name of the habit
+        :return: (last_day, streak, max_streak) of the habit or a message
+            showing it has not been calculated since the last change
+        """
+        state = self._streaks.get(name.upper())
+        return state if state is not None else "ERROR: Requested item NOT found!"
+
+    def save_streak_state(self, name: str, streak: int, max_streak: int):
+        """Keep a freshly calculated streak of the habit. See db.save_streak_state.
+
+        :params: name: name of the habit the streak was calculated for
+        :params: streak: current streak of the habit
+        :params: max_streak: highest streak of the habit
+        """
+        with self.log._lock:
+            positions = self.log.positions(self.log.habit_id(name.upper()))
+            last_day = positions[-1][0] // 86400 + _EPOCH_ORDINAL if positions else None
+            self._set_streak(name.upper(), (last_day, streak, max_streak))
+
+    def get_data_version(self, name: str):
+        """Return the data version of the habit. See db.get_data_version.
+
+        :params: name: name of the habit
+        :return: (entry_date, version, log version) of the habit, the log
+            version counting the changes to its events, or the error message
+        """
+        version = db.get_data_version(name)
+        if isinstance(version, str):
+            return version
+        return tuple(version) + (self._versions.get(self.log.habit_id(name.upper()), 0),)
+
+    def close(self):
+        """Close the event log."""
+        self.log.close()
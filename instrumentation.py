@@ -0,0 +1,337 @@
+import json
+import os
+import sys
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps, lru_cache
+from time import perf_counter, time
+
+from parsing import parse_cache_info
+
+# Instrumentation is off until enable() is called. While off, every timed
+# function only pays for one extra call and a check of this flag.
+enabled = False
+_sinks = []
+_local = threading.local()
+# marks the end of the iterables timed by timed_iter
+_END = object()
+
+# upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+def enable(*sinks):
+    """Start sending timings and counts to the sinks.
+
+    :params: sinks: objects with observe(kind, name, seconds, parent) and
+        increment(name, value) methods, and optionally flush()
+    """
+    global enabled, _sinks
+    _sinks = list(sinks)
+    enabled = bool(_sinks)
+
+
+def disable():
+    """Stop the instrumentation, flush the sinks one last time and close them."""
+    global enabled, _sinks
+    enabled = False
+    flush()
+    for sink in _sinks:
+        if hasattr(sink, 'close'):
+            sink.close()
+    _sinks = []
+
+
+def flush():
+    """Ask every sink able to write its data out to do so."""
+    for sink in _sinks:
+        if hasattr(sink, 'flush'):
+            sink.flush()
+
+
+def observe(kind: str, name: str, seconds: float):
+    """Record the duration of one operation.
+
+    :params: kind: group of the operation - query, read, connect or span
+    :params: name: operation, eg the normalized SQL or the function name
+    :params: seconds: how long it took
+    """
+    if not enabled:
+        return
+    stack = getattr(_local, 'stack', None)
+    parent = stack[-1] if stack else None
+    for sink in _sinks:
+        sink.observe(kind, name, seconds, parent)
+
+
+def count(name: str, value=1):
+    """Add to a named counter, eg streak_cache_hit."""
+    if not enabled:
+        return
+    for sink in _sinks:
+        sink.increment(name, value)
+
+
+@lru_cache(maxsize=512)
+def _collapse(sql_query: str):
+    """Collapse the whitespace of a query, queries are labelled by their SQL."""
+    return ' '.join(sql_query.split())
+
+
+def query_label(sql_query: str, *args, **kwargs):
+    """Label the timings of a query with its SQL, whitespace collapsed."""
+    return _collapse(sql_query)
+
+
+def queries_label(queries, *args, **kwargs):
+    """Label the timings of a batch of (sql_query, parameters) pairs."""
+    return '; '.join(_collapse(x[0]) for x in queries)
+
+
+def timed(kind: str, name=None):
+    """Decorate a function to record the duration of every call while enabled.
+
+    :params: kind: group of the operation - query, read, connect or span
+    :params: name: label of the timings, or a callable receiving the call
+        arguments and returning it. The function name when omitted
+    :return: the decorator
+    """
+    def decorate(function):
+        label = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            # same as span(), inlined as it runs around every query
+            key = label(*args, **kwargs) if callable(label) else label
+            stack = getattr(_local, 'stack', None)
+            if stack is None:
+                stack = _local.stack = []
+            stack.append(key)
+            began = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = perf_counter() - began
+                stack.pop()
+                parent = stack[-1] if stack else None
+                for sink in _sinks:
+                    sink.observe(kind, key, seconds, parent)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def span(name: str, kind='span'):
+    """Time a block; timings recorded inside it name it as their parent."""
+    if not enabled:
+        yield
+        return
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(name)
+    began = perf_counter()
+    try:
+        yield
+    finally:
+        seconds = perf_counter() - began
+        stack.pop()
+        parent = stack[-1] if stack else None
+        for sink in _sinks:
+            sink.observe(kind, name, seconds, parent)
+
+
+def timed_iter(name: str, iterable, kind='span'):
+    """Time fetching every item of an iterable, eg rows streamed by a query.
+
+    :params: name: label of the timings
+    :params: iterable: iterable whose items are fetched one at a time
+    :params: kind: group of the operation - query, read, connect or span
+    :return: generator of the items of the iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        with span(name, kind):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+class HistogramSink:
+    """Keep latency histograms and counters in memory."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, kind, name, seconds, parent=None):
+        """Add a timing to the histogram of its kind and name.
+
+        :params: kind: group of the operation - query, read, connect or span
+        :params: name: label of the operation
+        :params: seconds: how long it took
+        :params: parent: label of the enclosing operation, not kept
+        """
+        with self._lock:
+            histogram = self._histograms.get((kind, name))
+            if histogram is None:
+                histogram = self._histograms[(kind, name)] = {'buckets': [0] * (len(self.buckets) + 1),
+                                                              'count': 0, 'sum': 0.0, 'max': 0.0}
+            histogram['buckets'][bisect_left(self.buckets, seconds)] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+
+    def increment(self, name, value=1):
+        """Add to a named counter.
+
+        :params: name: name of the counter
+        :params: value: amount added
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self):
+        """Return a copy of the histograms, counters and parse cache statistics.
+
+        :return: dictionary with histograms - {kind: {name: {buckets, count,
+            sum, max}}}, counters - {name: value} and parse_cache as returned
+            by parsing.parse_cache_info
+        """
+        with self._lock:
+            histograms = {}
+            for (kind, name), histogram in self._histograms.items():
+                histograms.setdefault(kind, {})[name] = dict(histogram, buckets=list(histogram['buckets']))
+            counters = dict(self._counters)
+        return {'histograms': histograms, 'counters': counters, 'parse_cache': parse_cache_info()}
+
+    def percentile(self, kind, name, fraction):
+        """Upper bound of the bucket holding the given fraction of the timings."""
+        with self._lock:
+            histogram = self._histograms.get((kind, name))
+            if not histogram:
+                return None
+            target = fraction * histogram['count']
+            seen = 0
+            for bound, hits in zip(self.buckets + (histogram['max'],), histogram['buckets']):
+                seen += hits
+                if seen >= target:
+                    return bound
+            return histogram['max']
+
+    def reset(self):
+        """Forget every timing and count recorded so far."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+class JsonLogSink:
+    """Write every timing and count as a line of JSON."""
+
+    def __init__(self, stream=None):
+        """Initialize the JSON log sink.
+
+        :params: stream: file name or writable text stream, stderr when omitted
+        """
+        self._owned = isinstance(stream, str)
+        self.stream = open(stream, 'a', encoding='utf-8') if self._owned else (stream or sys.stderr)
+        self._lock = threading.Lock()
+
+    def _write(self, record):
+        """Write a record as one line, whole even when threads log at once."""
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self.stream.write(line)
+
+    def observe(self, kind, name, seconds, parent=None):
+        """Log a timing with the time it was recorded at.
+
+        :params: kind: group of the operation - query, read, connect or span
+        :params: name: label of the operation
+        :params: seconds: how long it took
+        :params: parent: label of the enclosing operation, None at the top
+        """
+        self._write({'ts': time(), 'kind': kind, 'name': name, 'seconds': seconds, 'parent': parent})
+
+    def increment(self, name, value=1):
+        """Log an increment of a named counter.
+
+        :params: name: name of the counter
+        :params: value: amount added
+        """
+        self._write({'ts': time(), 'kind': 'count', 'name': name, 'value': value})
+
+    def flush(self):
+        """Flush the lines buffered by the stream."""
+        with self._lock:
+            self.stream.flush()
+
+    def close(self):
+        """Close the log file if the sink opened it."""
+        if self._owned:
+            with self._lock:
+                self.stream.close()
+
+
+def _escape(value):
+    """Escape a Prometheus label value."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PrometheusSink(HistogramSink):
+    """Keep histograms in memory and write them out in the Prometheus text format."""
+
+    def __init__(self, path: str, buckets=DEFAULT_BUCKETS, prefix='htp'):
+        """Initialize the Prometheus sink.
+
+        :params: path: file flush() writes the exposition to, eg for the
+            node exporter textfile collector
+        :params: buckets: upper bounds of the histogram buckets in seconds
+        :params: prefix: prefix of the metric names
+        """
+        super().__init__(buckets)
+        self.path = path
+        self.prefix = prefix
+
+    def exposition(self):
+        """Return the current metrics in the Prometheus text format."""
+        snapshot = self.snapshot()
+        lines = []
+        for kind, histograms in sorted(snapshot['histograms'].items()):
+            metric = f'{self.prefix}_{kind}_seconds'
+            lines += [f'# HELP {metric} Duration of {kind} operations.', f'# TYPE {metric} histogram']
+            for name, histogram in sorted(histograms.items()):
+                label = f'name="{_escape(name)}"'
+                cumulative = 0
+                for bound, hits in zip(self.buckets + ('+Inf',), histogram['buckets']):
+                    cumulative += hits
+                    lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label}}} {histogram["sum"]}')
+                lines.append(f'{metric}_count{{{label}}} {histogram["count"]}')
+
+        metric = f'{self.prefix}_events_total'
+        lines += [f'# HELP {metric} Number of times each instrumented event happened.', f'# TYPE {metric} counter']
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f'{metric}{{name="{_escape(name)}"}} {value}')
+
+        for field in ('hits', 'misses'):
+            metric = f'{self.prefix}_parse_cache_{field}_total'
+            lines += [f'# HELP {metric} Parse cache {field}.', f'# TYPE {metric} counter']
+            for cache, info in sorted(snapshot['parse_cache'].items()):
+                lines.append(f'{metric}{{cache="{cache}"}} {info[field]}')
+        return '\n'.join(lines) + '\n'
+
+    def flush(self):
+        """Replace the exposition file atomically so scrapers never read half of it."""
+        temporary = f'{self.path}.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(self.exposition())
+        os.replace(temporary, self.path)
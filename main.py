@@ -1,10 +1,15 @@
-import questionary
-from db import create_data_storage
-from counter import Counter
-from analyse import calculate_all_counters, get_all_habits, get_habits_periodically, habit_with_longest_streak
+import sys
 
 
 def cli():
+    # the interactive stack is only imported when the menu is used, batch
+    # commands start without it
+    import questionary
+    from db import create_data_storage
+    from counter import Counter
+    from analyse import (calculate_all_counters, get_all_habits, get_habits_periodically,
+                         habit_with_longest_streak, top_streaks)
+
     create_data_storage()
     stop = False
     while not stop:
@@ -42,7 +47,7 @@ def cli():
         elif choice == 'Analyze':
             my_pick = questionary.select('Which analysis would you like to see?',
                                          choices=['All Habits with same Periodicity', 'All Habits Streaks',
-                                                  'Any Habit Streak', 'Longest Streak Habit']).ask()
+                                                  'Any Habit Streak', 'Longest Streak Habit', 'Top Streaks']).ask()
             if my_pick == 'All Habits with same Periodicity':
                 frequency = questionary.select(
                     'Select habit periodicity to view',
@@ -58,6 +63,16 @@ def cli():
                 print(calculate_all_counters())
             elif my_pick == 'Longest Streak Habit':
                 print(habit_with_longest_streak())
+            elif my_pick == 'Top Streaks':
+                count = questionary.text('How many habits would you like to see?', default='10').ask()
+                rank_by = questionary.select('Rank habits by',
+                                             choices=['max_streak', 'streak']).ask()
+                frequency = questionary.select('Select habit periodicity to rank',
+                                               choices=['All', 'Daily', 'Weekly']).ask()
+                if not count.isdigit():
+                    print(f'ERROR: {count} is not a number of habits')
+                else:
+                    print(top_streaks(int(count), rank_by, None if frequency == 'All' else frequency))
             else:
                 print(f'Unknown request {my_pick}! Please check the spellings.')
         elif choice == 'Edit':
@@ -142,4 +157,7 @@ def cli():
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        import batch
+        sys.exit(batch.main())
     cli()
@@ -0,0 +1,291 @@
+def _create_tables(conn):
+    """Create the tables - habits and events, used by the counter app."""
+    conn.execute("""CREATE TABLE IF NOT EXISTS habits (
+            name TEXT NOT NULL PRIMARY KEY,
+            description TEXT,
+            entry_date TEXT,
+            start_date TEXT,
+            periodicity TEXT,
+            cut_off_style TEXT,
+            cut_off_time TEXT,
+            habit_status TEXT
+            )
+            """)
+    conn.execute("""CREATE TABLE IF NOT EXISTS events (
+            event_id   TEXT NOT NULL PRIMARY KEY,
+            habit_name TEXT,
+            event_date TEXT,
+            FOREIGN KEY (habit_name) REFERENCES habits (name)
+            )
+            """)
+
+
+def _index_events_by_habit_and_date(conn):
+    """Index events by habit name and event date for lookups and ranges."""
+    conn.execute('CREATE INDEX IF NOT EXISTS events_habit_name_event_date ON events (habit_name, event_date)')
+
+
+def _add_event_time_columns(conn):
+    """Store each event date as integer epoch seconds and day ordinal.
+
+    event_epoch counts the seconds of the stored wall clock time since
+    1970-01-01 00:00:00 and event_day is the proleptic Gregorian ordinal of the
+    date, the same value as datetime.toordinal().
+    """
+    conn.execute('ALTER TABLE events ADD COLUMN event_epoch INTEGER')
+    conn.execute('ALTER TABLE events ADD COLUMN event_day INTEGER')
+    conn.execute("""UPDATE events SET
+            event_epoch = CAST(strftime('%s', event_date) AS INTEGER),
+            event_day = CAST(julianday(date(event_date)) - 1721424.5 AS INTEGER)
+            """)
+    conn.execute('CREATE INDEX IF NOT EXISTS events_habit_name_event_day ON events (habit_name, event_day)')
+
+
+def _create_streaks_table(conn):
+    """Keep the last counted event day, streak and highest streak per habit."""
+    conn.execute("""CREATE TABLE IF NOT EXISTS streaks (
+            habit_name TEXT NOT NULL PRIMARY KEY,
+            last_day   INTEGER,
+            streak     INTEGER,
+            max_streak INTEGER,
+            FOREIGN KEY (habit_name) REFERENCES habits (name)
+            )
+            """)
+
+
+def _index_habits_by_periodicity(conn):
+    """Index habits in the order they are listed and analysed in."""
+    conn.execute('CREATE INDEX IF NOT EXISTS habits_periodicity_name ON habits (periodicity, name)')
+
+
+def _add_habit_data_version(conn):
+    """Count the changes made to each habit and its events.
+
+    Triggers bump habits.data_version whenever the habit or one of its events
+    is written, whichever function made the change, so readers can tell
+    whether anything they derived from the habit is still current.
+    """
+    conn.execute('ALTER TABLE habits ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0')
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS habits_update_data_version
+            AFTER UPDATE OF description, start_date, periodicity, cut_off_style, cut_off_time, habit_status
+            ON habits BEGIN
+                UPDATE habits SET data_version = data_version + 1 WHERE name = NEW.name;
+            END
+            """)
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS events_insert_data_version AFTER INSERT ON events BEGIN
+                UPDATE habits SET data_version = data_version + 1 WHERE name = NEW.habit_name;
+            END
+            """)
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS events_update_data_version AFTER UPDATE ON events BEGIN
+                UPDATE habits SET data_version = data_version + 1 WHERE name IN (OLD.habit_name, NEW.habit_name);
+            END
+            """)
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS events_delete_data_version AFTER DELETE ON events BEGIN
+                UPDATE habits SET data_version = data_version + 1 WHERE name = OLD.habit_name;
+            END
+            """)
+
+
+def _use_integer_habit_ids(conn):
+    """Key habits and events by integers instead of the habit name and uuid.
+
+    habits get a habit_id INTEGER PRIMARY KEY with name kept UNIQUE, events and
+    streaks refer to their habit by habit_id and events get an integer
+    event_key, the uuid event_id staying UNIQUE for lookups. Events are copied
+    grouped by habit and date so the events of a habit share pages. Events of
+    habits deleted earlier keep a NULL habit_id.
+    """
+    for trigger in ('habits_update_data_version', 'events_insert_data_version', 'events_update_data_version',
+                    'events_delete_data_version'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+
+    conn.execute("""CREATE TABLE habits_by_id (
+            habit_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            description TEXT,
+            entry_date TEXT,
+            start_date TEXT,
+            periodicity TEXT,
+            cut_off_style TEXT,
+            cut_off_time TEXT,
+            habit_status TEXT,
+            data_version INTEGER NOT NULL DEFAULT 0
+            )
+            """)
+    conn.execute("""INSERT INTO habits_by_id (name, description, entry_date, start_date, periodicity,
+                cut_off_style, cut_off_time, habit_status, data_version)
+            SELECT name, description, entry_date, start_date, periodicity, cut_off_style, cut_off_time,
+                habit_status, data_version
+            FROM habits ORDER BY entry_date, name
+            """)
+    conn.execute("""CREATE TABLE events_by_id (
+            event_key INTEGER PRIMARY KEY,
+            event_id TEXT NOT NULL UNIQUE,
+            habit_id INTEGER,
+            event_date TEXT,
+            event_epoch INTEGER,
+            event_day INTEGER,
+            FOREIGN KEY (habit_id) REFERENCES habits (habit_id)
+            )
+            """)
+    conn.execute("""INSERT INTO events_by_id (event_id, habit_id, event_date, event_epoch, event_day)
+            SELECT event_id, habit_id, event_date, event_epoch, event_day
+            FROM events LEFT JOIN habits_by_id ON habits_by_id.name = events.habit_name
+            ORDER BY habit_id, event_date
+            """)
+    conn.execute("""CREATE TABLE streaks_by_id (
+            habit_id   INTEGER NOT NULL PRIMARY KEY,
+            last_day   INTEGER,
+            streak     INTEGER,
+            max_streak INTEGER,
+            FOREIGN KEY (habit_id) REFERENCES habits (habit_id)
+            )
+            """)
+    conn.execute("""INSERT INTO streaks_by_id
+            SELECT habit_id, last_day, streak, max_streak
+            FROM streaks JOIN habits_by_id ON habits_by_id.name = streaks.habit_name
+            """)
+
+    for table in ('streaks', 'events', 'habits'):
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {table}_by_id RENAME TO {table}')
+    # the (habit_id, event_date) index also answers the day and streak lookups
+    conn.execute('CREATE INDEX habits_periodicity_name ON habits (periodicity, name)')
+    conn.execute('CREATE INDEX events_habit_id_event_date ON events (habit_id, event_date)')
+
+    conn.execute("""CREATE TRIGGER habits_update_data_version
+            AFTER UPDATE OF description, start_date, periodicity, cut_off_style, cut_off_time, habit_status
+            ON habits BEGIN
+                UPDATE habits SET data_version = data_version + 1 WHERE habit_id = NEW.habit_id;
+            END
+            """)
+    conn.execute("""CREATE TRIGGER events_insert_data_version AFTER INSERT ON events BEGIN
+                UPDATE habits SET data_version = data_version + 1 WHERE habit_id = NEW.habit_id;
+            END
+            """)
+    conn.execute("""CREATE TRIGGER events_update_data_version AFTER UPDATE ON events BEGIN
+                UPDATE habits SET data_version = data_version + 1 WHERE habit_id IN (OLD.habit_id, NEW.habit_id);
+            END
+            """)
+    conn.execute("""CREATE TRIGGER events_delete_data_version AFTER DELETE ON events BEGIN
+                UPDATE habits SET data_version = data_version + 1 WHERE habit_id = OLD.habit_id;
+            END
+            """)
+
+
+# bit of the day of the month of an event, and whether the event happened at
+# the time of day its habit requires, the same test as streaks.is_credible
+_DAY_BIT = '1 << (CAST(substr(event_date, 9, 2) AS INTEGER) - 1)'
+_CUT_OFF = "(CAST(substr(cut_off_time, 1, 2) AS INTEGER) * 3600 + CAST(substr(cut_off_time, 4, 2) AS INTEGER) * 60 " \
+           "+ CAST(substr(cut_off_time, 7, 2) AS INTEGER))"
+_CREDIBLE = f"""CASE cut_off_style WHEN 'IGNORE' THEN 1 WHEN 'ON' THEN event_epoch % 86400 = {_CUT_OFF}
+            WHEN 'BEFORE' THEN event_epoch % 86400 < {_CUT_OFF} WHEN 'AFTER' THEN event_epoch % 86400 > {_CUT_OFF}
+            ELSE 0 END"""
+_ROLLUP_ROWS = f"""INSERT INTO rollups (habit_id, month, events, days, credible)
+            SELECT habit_id, substr(event_date, 1, 7), count(*), sum(DISTINCT {_DAY_BIT}),
+                coalesce(sum(DISTINCT CASE WHEN {_CREDIBLE} THEN {_DAY_BIT} END), 0)
+            FROM events JOIN habits USING (habit_id) WHERE {{where}}
+            GROUP BY habit_id, substr(event_date, 1, 7)"""
+# recount one month of a habit, through the (habit_id, event_date) index
+_REFRESH_MONTH = """DELETE FROM rollups WHERE habit_id = {habit} AND month = substr({date}, 1, 7);
+            """ + _ROLLUP_ROWS.format(where="habit_id = {habit} AND event_date >= substr({date}, 1, 7) || '-01' "
+                                            "AND event_date < substr({date}, 1, 7) || '-32'") + ';'
+
+
+def _create_rollups(conn):
+    """Keep a rollup of the events of every habit per month.
+
+    Every row counts the events of a habit in a month and holds two bitmasks of
+    the days of the month, bit 0 being the 1st: the days with an event and the
+    days with an event satisfying the cut off style of the habit. Triggers add
+    new events to their month and recount the months of updated and deleted
+    events, and every month of a habit whose cut off changes, so windowed
+    analytics read one row per month instead of every event. Months without a
+    rollup row are not recounted when their events are deleted.
+    """
+    conn.execute("""CREATE TABLE rollups (
+            habit_id INTEGER NOT NULL,
+            month    TEXT NOT NULL,
+            events   INTEGER NOT NULL,
+            days     INTEGER NOT NULL,
+            credible INTEGER NOT NULL,
+            PRIMARY KEY (habit_id, month),
+            FOREIGN KEY (habit_id) REFERENCES habits (habit_id)
+            ) WITHOUT ROWID
+            """)
+    conn.execute(_ROLLUP_ROWS.format(where='habit_id IS NOT NULL'))
+    # a new event only adds to its month, no need to recount it
+    conn.execute(f"""CREATE TRIGGER events_insert_rollup AFTER INSERT ON events BEGIN
+                INSERT INTO rollups (habit_id, month, events, days, credible)
+                SELECT habit_id, substr(event_date, 1, 7), 1, {_DAY_BIT},
+                    CASE WHEN {_CREDIBLE} THEN {_DAY_BIT} ELSE 0 END
+                FROM (SELECT NEW.event_date AS event_date, NEW.event_epoch AS event_epoch), habits
+                WHERE habit_id = NEW.habit_id
+                ON CONFLICT (habit_id, month) DO UPDATE SET events = events + 1, days = days | excluded.days,
+                    credible = credible | excluded.credible;
+            END
+            """)
+    conn.execute(f"""CREATE TRIGGER events_update_rollup AFTER UPDATE OF habit_id, event_date ON events BEGIN
+                {_REFRESH_MONTH.format(habit='OLD.habit_id', date='OLD.event_date')}
+                {_REFRESH_MONTH.format(habit='NEW.habit_id', date='NEW.event_date')}
+            END
+            """)
+    # deleting a habit drops its rollups first, so its events skip the recount
+    conn.execute(f"""CREATE TRIGGER events_delete_rollup AFTER DELETE ON events
+            WHEN EXISTS (SELECT 1 FROM rollups WHERE habit_id = OLD.habit_id AND month = substr(OLD.event_date, 1, 7))
+            BEGIN
+                {_REFRESH_MONTH.format(habit='OLD.habit_id', date='OLD.event_date')}
+            END
+            """)
+    conn.execute(f"""CREATE TRIGGER habits_update_rollup AFTER UPDATE OF cut_off_style, cut_off_time ON habits BEGIN
+                DELETE FROM rollups WHERE habit_id = NEW.habit_id;
+                {_ROLLUP_ROWS.format(where='habit_id = NEW.habit_id')};
+            END
+            """)
+
+
+# Every migration runs once, in order, inside its own transaction. The index of
+# the last applied migration is kept in PRAGMA user_version so existing
+# databases are upgraded in place the next time they are opened.
+MIGRATIONS = [
+    _create_tables,
+    _index_events_by_habit_and_date,
+    _add_event_time_columns,
+    _create_streaks_table,
+    _index_habits_by_periodicity,
+    _add_habit_data_version,
+    _use_integer_habit_ids,
+    _create_rollups,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn):
+    """Return the schema version recorded in the database."""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=SCHEMA_VERSION):
+    """Apply every pending migration up to the target version.
+
+    :params: conn: open sqlite3 connection to the database to upgrade
+    :params: target: schema version to stop at, the latest by default
+    :return: list of the names of the migrations applied
+    """
+    applied = []
+    version = get_schema_version(conn)
+    while version < target:
+        migration = MIGRATIONS[version]
+        conn.commit()
+        conn.execute('BEGIN')
+        try:
+            migration(conn)
+            version += 1
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(migration.__name__)
+    return applied
@@ -0,0 +1,154 @@
+import time
+from datetime import datetime
+from functools import lru_cache
+
+# bounds of the caches; user input repeats little, stored dates repeat a lot
+INPUT_CACHE_SIZE = 4096
+STORED_CACHE_SIZE = 65536
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _is_canonical_datetime(value: str):
+    """Check if the value is shaped like YYYY-MM-DD hh:mm:ss."""
+    return len(value) == 19 and value[4] == '-' and value[7] == '-' and value[10] == ' ' and \
+        value[13] == ':' and value[16] == ':'
+
+
+def convert_time_to_24hrs_format(value: str):
+    """Convert 12hrs datetime value to 24hrs format.
+
+    :params: value: datetime value. Input format is YYYY-MM-DD hh:mm:ss AM
+    :return: returns datetime string value in equivalent 24hrs format
+    """
+    value = value.lower()
+    pm_add_twelve_hours = 0
+
+    if 'pm' in value:
+        pm_add_twelve_hours = 12
+        value = value.replace("pm", "")
+    elif 'am' in value:
+        value = value.replace("am", "")
+
+    value = value.rstrip()
+    value = value.lstrip()
+
+    return value, pm_add_twelve_hours
+
+
+@lru_cache(maxsize=INPUT_CACHE_SIZE)
+def normalize_datetime(value: str):
+    """Validate the date time input. Format YYYY-MM-DD hh:mm:ss AM.
+
+    Values already in the stored YYYY-MM-DD hh:mm:ss format skip the 12hrs
+    conversion and the reformatting.
+
+    :params: value: datetime value. Input format is YYYY-MM-DD hh:mm:ss AM
+    :return: returns valid datetime string - YYYY-MM-DD hh:mm:ss or the error
+    """
+    if _is_canonical_datetime(value):
+        try:
+            datetime.fromisoformat(value)
+            return value
+        except ValueError:
+            pass
+
+    value, patch_to_24hrs = convert_time_to_24hrs_format(value)
+
+    try:
+        check_date = datetime.fromisoformat(value)
+        valid_datetime = datetime(check_date.year, check_date.month,
+                                  check_date.day,
+                                  check_date.hour + patch_to_24hrs,
+                                  check_date.minute, check_date.second)
+        return valid_datetime.strftime("%Y-%m-%d %H:%M:%S")
+    except Exception as ex:
+        return f"ERROR: {ex.args}. Sample Date is 2024-01-31 05:19:03 AM"
+
+
+@lru_cache(maxsize=INPUT_CACHE_SIZE)
+def normalize_time(value: str):
+    """Validate the time input. Accepted input format hh:mm:ss AM.
+
+    :params: value: time value. Input format is hh:mm:ss A
+    :return: returns valid time string - hh:mm:ss or the error message
+    """
+    value, patch_to_24hrs = convert_time_to_24hrs_format(value)
+
+    try:
+        check_time = datetime.fromisoformat("1111-01-01 " + value)
+        valid_time = datetime(check_time.year, check_time.month,
+                              check_time.day,
+                              check_time.hour + patch_to_24hrs,
+                              check_time.minute, check_time.second)
+        return valid_time.strftime("%H:%M:%S")
+    except Exception as ex:
+        return f"ERROR: {ex.args}. Sample Time is 05:19:03 AM"
+
+
+@lru_cache(maxsize=STORED_CACHE_SIZE)
+def parse_datetime(value: str):
+    """Parse a stored YYYY-MM-DD hh:mm:ss string into a datetime.
+
+    :params: value: datetime string as stored in the database
+    :return: returns the datetime, shared between calls with the same value
+    """
+    return datetime.fromisoformat(value)
+
+
+def format_epoch(epoch: int):
+    """Format seconds since 1970-01-01 as a stored YYYY-MM-DD hh:mm:ss string.
+
+    :params: epoch: seconds, as in the event_epoch column
+    :return: returns the datetime string
+    """
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+def format_uuid(raw: bytes):
+    """Format the 16 bytes of a uuid like str(uuid.UUID(bytes=raw)), only faster.
+
+    :params: raw: the 16 bytes of the uuid
+    :return: returns the uuid string, as in the event_id column
+    """
+    x = raw.hex()
+    return f'{x[:8]}-{x[8:12]}-{x[12:16]}-{x[16:20]}-{x[20:]}'
+
+
+def event_time_columns(event_date: str):
+    """Return the integer columns stored along an event date.
+
+    :params: event_date: valid datetime string - YYYY-MM-DD hh:mm:ss
+    :return: returns (event_epoch, event_day) - seconds since 1970-01-01 and
+        the day ordinal of the date
+    """
+    event_datetime = parse_datetime(event_date)
+    return int((event_datetime - _EPOCH).total_seconds()), event_datetime.toordinal()
+
+
+def event_date_range(since=None, until=None):
+    """Return the event_date bounds of the days from since to until, inclusive.
+
+    :params: since: first day YYYY-MM-DD, unbounded when omitted
+    :params: until: last day YYYY-MM-DD, unbounded when omitted
+    :return: (lowest, highest) event_date strings for a BETWEEN
+    """
+    return (since or '0000-00-00')[:10], (until or '9999-12-31')[:10] + ' 23:59:59'
+
+
+_CACHED = {'datetime': normalize_datetime, 'time': normalize_time, 'stored': parse_datetime}
+
+
+def parse_cache_info():
+    """Return the hit and miss statistics of the parsing caches.
+
+    :return: dictionary of cache name - datetime (user input), time (user
+        input) and stored (dates read from the database), to a dictionary of
+        hits, misses, maxsize and currsize
+    """
+    return {name: function.cache_info()._asdict() for name, function in _CACHED.items()}
+
+
+def clear_parse_caches():
+    """Empty the parsing caches and reset their statistics."""
+    for function in _CACHED.values():
+        function.cache_clear()
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, unquote, parse_qs
+
+import db
+from analyse import calculate_all_counters, habit_with_longest_streak, read_counter, top_streaks
+
+# Routes of the service. GET responses carry an ETag built from the data
+# version of the habits they depend on, so polling clients get a 304 and the
+# streaks are only calculated again after a habit or its events changed.
+#
+#   GET  /habits                      ACTIVE habits
+#   POST /habits                      create a habit from the JSON body
+#   GET  /habits/<name>               one habit
+#   GET  /habits/<name>/events        events of the habit
+#   POST /habits/<name>/events        save an event, body {"event_date": ...}
+#   GET  /habits/<name>/streak        streak and highest streak of the habit
+#   GET  /streaks                     streaks of every ACTIVE habit
+#   GET  /streaks/top?k=&by=&periodicity=
+#   GET  /streaks/longest             habit with the longest streak
+
+RESPONSE_CACHE_SIZE = 1024
+_HABIT_FIELDS = ('name', 'description', 'start_date', 'periodicity', 'cut_off_style', 'cut_off_time',
+                 'habit_status')
+
+
+def _to_json(value):
+    """Convert query results and namedtuples to JSON serializable values."""
+    if hasattr(value, '_asdict'):
+        return value._asdict()
+    if isinstance(value, list):
+        return [_to_json(x) for x in value]
+    return value
+
+
+def _is_conflict(message: str):
+    """Check if an error message reports a duplicate or a violated constraint."""
+    message = message.lower()
+    return 'constraint' in message or 'already exists' in message
+
+
+def _error_status(result):
+    """Return the HTTP status of a result, 200 unless it is an error message.
+
+    Missing paths and habits are answered with 404 by the routes themselves,
+    before their result is known.
+    """
+    if isinstance(result, str) and 'ERROR' in result:
+        return 409 if _is_conflict(result) else 400
+    if isinstance(result, tuple) and not hasattr(result, '_asdict'):
+        return 409 if _is_conflict(' '.join(str(x) for x in result)) else 500
+    return 200
+
+
+def _etag_matches(header: str, etag: str):
+    """Check if an If-None-Match header lists the ETag, or is *.
+
+    Weak validators W/"..." match their strong ETag, as If-None-Match uses the
+    weak comparison.
+    """
+    for value in header.split(','):
+        value = value.strip()
+        if value == '*':
+            return True
+        if value.startswith('W/'):
+            value = value[2:]
+        if value == etag:
+            return True
+    return False
+
+
+def _habit_etag(name: str):
+    """ETag of everything derived from one habit, None if it does not exist."""
+    version = db.get_data_version(name)
+    if isinstance(version, str):
+        return None
+    # the entry date tells a habit apart from an older one with the same name
+    return f'"{hashlib.sha1(f"{name.upper()}|{version[0]}".encode()).hexdigest()[:12]}-{version[1]}"'
+
+
+def _all_habits_etag():
+    """ETag of everything derived from all the habits."""
+    versions = db.get_data_versions()
+    if isinstance(versions, str):
+        return None
+    return f'"{hashlib.sha1(repr(versions).encode()).hexdigest()[:20]}"'
+
+
+class _ResponseCache:
+    """Last JSON body sent for each path, valid for as long as its ETag."""
+
+    def __init__(self, size=RESPONSE_CACHE_SIZE):
+        self.size = size
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        with self._lock:
+            cached = self._bodies.get(key)
+        if cached is not None and cached[0] == etag:
+            return cached[1]
+        return None
+
+    def put(self, key, etag, body):
+        with self._lock:
+            if len(self._bodies) >= self.size:
+                self._bodies.clear()
+            self._bodies[key] = (etag, body)
+
+
+class HabitRequestHandler(BaseHTTPRequestHandler):
+    """Serve the habit tracker as JSON over persistent HTTP/1.1 connections."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server_version = 'HabitTrackerPlus/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, body=b'', etag=None):
+        """Write a response with a Content-Length so the connection stays open."""
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_result(self, result, success_status=200, etag=None, cache_key=None, error_status=None):
+        """Serialize a db or analyse result, messages go in a message field."""
+        status = error_status or _error_status(result)
+        if status == 200:
+            status = success_status
+        else:
+            etag = None
+        if isinstance(result, str):
+            result = {'error' if status >= 400 else 'message': result}
+        elif status == 500:
+            result = {'error': str(result)}
+        body = json.dumps(_to_json(result)).encode()
+        if etag and cache_key:
+            self.server.responses.put(cache_key, etag, body)
+        self._send(status, body, etag)
+
+    def _read_json(self):
+        """Read the JSON object sent as the request body."""
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        body = json.loads(self.rfile.read(length))
+        if not isinstance(body, dict):
+            raise ValueError('Request body must be a JSON object')
+        return body
+
+    def _route(self):
+        """Split the request path into its parts and query parameters."""
+        url = urlsplit(self.path)
+        parts = [unquote(x) for x in url.path.split('/') if x]
+        return parts, {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+    def _send_missing_habit(self, name: str):
+        """Answer 404 for a route of a habit that does not exist."""
+        self._send_result(f'ERROR: Habit {name} NOT found!', error_status=404)
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts[:1] == ['habits'] and len(parts) > 1:
+            etag = _habit_etag(parts[1])
+            if etag is None:
+                self._send_missing_habit(parts[1])
+                return
+        else:
+            etag = _all_habits_etag()
+
+        if etag and _etag_matches(self.headers.get('If-None-Match', ''), etag):
+            self._send(304, etag=etag)
+            return
+        cached = self.server.responses.get(self.path, etag) if etag else None
+        if cached is not None:
+            self._send(200, cached, etag)
+            return
+
+        if parts == ['habits']:
+            result = db.get_habits()
+        elif len(parts) == 2 and parts[0] == 'habits':
+            result = db.get_habit(parts[1])
+        elif len(parts) == 3 and parts[0] == 'habits' and parts[2] == 'events':
+            result = db.get_events(parts[1])
+        elif len(parts) == 3 and parts[0] == 'habits' and parts[2] == 'streak':
+            # GETs never write, the ETag already spares polling clients the recalculation
+            result = read_counter(parts[1])[0]
+        elif parts == ['streaks']:
+            result = calculate_all_counters()
+        elif parts == ['streaks', 'top']:
+            result = top_streaks(query.get('k', 10), query.get('by', 'max_streak'), query.get('periodicity'),
+                                 query.get('tie_break', 'name'))
+        elif parts == ['streaks', 'longest']:
+            result = habit_with_longest_streak()
+        else:
+            self._send_result(f'ERROR: Requested path {self.path} NOT found!', error_status=404)
+            return
+        self._send_result(result, etag=etag, cache_key=self.path)
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        parts, _ = self._route()
+        try:
+            body = self._read_json()
+        except ValueError as ex:
+            self._send_result(f'ERROR: {ex.args}')
+            return
+
+        if parts == ['habits']:
+            fields = {x: str(body[x]) for x in _HABIT_FIELDS if body.get(x)}
+            if 'name' not in fields:
+                self._send_result('ERROR: Habit name is required')
+                return
+            fields.setdefault('description', '')
+            result = db.save_habit(**fields)
+        elif len(parts) == 3 and parts[0] == 'habits' and parts[2] == 'events':
+            if 'ERROR' in db.get_habit(parts[1]):
+                self._send_missing_habit(parts[1])
+                return
+            result = db.save_event(parts[1], str(body.get('event_date', '')))
+        else:
+            self._send_result(f'ERROR: Requested path {self.path} NOT found!', error_status=404)
+            return
+        self._send_result(result, success_status=201)
+
+
+class HabitService(ThreadingHTTPServer):
+    """Threaded HTTP server, every connection is served by its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, address, verbose=False):
+        super().__init__(address, HabitRequestHandler)
+        self.verbose = verbose
+        self.responses = _ResponseCache()
+
+
+def create_service(host='127.0.0.1', port=8000, database='main.db', profile='balanced', pool_size=8,
+                   verbose=False):
+    """Open the database and bind the HTTP service without serving yet.
+
+    :params: host: interface the service listens on
+    :params: port: port the service listens on, 0 picks a free one
+    :params: database: database file name
+    :params: profile: storage profile - durable/balanced/ingest
+    :params: pool_size: number of reader connections kept open for the
+        concurrent requests
+    :params: verbose: log every request to stderr
+    :return: the HabitService, call serve_forever() to start it
+    """
+    db.create_data_storage(database, pool_size=pool_size, profile=profile)
+    return HabitService((host, port), verbose)
+
+
+def serve(host='127.0.0.1', port=8000, database='main.db', profile='balanced'):
+    """Serve the habit tracker over HTTP until interrupted."""
+    service = create_service(host, port, database, profile, verbose=True)
+    print(f'Habit Tracker Plus serving on http://{host}:{service.server_address[1]}')
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+        db.close_data_storage()
+
+
+if __name__ == '__main__':
+    serve(*[cast(x) for cast, x in zip((str, int, str, str), sys.argv[1:5])])
@@ -0,0 +1,399 @@
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import db
+from db import Event, Habit, TimedEvent
+from parsing import event_time_columns, format_epoch, format_uuid
+
+FORMAT_VERSION = 1
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+# habit columns kept as strings, the dates are stored as int64 epoch seconds
+_TEXT_COLUMNS = ('description', 'periodicity', 'cut_off_style', 'cut_off_time', 'habit_status')
+_DATE_COLUMNS = ('entry_date', 'start_date')
+_SUFFIXES = {'parquet': '.parquet', 'npz': '.npz'}
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def available_formats():
+    """Return the snapshot formats the installed packages can write, best first."""
+    if _import_numpy() is None:
+        return []
+    return (['parquet'] if _import_pyarrow() is not None else []) + ['npz']
+
+
+def _read_columns():
+    """Read every habit and event in one read transaction of the database.
+
+    :return: (habits, event_habit, event_epoch, event_id) - the habits ordered
+        by periodicity and name, then for every event the position of its
+        habit, its epoch seconds and the 16 bytes of its uuid, ordered by
+        habit and date
+    """
+    np = _import_numpy()
+    habits, rows = db.export_rows()
+    positions = {x.name: number for number, x in enumerate(habits)}
+    event_habit, event_epoch, event_id = [], [], []
+    for name, epoch, identifier in rows:
+        position = positions.get(name)
+        if position is not None:
+            event_habit.append(position)
+            event_epoch.append(epoch)
+            event_id.append(uuid.UUID(identifier).bytes)
+
+    event_habit = np.array(event_habit, dtype=np.int32)
+    event_epoch = np.array(event_epoch, dtype=np.int64)
+    event_id = np.array(event_id, dtype='S16')
+    order = np.lexsort((event_epoch, event_habit))
+    return habits, event_habit[order], event_epoch[order], event_id[order]
+
+
+def _habit_columns(habits):
+    """Split the habits into a dictionary of columns, dates as epoch seconds."""
+    columns = {'name': [x.name for x in habits]}
+    for column in _TEXT_COLUMNS:
+        columns[column] = [getattr(x, column) for x in habits]
+    for column in _DATE_COLUMNS:
+        columns[column] = [event_time_columns(getattr(x, column))[0] for x in habits]
+    return columns
+
+
+def _habits_from_columns(columns):
+    """Rebuild the habit namedtuples out of their columns."""
+    return [Habit(name, description, format_epoch(entry_date), format_epoch(start_date), periodicity,
+                  cut_off_style, cut_off_time, habit_status)
+            for name, description, entry_date, start_date, periodicity, cut_off_style, cut_off_time,
+            habit_status in zip(columns['name'], columns['description'], columns['entry_date'],
+                                columns['start_date'], columns['periodicity'], columns['cut_off_style'],
+                                columns['cut_off_time'], columns['habit_status'])]
+
+
+def _write_parquet(path: str, meta, habits, event_habit, event_epoch, event_id):
+    """Write the events as a Parquet table, habits in its key-value metadata.
+
+    The habit column is dictionary encoded, its indices point into the
+    habits so the names are stored once.
+    """
+    pa = _import_pyarrow()
+    names = pa.array([x.name for x in habits], type=pa.string())
+    table = pa.table({
+        'habit': pa.DictionaryArray.from_arrays(pa.array(event_habit, type=pa.int32()), names),
+        'event_epoch': pa.array(event_epoch, type=pa.int64()),
+        'event_id': pa.Array.from_buffers(pa.binary(16), len(event_id), [None, pa.py_buffer(event_id.tobytes())]),
+    })
+    columns = _habit_columns(habits)
+    table = table.replace_schema_metadata({'htp.meta': json.dumps(meta), 'htp.habits': json.dumps(columns)})
+    pa.parquet.write_table(table, path, compression='zstd')
+
+
+def _read_parquet(path: str):
+    np = _import_numpy()
+    pa = _import_pyarrow()
+    table = pa.parquet.read_table(path)
+    metadata = table.schema.metadata
+    meta = json.loads(metadata[b'htp.meta'])
+    habits = _habits_from_columns(json.loads(metadata[b'htp.habits']))
+    positions = {x.name: number for number, x in enumerate(habits)}
+    # readers may encode the dictionary again per chunk, so the names are
+    # mapped back to the positions of the habits
+    codes = []
+    for chunk in table.column('habit').chunks:
+        lookup = np.array([positions[x] for x in chunk.dictionary.to_pylist()], dtype=np.int32)
+        codes.append(lookup[chunk.indices.to_numpy(zero_copy_only=False)])
+    event_habit = np.concatenate(codes) if codes else np.empty(0, dtype=np.int32)
+    event_epoch = table.column('event_epoch').to_numpy()
+    event_id = np.array(table.column('event_id').to_pylist(), dtype='S16')
+    return Snapshot(habits, event_habit, event_epoch, event_id, meta)
+
+
+def _write_npz(path: str, meta, habits, event_habit, event_epoch, event_id):
+    """Write the habit and event columns as arrays of a compressed npz file."""
+    np = _import_numpy()
+    arrays = {}
+    for column, values in _habit_columns(habits).items():
+        if column in _DATE_COLUMNS:
+            arrays[f'habit_{column}'] = np.array(values, dtype=np.int64)
+        else:
+            # numpy strings have no None, it is stored as '' flagged in a mask
+            arrays[f'habit_{column}'] = np.array(['' if x is None else x for x in values], dtype=str)
+            arrays[f'null_{column}'] = np.array([x is None for x in values], dtype=bool)
+    np.savez_compressed(path, meta=np.array(json.dumps(meta)), event_habit=event_habit, event_epoch=event_epoch,
+                        event_id=event_id, **arrays)
+
+
+def _read_npz(path: str):
+    np = _import_numpy()
+    with np.load(path, allow_pickle=False) as arrays:
+        meta = json.loads(str(arrays['meta']))
+        columns = {key[len('habit_'):]: arrays[key].tolist() for key in arrays.files if key.startswith('habit_')}
+        for column in _TEXT_COLUMNS:
+            if f'null_{column}' in arrays.files:
+                columns[column] = [None if null else x
+                                   for x, null in zip(columns[column], arrays[f'null_{column}'].tolist())]
+        habits = _habits_from_columns(columns)
+        return Snapshot(habits, arrays['event_habit'], arrays['event_epoch'], arrays['event_id'], meta)
+
+
+def export_snapshot(path: str, file_format=None):
+    """Write every habit and event of the database into a columnar file.
+
+    Habit names are dictionary encoded - every event stores the position of
+    its habit - and dates are int64 seconds since 1970-01-01. The database
+    is read in a single transaction, so the snapshot is a consistent copy.
+
+    :params: path: file to write, the suffix of the format is added when missing
+    :params: file_format: parquet (needs pyarrow) or npz (needs numpy). The
+        best available one when omitted
+    :return: message showing the file written and its size or the error
+        encountered
+    """
+    formats = available_formats()
+    if not formats:
+        return 'ERROR: numpy is not installed, snapshots are unavailable'
+    file_format = file_format or formats[0]
+    if file_format not in formats:
+        return f'ERROR: Available snapshot formats are {"/".join(formats)} NOT [{file_format}]'
+    if not path.endswith(_SUFFIXES[file_format]):
+        path += _SUFFIXES[file_format]
+
+    try:
+        habits, event_habit, event_epoch, event_id = _read_columns()
+        meta = {'version': FORMAT_VERSION, 'database': db.get_database_name(),
+                'created': datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                'habits': len(habits), 'events': len(event_epoch)}
+        writer = _write_parquet if file_format == 'parquet' else _write_npz
+        writer(path, meta, habits, event_habit, event_epoch, event_id)
+    except Exception as ex:
+        return ex.args
+    return f'SUCCESS: {len(habits)} habits and {len(event_epoch)} events written to {path} ' \
+           f'({os.path.getsize(path)} bytes)'
+
+
+def read_snapshot(path: str):
+    """Load a snapshot written by export_snapshot.
+
+    :params: path: .parquet or .npz snapshot file
+    :return: the Snapshot or a message showing the error encountered
+    """
+    if _import_numpy() is None:
+        return 'ERROR: numpy is not installed, snapshots are unavailable'
+    if path.endswith('.parquet') and _import_pyarrow() is None:
+        return 'ERROR: pyarrow is not installed, Parquet snapshots are unavailable'
+    try:
+        snapshot = _read_parquet(path) if path.endswith('.parquet') else _read_npz(path)
+    except Exception as ex:
+        return ex.args
+    if snapshot.meta.get('version') != FORMAT_VERSION:
+        return f'ERROR: {path} is not a version {FORMAT_VERSION} snapshot'
+    return snapshot
+
+
+def _read_only(*args, **kwargs):
+    return 'ERROR: Snapshots are read-only'
+
+
+class Snapshot:
+    """Habits and events loaded from a snapshot file, read-only.
+
+    It answers the reads of a storage backend, so the analyse functions take
+    it as their backend and never touch the database. Streaks calculated
+    from it are cached in memory.
+    """
+
+    save_habit = update_habit = delete_habit = staticmethod(_read_only)
+    save_event = save_events_bulk = update_event = delete_event = delete_events = staticmethod(_read_only)
+
+    def __init__(self, habits, event_habit, event_epoch, event_id, meta):
+        """Initialize the snapshot with its columns.
+
+        :params: habits: namedtuple list of the habits
+        :params: event_habit: int32 array of the position of the habit of every
+            event, ascending
+        :params: event_epoch: int64 array of the epoch seconds of every event,
+            ascending for every habit
+        :params: event_id: array of the 16 bytes of every event uuid
+        :params: meta: dictionary describing the snapshot
+        """
+        np = _import_numpy()
+        self.habits = habits
+        self.event_habit = event_habit
+        self.event_epoch = event_epoch
+        self.event_id = event_id
+        self.meta = meta
+        self._positions = {x.name: number for number, x in enumerate(habits)}
+        # the events of habit x are event_epoch[bounds[x]:bounds[x + 1]]
+        self._bounds = np.searchsorted(event_habit, np.arange(len(habits) + 1))
+        self._streaks = {}
+
+    def _slice(self, name: str):
+        position = self._positions.get(name.upper())
+        if position is None:
+            return slice(0, 0)
+        return slice(int(self._bounds[position]), int(self._bounds[position + 1]))
+
+    def _active(self, periodicity=None):
+        return [x for x in self.habits if x.habit_status == 'ACTIVE' and
+                (not periodicity or x.periodicity == periodicity.capitalize())]
+
+    def get_habits(self):
+        """Retrieve the ACTIVE habits of the snapshot. See db.get_habits.
+
+        :return: namedtuple list of the habits ordered by periodicity and name
+            or a message showing no habit was found
+        """
+        return self._active() or 'ERROR: Requested item(s) NOT found!'
+
+    def get_habit(self, name: str):
+        """Retrieve a habit of the snapshot by its name. See db.get_habit.
+
+        :params: name: name of the habit
+        :return: namedtuple of the habit or a message showing it was not found
+        """
+        position = self._positions.get(name.upper())
+        return self.habits[position] if position is not None else "ERROR: Requested item NOT found!"
+
+    def get_habits_by_periodicity(self, frequency: str):
+        """Retrieve the ACTIVE habits of a periodicity. See db.get_habits_by_periodicity.
+
+        :params: frequency: Daily or Weekly
+        :return: namedtuple list of the habits ordered by name or a message
+            showing no habit was found
+        """
+        return self._active(frequency) or 'ERROR: Requested item(s) NOT found!'
+
+    def habit_days(self, name: str):
+        """Return the events of the habit as an int64 array of (event_day, event_epoch) rows."""
+        np = _import_numpy()
+        epochs = self.event_epoch[self._slice(name)]
+        return np.column_stack((epochs // 86400 + _EPOCH_ORDINAL, epochs))
+
+    def iter_habit_days(self, periodicity=None):
+        """Stream the ACTIVE habits with the arrays of habit_days."""
+        for habit in self._active(periodicity):
+            yield habit, self.habit_days(habit.name)
+
+    def _timed_events(self, name: str):
+        part = self._slice(name)
+        return [TimedEvent(format_uuid(identifier.ljust(16, b'\x00')), name.upper(), format_epoch(epoch),
+                           epoch // 86400 + _EPOCH_ORDINAL, epoch)
+                for identifier, epoch in zip(self.event_id[part].tolist(), self.event_epoch[part].tolist())]
+
+    def iter_habits_with_events(self, names=None, periodicity=None):
+        """Stream the ACTIVE habits with their events. See db.iter_habits_with_events.
+
+        :params: names: optional names of the habits to stream
+        :params: periodicity: optional periodicity - Daily or Weekly
+        :return: generator of (habit, TimedEvent list ordered by date) pairs
+        """
+        for habit in self._active(periodicity):
+            if names is None or habit.name in names:
+                yield habit, self._timed_events(habit.name)
+
+    def get_events(self, name: str):
+        """Retrieve the events of a habit. See db.get_events.
+
+        :params: name: name of the habit
+        :return: namedtuple list of the events ordered by date or a message
+            showing no event was found
+        """
+        events = [Event(*x[:3]) for x in self._timed_events(name)]
+        return events or f'ERROR: There are no events for habit {name.upper()} in our database'
+
+    def get_event_days(self, name: str, since=None, until=None):
+        """Retrieve the day ordinal and epoch seconds of the habit events. See db.get_event_days.
+
+        :params: name: name of the habit
+        :params: since: first day YYYY-MM-DD of the events, all of them when omitted
+        :params: until: last day YYYY-MM-DD of the events, all of them when omitted
+        :return: list of (event_day, event_epoch) tuples ordered by date or a
+            message showing no event was found
+        """
+        days = self.habit_days(name)
+        if since is not None or until is not None:
+            lowest = datetime.fromisoformat((since or '0001-01-01')[:10]).toordinal()
+            highest = datetime.fromisoformat((until or '9999-12-31')[:10]).toordinal()
+            days = days[days[:, 0].searchsorted(lowest):days[:, 0].searchsorted(highest, 'right')]
+        days = days.tolist()
+        return [tuple(x) for x in days] or f'ERROR: There are no events for habit {name.upper()} in our database'
+
+    def get_event(self, event_id: str):
+        """Retrieve an event by its event_id. See db.get_event.
+
+        :params: event_id: event_id of the event
+        :return: namedtuple of the event or a message showing it was not found
+        """
+        try:
+            raw = uuid.UUID(event_id).bytes
+        except ValueError:
+            return "ERROR: Requested item NOT found!"
+        found = (self.event_id == raw).nonzero()[0]
+        if not len(found):
+            return "ERROR: Requested item NOT found!"
+        position = int(found[0])
+        name = self.habits[int(self.event_habit[position])].name
+        return Event(event_id, name, format_epoch(int(self.event_epoch[position])))
+
+    def get_events_by_name_event_date(self, name: str, event_date: str):
+        """Retrieve the events of a habit on the day of a date. See db.get_events_by_name_event_date.
+
+        :params: name: name of the habit
+        :params: event_date: valid datetime string - YYYY-MM-DD hh:mm:ss
+        :return: namedtuple list of the events found
+        """
+        day = event_time_columns(event_date[:10] + ' 00:00:00')[1]
+        return [Event(*x[:3]) for x in self._timed_events(name) if x.event_day == day]
+
+    def get_streak_state(self, name: str):
+        """Retrieve the streaks calculated from the snapshot. See db.get_streak_state.
+
+        :params: name: name of the habit
+        :return: tuple of last_day (None), streak and max_streak or a message
+            showing no streak was calculated yet
+        """
+        state = self._streaks.get(name.upper())
+        return state if state is not None else "ERROR: Requested item NOT found!"
+
+    def save_streak_state(self, name: str, streak: int, max_streak: int):
+        """Keep the streaks calculated from the snapshot in memory.
+
+        :params: name: name of the habit
+        :params: streak: current streak of the habit
+        :params: max_streak: highest streak of the habit
+        """
+        self._streaks[name.upper()] = (None, streak, max_streak)
+
+    def get_data_version(self, name: str):
+        """Retrieve the data version of a habit. See db.get_data_version.
+
+        :params: name: name of the habit
+        :return: tuple of the habit entry date and 0, a snapshot never
+            changes, or a message showing the habit was not found
+        """
+        habit = self.get_habit(name)
+        return habit if isinstance(habit, str) else (habit.entry_date, 0)
+
+    @contextmanager
+    def transaction(self):
+        """Nothing to group, the snapshot is read-only.
+
+        :return: yields the snapshot itself
+        """
+        yield self
@@ -0,0 +1,571 @@
+import threading
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Protocol
+import uuid
+
+import db
+from db import Habit, Event, TimedEvent
+from parsing import event_date_range, event_time_columns, normalize_datetime, parse_datetime
+from streaks import advance_streak, cut_off_seconds
+from validation import STREAK_COLUMNS, validate_habit
+
+
+class StorageBackend(Protocol):
+    """Operations the counter and the analytics need from a storage backend.
+
+    Every method behaves like the db function of the same name, including the
+    messages returned on success and on error.
+    """
+
+    def save_habit(self, name: str, description: str, start_date="", periodicity="Daily",
+                   cut_off_style="IGNORE", cut_off_time="00:00:00", habit_status="ACTIVE"): ...
+
+    def get_habits(self): ...
+
+    def get_habit(self, name: str): ...
+
+    def get_habits_by_periodicity(self, frequency: str): ...
+
+    def iter_habits_with_events(self, names=None, periodicity=None): ...
+
+    def update_habit(self, name: str, description="", start_date="", periodicity="",
+                     cut_off_style="", cut_off_time="", habit_status=""): ...
+
+    def delete_habit(self, name: str): ...
+
+    def save_event(self, name: str, event_date=""): ...
+
+    def save_events_bulk(self, events, chunk_size=500, on_result=None): ...
+
+    def get_event(self, event_id: str): ...
+
+    def get_events(self, name: str): ...
+
+    def get_event_days(self, name: str, since=None, until=None): ...
+
+    def get_events_by_name_event_date(self, name: str, event_date: str): ...
+
+    def update_event(self, event_id: str, name, event_date): ...
+
+    def delete_event(self, event_id: str): ...
+
+    def delete_events(self, name: str): ...
+
+    def get_streak_state(self, name: str): ...
+
+    def save_streak_state(self, name: str, streak: int, max_streak: int): ...
+
+    def get_data_version(self, name: str): ...
+
+    def transaction(self): ...
+
+
+class SQLiteBackend:
+    """Storage in the sqlite3 database opened by db.create_data_storage."""
+
+    save_habit = staticmethod(db.save_habit)
+    get_habits = staticmethod(db.get_habits)
+    get_habit = staticmethod(db.get_habit)
+    get_habits_by_periodicity = staticmethod(db.get_habits_by_periodicity)
+    update_habit = staticmethod(db.update_habit)
+    delete_habit = staticmethod(db.delete_habit)
+    save_event = staticmethod(db.save_event)
+    save_events_bulk = staticmethod(db.save_events_bulk)
+    get_event = staticmethod(db.get_event)
+    get_events = staticmethod(db.get_events)
+    get_event_days = staticmethod(db.get_event_days)
+    get_rollups = staticmethod(db.get_rollups)
+    get_events_by_name_event_date = staticmethod(db.get_events_by_name_event_date)
+    update_event = staticmethod(db.update_event)
+    delete_event = staticmethod(db.delete_event)
+    delete_events = staticmethod(db.delete_events)
+    get_streak_state = staticmethod(db.get_streak_state)
+    save_streak_state = staticmethod(db.save_streak_state)
+    get_data_version = staticmethod(db.get_data_version)
+    transaction = staticmethod(db.transaction)
+
+    @staticmethod
+    def iter_habits_with_events(names=None, periodicity=None):
+        """Stream the ACTIVE habits with their events. See db.iter_habits_with_events.
+
+        :params: names: optional names of the habits to stream
+        :params: periodicity: optional periodicity - Daily or Weekly
+        :return: generator of (habit, TimedEvent list ordered by date) pairs,
+            read through a pooled connection
+        """
+        return db.iter_habits_with_events(names, periodicity=periodicity)
+
+
+_MISSING = object()
+
+
+class MemoryBackend:
+    """Storage kept in memory, lost when the process ends.
+
+    Events are kept in a dictionary by event_id and, per habit, in a list of
+    (event_date, event_id) sorted by date, so same day checks and date ordered
+    reads are binary searches instead of scans.
+    """
+
+    def __init__(self):
+        self._habits = {}
+        self._events = {}
+        self._by_habit = {}
+        self._streaks = {}
+        # writes per habit, only ever growing so rolled back writes count too
+        self._versions = {}
+        self._lock = threading.RLock()
+        # undo actions of the running transaction, None outside of one
+        self._undo = None
+
+    @contextmanager
+    def transaction(self):
+        """Group the changes of the block, undone if the block raises.
+
+        :return: yields the backend itself
+        """
+        with self._lock:
+            outermost = self._undo is None
+            if outermost:
+                self._undo = []
+            mark = len(self._undo)
+            try:
+                yield self
+            except BaseException:
+                for undo in reversed(self._undo[mark:]):
+                    undo()
+                del self._undo[mark:]
+                raise
+            finally:
+                if outermost:
+                    self._undo = None
+
+    def _set(self, mapping, key, value):
+        """Set a key, recording how to restore its previous value."""
+        old = mapping.get(key, _MISSING)
+        mapping[key] = value
+        if self._undo is not None:
+            self._undo.append(lambda: mapping.pop(key) if old is _MISSING else mapping.__setitem__(key, old))
+
+    def _pop(self, mapping, key):
+        """Remove a key, recording how to put it back."""
+        old = mapping.pop(key, _MISSING)
+        if old is not _MISSING and self._undo is not None:
+            self._undo.append(lambda: mapping.__setitem__(key, old))
+
+    def _insert_event(self, event):
+        """Index a TimedEvent by id and in the date ordered list of its habit."""
+        self._set(self._events, event.event_id, event)
+        dates = self._by_habit.get(event.habit_name)
+        if dates is None:
+            dates = []
+            self._set(self._by_habit, event.habit_name, dates)
+        item = (event.event_date, event.event_id)
+        insort(dates, item)
+        self._versions[event.habit_name] = self._versions.get(event.habit_name, 0) + 1
+        if self._undo is not None:
+            self._undo.append(lambda: dates.remove(item))
+
+    def _remove_event(self, event_id):
+        """Drop an event from both indexes."""
+        event = self._events[event_id]
+        self._pop(self._events, event_id)
+        dates = self._by_habit[event.habit_name]
+        item = (event.event_date, event_id)
+        dates.remove(item)
+        self._versions[event.habit_name] = self._versions.get(event.habit_name, 0) + 1
+        if self._undo is not None:
+            self._undo.append(lambda: insort(dates, item))
+
+    def _day_events(self, name: str, event_date: str):
+        """Events of the habit on the same day as the given valid datetime."""
+        dates = self._by_habit.get(name, [])
+        day_start = event_date[:10]
+        day_end = (parse_datetime(event_date) + timedelta(days=1)).strftime("%Y-%m-%d")
+        position = bisect_left(dates, (day_start,))
+        found = []
+        while position < len(dates) and dates[position][0] < day_end:
+            found.append(self._events[dates[position][1]])
+            position += 1
+        return found
+
+    @staticmethod
+    def _event(event):
+        return Event(event.event_id, event.habit_name, event.event_date)
+
+    def _timed_event(self, event_id: str, name: str, event_date: str):
+        return TimedEvent(event_id, name, event_date, *reversed(event_time_columns(event_date)))
+
+    def _sorted_events(self, name: str):
+        return [self._events[x[1]] for x in self._by_habit.get(name, [])]
+
+    def save_habit(self, name: str, description: str, start_date="", periodicity="Daily",
+                   cut_off_style="IGNORE", cut_off_time="00:00:00", habit_status="ACTIVE"):
+        """Create a new habit. See db.save_habit.
+
+        :params: name: is the name of the habit
+        :params: description: is the description of the habit
+        :params: start_date: is the datetime the app starts analyzing events
+            for the habit, now when omitted
+        :params: periodicity: is the expected frequency for the habit - Daily
+            or Weekly
+        :params: cut_off_style: IGNORE/ON/BEFORE/AFTER
+        :params: cut_off_time: is the threshold time for the habit
+        :params: habit_status: ACTIVE/COMPLETED
+        :return: message showing the habit was created, the error message or,
+            for an existing habit, the error as a tuple like sqlite3 reports it
+        """
+        result = validate_habit(name, description, start_date, periodicity, cut_off_style, cut_off_time,
+                                habit_status)
+        if isinstance(result, str):
+            return result
+        name, description, start_date, periodicity, cut_off_style, cut_off_time, habit_status = result
+
+        current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.transaction():
+            if name in self._habits:
+                return ('UNIQUE constraint failed: habits.name',)
+            self._set(self._habits, name, Habit(name, description, current_date, start_date or current_date,
+                                                periodicity, cut_off_style, cut_off_time, habit_status))
+        return 'Habit {} successfully created!'.format(name)
+
+    def get_habits(self):
+        """Retrieve all the ACTIVE habits. See db.get_habits.
+
+        :return: namedtuple list of the habits ordered by periodicity and name
+            or a message showing no habit was found
+        """
+        with self._lock:
+            habits = sorted((x for x in self._habits.values() if x.habit_status == 'ACTIVE'),
+                            key=lambda x: (x.periodicity, x.name))
+        return habits if habits else 'ERROR: Requested item(s) NOT found!'
+
+    def get_habit(self, name: str):
+        """Retrieve a habit by its name. See db.get_habit.
+
+        :params: name: name of the habit
+        :return: namedtuple of the habit or a message showing it was not found
+        """
+        habit = self._habits.get(name.upper())
+        return habit if habit is not None else "ERROR: Requested item NOT found!"
+
+    def get_habits_by_periodicity(self, frequency: str):
+        """Retrieve the ACTIVE habits of a periodicity. See db.get_habits_by_periodicity.
+
+        :params: frequency: Daily or Weekly
+        :return: namedtuple list of the habits ordered by name or a message
+            showing no habit was found
+        """
+        frequency = frequency.capitalize()
+        with self._lock:
+            habits = sorted((x for x in self._habits.values()
+                             if x.habit_status == 'ACTIVE' and x.periodicity == frequency), key=lambda x: x.name)
+        return habits if habits else 'ERROR: Requested item(s) NOT found!'
+
+    def iter_habits_with_events(self, names=None, periodicity=None):
+        """Stream the ACTIVE habits with their events. See db.iter_habits_with_events.
+
+        :params: names: optional names of the habits to stream
+        :params: periodicity: optional periodicity - Daily or Weekly
+        :return: generator of (habit, TimedEvent list ordered by date) pairs
+        """
+        with self._lock:
+            habits = sorted((x for x in self._habits.values() if x.habit_status == 'ACTIVE'
+                             and (names is None or x.name in names)
+                             and (not periodicity or x.periodicity == periodicity.capitalize())),
+                            key=lambda x: (x.periodicity, x.name))
+        for habit in habits:
+            with self._lock:
+                events = self._sorted_events(habit.name)
+            yield habit, events
+
+    def update_habit(self, name: str, description="", start_date="", periodicity="",
+                     cut_off_style="", cut_off_time="", habit_status=""):
+        """Edit the fields of an existing habit. See db.update_habit.
+
+        Changing a field the streaks depend on drops the stored streak state.
+
+        :params: name: name of the habit to be updated
+        :params: description, start_date, periodicity, cut_off_style,
+            cut_off_time, habit_status: new values, unchanged when empty
+        :return: message showing the habit was updated or the error message
+        """
+        habit_name = name
+        result = validate_habit(name, description, start_date, periodicity, cut_off_style, cut_off_time,
+                                habit_status)
+        if isinstance(result, str):
+            return result
+        name, description, start_date, periodicity, cut_off_style, cut_off_time, habit_status = result
+
+        changes = {column: value for column, value in
+                   [('description', description), ('start_date', start_date), ('periodicity', periodicity),
+                    ('cut_off_style', cut_off_style), ('cut_off_time', cut_off_time),
+                    ('habit_status', habit_status)] if value}
+        with self.transaction():
+            habit = self._habits.get(name)
+            if habit is None:
+                return f'ERROR: Habit {habit_name} does not exist!'
+            if changes:
+                self._set(self._habits, name, habit._replace(**changes))
+                self._versions[name] = self._versions.get(name, 0) + 1
+            if changes.keys() & STREAK_COLUMNS:
+                self._pop(self._streaks, name)
+        return f'SUCCESS: Habit {name} successfully updated!'
+
+    def delete_habit(self, name: str):
+        """Delete a habit along with its events and streak state. See db.delete_habit.
+
+        :params: name: name of the habit to be deleted
+        :return: message showing the habit was deleted or did not exist
+        """
+        with self.transaction():
+            if name.upper() not in self._habits:
+                return f'ERROR: Habit {name} does not exist!'
+            for _, event_id in list(self._by_habit.get(name.upper(), [])):
+                self._remove_event(event_id)
+            self._pop(self._habits, name.upper())
+            self._pop(self._streaks, name.upper())
+        return f'Habit {name} has been deleted!'
+
+    def _validate_event(self, name: str, event_date=""):
+        """Same checks as db._validate_event, against the habits in memory."""
+        if not name:
+            return 'ERROR: habit name for event is required'
+        if name.upper() not in self._habits:
+            return f'ERROR: Habit {name} does not exist'
+        if event_date:
+            event_date = normalize_datetime(event_date)
+            if 'ERROR' in event_date:
+                return event_date
+        return [name.upper(), event_date or datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
+
+    def _advance_streak_state(self, name: str, event):
+        """Same as db._advance_streak_state for an event newer or older than the others."""
+        state = self._streaks.get(name)
+        habit = self._habits[name]
+        if state is None or event.event_day < parse_datetime(habit.start_date).toordinal():
+            return
+        if state[0] is None or event.event_day <= state[0]:
+            self._pop(self._streaks, name)
+            return
+        cut_off = cut_off_seconds(habit.start_date, habit.cut_off_style, habit.cut_off_time)
+        self._set(self._streaks, name, advance_streak(*state, event.event_day, event.event_epoch % 86400,
+                                                      habit.periodicity, cut_off, habit.cut_off_style))
+
+    def save_event(self, name: str, event_date=""):
+        """Save a new event of a habit. See db.save_event.
+
+        :params: name: name of the habit
+        :params: event_date: datetime the event happened, now when omitted
+        :return: message showing the event was saved or the error message
+        """
+        with self.transaction():
+            result = self._validate_event(name, event_date)
+            if isinstance(result, str):
+                return result
+            name, event_date = result
+            if self._day_events(name, event_date):
+                return 'ERROR: Event Already Exists!'
+            event = self._timed_event(str(uuid.uuid4()), name, event_date)
+            self._insert_event(event)
+            self._advance_streak_state(name, event)
+        return 'Event for habit {} was successfully uploaded!'.format(name)
+
+    def save_events_bulk(self, events, chunk_size=500, on_result=None):
+        """Save many events in one transaction. See db.save_events_bulk.
+
+        :params: events: iterable of (habit name, event date) pairs
+        :params: chunk_size: number of events validated at a time
+        :params: on_result: optional callable receiving the position and the
+            message of every event
+        :return: list of the message of every event or, with on_result, a
+            summary message
+        """
+        results = []
+        report = on_result if on_result else lambda position, message: results.append(message)
+        saved = 0
+        position = 0
+        events = iter(events)
+        with self.transaction():
+            while True:
+                chunk = list(islice(events, chunk_size))
+                if not chunk:
+                    break
+                for name, event_date in chunk:
+                    result = self._validate_event(name, event_date)
+                    if isinstance(result, str):
+                        message = result
+                    elif self._day_events(*result):
+                        message = 'ERROR: Event Already Exists!'
+                    else:
+                        self._insert_event(self._timed_event(str(uuid.uuid4()), *result))
+                        self._pop(self._streaks, result[0])
+                        saved += 1
+                        message = 'Event for habit {} was successfully uploaded!'.format(result[0])
+                    report(position, message)
+                    position += 1
+        if on_result:
+            return f'SUCCESS: {saved} of {position} events were successfully uploaded!'
+        return results
+
+    def get_event(self, event_id: str):
+        """Retrieve an event by its event_id. See db.get_event.
+
+        :params: event_id: event_id of the event
+        :return: namedtuple of the event or a message showing it was not found
+        """
+        event = self._events.get(event_id)
+        return self._event(event) if event is not None else "ERROR: Requested item NOT found!"
+
+    def get_events(self, name: str):
+        """Retrieve the events of a habit. See db.get_events.
+
+        :params: name: name of the habit
+        :return: namedtuple list of the events ordered by date or a message
+            showing no event was found
+        """
+        with self._lock:
+            events = [self._event(x) for x in self._sorted_events(name.upper())]
+        if not events:
+            return f'ERROR: There are no events for habit {name.upper()} in our database'
+        return events
+
+    def get_event_days(self, name: str, since=None, until=None):
+        """Retrieve the day ordinal and epoch seconds of the habit events. See db.get_event_days.
+
+        :params: name: name of the habit
+        :params: since: first day YYYY-MM-DD of the events, all of them when omitted
+        :params: until: last day YYYY-MM-DD of the events, all of them when omitted
+        :return: list of (event_day, event_epoch) tuples ordered by date or a
+            message showing no event was found
+        """
+        lowest, highest = event_date_range(since, until)
+        with self._lock:
+            dates = self._by_habit.get(name.upper(), [])
+            window = islice(dates, bisect_left(dates, (lowest,)), bisect_left(dates, (highest + '~',)))
+            days = [(x.event_day, x.event_epoch) for x in (self._events[y[1]] for y in window)]
+        if not days:
+            return f'ERROR: There are no events for habit {name.upper()} in our database'
+        return days
+
+    def get_events_by_name_event_date(self, name: str, event_date: str):
+        """Retrieve the events of a habit on the day of a date. See db.get_events_by_name_event_date.
+
+        :params: name: name of the habit
+        :params: event_date: valid datetime string - YYYY-MM-DD hh:mm:ss
+        :return: namedtuple list of the events found
+        """
+        parse_datetime(event_date)
+        with self._lock:
+            return [self._event(x) for x in self._day_events(name.upper(), event_date)]
+
+    def update_event(self, event_id: str, name, event_date):
+        """Edit the habit and date of an existing event. See db.update_event.
+
+        :params: event_id: event_id of the event to be updated
+        :params: name: name of the habit
+        :params: event_date: datetime the event happened
+        :return: message showing the event was updated or the error message
+        """
+        with self.transaction():
+            existing = self._events.get(event_id)
+            if existing is None:
+                return f'ERROR: event with the id {event_id} does not exist!'
+            result = self._validate_event(name, event_date)
+            if isinstance(result, str):
+                return result
+            name, event_date = result
+            if self._day_events(name, event_date):
+                return 'ERROR: Event Already Exists!'
+            self._remove_event(event_id)
+            self._insert_event(self._timed_event(event_id, name, event_date))
+            self._pop(self._streaks, existing.habit_name)
+            self._pop(self._streaks, name)
+        return f'event {event_id} for habit {name} has been updated!'
+
+    def delete_event(self, event_id: str):
+        """Delete an event by its event_id. See db.delete_event.
+
+        :params: event_id: event_id of the event to be deleted
+        :return: message showing the event was deleted or did not exist
+        """
+        with self.transaction():
+            existing = self._events.get(event_id)
+            if existing is None:
+                return f'ERROR: event with the event_id {event_id} does not exist!'
+            self._remove_event(event_id)
+            self._pop(self._streaks, existing.habit_name)
+        return f'event {event_id} has been deleted!'
+
+    def delete_events(self, name: str):
+        """Delete all the events of a habit. See db.delete_events.
+
+        :params: name: name of the habit
+        :return: message showing the events were deleted or that the habit
+            had none
+        """
+        with self.transaction():
+            event_ids = [x[1] for x in self._by_habit.get(name.upper(), [])]
+            if not event_ids:
+                return f'ERROR: event records for habit {name} does not exist!'
+            for event_id in event_ids:
+                self._remove_event(event_id)
+            self._pop(self._streaks, name.upper())
+        return f'event records for habit {name} have been deleted!'
+
+    def get_streak_state(self, name: str):
+        """Retrieve the stored streak state of a habit. See db.get_streak_state.
+
+        :params: name: name of the habit
+        :return: tuple of last_day, streak and max_streak or a message
+            showing no state is stored
+        """
+        state = self._streaks.get(name.upper())
+        return state if state is not None else "ERROR: Requested item NOT found!"
+
+    def save_streak_state(self, name: str, streak: int, max_streak: int):
+        """Store the streaks of a habit as of its newest event. See db.save_streak_state.
+
+        :params: name: name of the habit
+        :params: streak: current streak of the habit
+        :params: max_streak: highest streak of the habit
+        """
+        with self.transaction():
+            dates = self._by_habit.get(name.upper())
+            last_day = self._events[dates[-1][1]].event_day if dates else None
+            self._set(self._streaks, name.upper(), (last_day, streak, max_streak))
+
+    def get_data_version(self, name: str):
+        """Retrieve how many times a habit and its events were changed. See db.get_data_version.
+
+        :params: name: name of the habit
+        :return: tuple of the habit entry date and data version or a message
+            showing the habit was not found
+        """
+        habit = self._habits.get(name.upper())
+        if habit is None:
+            return "ERROR: Requested item NOT found!"
+        return habit.entry_date, self._versions.get(name.upper(), 0)
+
+
+_backend = SQLiteBackend()
+
+
+def set_backend(backend):
+    """Select the storage backend used by the whole process.
+
+    :params: backend: SQLiteBackend, MemoryBackend or any other object
+        implementing StorageBackend
+    :return: the backend previously selected
+    """
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
+
+
+def get_backend():
+    """Return the storage backend used by the whole process, SQLite by default."""
+    return _backend
@@ -0,0 +1,71 @@
+from parsing import parse_datetime
+
+
+def period_days(periodicity: str):
+    """Return the number of days between two expected events of a habit.
+
+    :params: periodicity: expected frequency of the habit - Daily or Weekly
+    :return: 7 for Weekly habits and 1 otherwise
+    """
+    return 7 if periodicity == 'Weekly' else 1
+
+
+def cut_off_seconds(start_date: str, cut_off_style: str, cut_off_time: str):
+    """Return the time of day, in seconds, events of a habit are compared to.
+
+    :params: start_date: datetime the habit starts being analyzed
+    :params: cut_off_style: IGNORE/ON/BEFORE/AFTER
+    :params: cut_off_time: threshold time of the habit - hh:mm:ss
+    :return: seconds since midnight of the cut off time or, when the cut off
+        style is IGNORE, of the start date
+    """
+    if not (cut_off_style == 'IGNORE'):
+        cut_off_time_parts = cut_off_time.split(':')
+        if len(cut_off_time_parts) == 3:
+            return int(cut_off_time_parts[0]) * 3600 + int(cut_off_time_parts[1]) * 60 + \
+                int(cut_off_time_parts[2])
+    habit_startdate = parse_datetime(start_date)
+    return habit_startdate.hour * 3600 + habit_startdate.minute * 60 + habit_startdate.second
+
+
+def is_credible(cut_off_style: str, event_seconds: int, cut_off: int):
+    """Check if an event happened at the time of day the habit requires.
+
+    :params: cut_off_style: IGNORE/ON/BEFORE/AFTER
+    :params: event_seconds: seconds since midnight the event happened
+    :params: cut_off: seconds since midnight returned by cut_off_seconds
+    :return: True if the event counts towards the streak
+    """
+    if cut_off_style == 'IGNORE':
+        return True
+    elif cut_off_style == 'ON':
+        return event_seconds == cut_off
+    elif cut_off_style == 'AFTER':
+        return event_seconds > cut_off
+    elif cut_off_style == 'BEFORE':
+        return event_seconds < cut_off
+    return False
+
+
+def advance_streak(last_day: int, streak: int, max_streak: int, event_day: int, event_seconds: int,
+                   periodicity: str, cut_off: int, cut_off_style: str):
+    """Extend a known streak state with an event newer than all the others.
+
+    An event keeps the streak going when it lands exactly one period after the
+    previous event and satisfies the cut off style, anything else starts over.
+
+    :params: last_day: day ordinal of the newest event already counted
+    :params: streak: current streak of the habit
+    :params: max_streak: highest streak of the habit
+    :params: event_day: day ordinal of the new event
+    :params: event_seconds: seconds since midnight the new event happened
+    :params: periodicity: expected frequency of the habit - Daily or Weekly
+    :params: cut_off: seconds since midnight returned by cut_off_seconds
+    :params: cut_off_style: IGNORE/ON/BEFORE/AFTER
+    :return: the new (last_day, streak, max_streak)
+    """
+    if event_day == last_day + period_days(periodicity) and is_credible(cut_off_style, event_seconds, cut_off):
+        streak += 1
+    else:
+        streak = 0
+    return event_day, streak, max(max_streak, streak)
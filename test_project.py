@@ -1,8 +1,23 @@
+import asyncio
 import gc
+import http.client
+import json
+import os
+import threading
+import time
+from datetime import datetime
+import pytest
+import async_api
+import batch
+import db
 from counter import Counter
-from db import create_data_storage
-from analyse import (calculate_all_counters, calculate_counter, get_all_habits, get_habits_periodically,
-                     habit_with_longest_streak)
+from db import create_data_storage, close_data_storage
+from service import create_service
+from storage import MemoryBackend, SQLiteBackend, set_backend
+from eventlog import EventLogBackend
+from analyse import (calculate_all_counters, calculate_counter, compliance_rate, get_all_habits,
+                     get_habits_periodically, habit_with_longest_streak, monthly_rollup, read_counter,
+                     store_counter, top_streaks)
 
 
 class TestCounter:
@@ -68,6 +83,7 @@ class TestCounter:
         all_habit_counters = calculate_all_counters()
         assert all_habit_counters[0].max_streak == 1
         assert len(all_habit_counters) == 3
+        assert calculate_all_counters(workers=2, chunk_size=1) == all_habit_counters
 
         self.habit2.update_my_habit(start_date='2024-01-05 06:00:00')
         assert self.habit2.start_date == '2024-01-05 06:00:00'
@@ -132,10 +148,166 @@ class TestCounter:
         assert self.habit.streak == 0
         assert self.habit.highest_streak == 2
 
+    def test_streak_cache(self):
+        from analyse import _get_habit_streak
+
+        self.habit = Counter('exercise')
+        self.habit.add_event('2024-01-01 07:00:01')
+        self.habit.calculate_streak()
+        assert db.get_streak_state('exercise')[1:] == (1, 1)
+
+        for event_date in ['2024-01-02 06:02:01', '2024-01-03 06:00:00', '2024-01-04 09:00:00',
+                           '2024-01-05 06:00:00', '2024-01-07 06:00:00', '2024-01-08 06:00:00']:
+            self.habit.add_event(event_date)
+            state = db.get_streak_state('exercise')
+            assert state[1:] == tuple(_get_habit_streak('exercise'))[1:]
+        self.habit.calculate_streak()
+        assert (self.habit.streak, self.habit.highest_streak) == (1, 3)
+
+        # out of order events and edits invalidate the stored streak
+        self.habit.add_event('2024-01-06 06:00:00')
+        assert 'ERROR' in db.get_streak_state('exercise')
+        self.habit.calculate_streak()
+        assert (self.habit.streak, self.habit.highest_streak) == (4, 4)
+        self.habit.update_my_habit(cut_off_style='IGNORE')
+        assert 'ERROR' in db.get_streak_state('exercise')
+        self.habit.calculate_streak()
+        db.save_events_bulk([('exercise', '2024-01-09 06:00:00')])
+        assert 'ERROR' in db.get_streak_state('exercise')
+
+    def test_instrumentation(self, tmp_path):
+        import io
+        import instrumentation
+        from analyse import _get_habit_streak
+
+        histogram = instrumentation.HistogramSink()
+        log = io.StringIO()
+        prometheus = instrumentation.PrometheusSink(str(tmp_path / 'htp.prom'))
+        instrumentation.enable(histogram, instrumentation.JsonLogSink(log), prometheus)
+        try:
+            self.habit = Counter('exercise')
+            self.habit.add_event('2024-01-01 07:00:01')
+            calculate_counter('exercise')
+            calculate_counter('exercise')
+            self.habit.add_event('2024-01-02 07:00:01')
+            calculate_all_counters()
+        finally:
+            instrumentation.disable()
+        _get_habit_streak('exercise')
+
+        snapshot = histogram.snapshot()
+        assert snapshot['counters'] == {'streak_cache_miss': 1, 'streak_cache_hit': 1, 'streak_cache_advance': 1}
+        assert snapshot['histograms']['span']['calculate_counter']['count'] == 2
+        assert snapshot['histograms']['span']['_get_habit_streak']['count'] == 1
+        # one fetch for the recalculated habit, three for the stream of all habits: running its query,
+        # handing the habit it fetched to the streak engine and reaching its end
+        assert snapshot['histograms']['span']['fetch_events']['count'] == 4
+        assert snapshot['histograms']['span']['compute_streaks']['count'] == 1
+        assert '"name": "fetch_events", "seconds"' in log.getvalue()
+        assert any(x.startswith('INSERT OR REPLACE INTO streaks') for x in snapshot['histograms']['query'])
+        assert any(x.startswith('SELECT') for x in snapshot['histograms']['read'])
+        assert '"parent": "calculate_counter"' in log.getvalue()
+        exposition = (tmp_path / 'htp.prom').read_text()
+        assert 'htp_span_seconds_count{name="calculate_counter"} 2' in exposition
+        assert 'htp_events_total{name="streak_cache_hit"} 1' in exposition
+        assert 'htp_parse_cache_hits_total{cache="stored"}' in exposition
+
+    def test_transaction(self):
+
+        self.habit = Counter('exercise')
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                self.habit.add_event('2024-01-01 07:00:01')
+                raise RuntimeError('crash')
+        assert isinstance(db.get_events('exercise'), str)
+
+        with db.transaction():
+            self.habit.add_event('2024-01-01 07:00:01')
+            try:
+                with db.transaction():
+                    self.habit.add_event('2024-01-02 07:00:01')
+                    raise ValueError('undo only the inner block')
+            except ValueError:
+                pass
+            # reads inside the transaction see its uncommitted changes
+            assert len(self.habit.get_events()) == 1
+        assert len(db.get_events('exercise')) == 1
+
+        assert 'deleted' in self.habit.delete_my_habit_plus_events()
+        assert isinstance(db.get_events('exercise'), str)
+
+    def test_update_habit(self):
+
+        assert db.update_habit('jogging', 'Run') == 'ERROR: Habit jogging does not exist!'
+        assert 'SUCCESS' in db.update_habit('exercise', 'Stay fit', periodicity='weekly', cut_off_time='09:00:00 AM')
+        habit = db.get_habit('exercise')
+        assert (habit.description, habit.periodicity, habit.cut_off_time) == ('Stay fit', 'Weekly', '09:00:00')
+        assert habit.start_date == '2024-01-01 07:00:00'
+        assert 'ERROR' in db.update_habit('exercise', periodicity='Monthly')
+
+    def test_top_streaks(self):
+        from analyse import top_streaks
+
+        Counter('exercise').add_events(['2024-01-01 07:00:01', '2024-01-02 07:00:01', '2024-01-04 07:00:01'])
+        Counter('Study', '', '2024-01-01 07:00:00').add_habit()
+        Counter('study').add_events(['2024-01-01 07:00:01', '2024-01-02 07:00:01'])
+        Counter('Walk', '', '2024-01-01 07:00:00', 'Weekly').add_habit()
+        Counter('walk').add_events(['2024-01-01 07:00:01'])
+
+        assert [x.name for x in top_streaks(2)] == ['EXERCISE', 'STUDY']
+        assert [x.name for x in top_streaks(3, by='streak')] == ['STUDY', 'WALK', 'EXERCISE']
+        assert [x.name for x in top_streaks(1, by='streak', tie_break='other')] == ['STUDY']
+        assert [x.name for x in top_streaks(5, periodicity='weekly')] == ['WALK']
+        assert 'ERROR' in top_streaks(3, by='events')
+        assert top_streaks('ten').startswith('ERROR')
+        assert top_streaks(None).startswith('ERROR')
+        assert top_streaks('0').startswith('ERROR')
+        assert [x.name for x in top_streaks('2')] == ['EXERCISE', 'STUDY']
+        assert habit_with_longest_streak().name == 'EXERCISE'
+
+    def test_same_day_event(self):
+        self.habit = Counter('exercise')
+        assert 'successfully' in self.habit.add_event('2024-01-01 23:59:59')
+        assert self.habit.add_event('2024-01-01 00:00:00') == 'ERROR: Event Already Exists!'
+        assert 'successfully' in self.habit.add_event('2024-01-02 00:00:00')
+        assert len(self.habit.get_event('2024-01-02 12:00:00')) == 1
+
+    def test_bulk_events(self):
+        self.habit = Counter('exercise')
+        self.habit.add_event('2024-01-01 07:00:01')
+        results = self.habit.add_events(x for x in ['2024-01-01 06:00:00', '2024-01-02 06:02:01',
+                                                     '2024-01-02 07:00:00', '2024-01-03 07:30:00 AM',
+                                                     'not a date'])
+
+        assert results[0] == 'ERROR: Event Already Exists!'
+        assert 'successfully' in results[1]
+        assert results[2] == 'ERROR: Event Already Exists!'
+        assert 'successfully' in results[3]
+        assert 'ERROR' in results[4]
+        assert len(self.habit.get_events()) == 3
+
+        summary = self.habit.add_events(['2024-01-04 07:00:00'], on_result=lambda position, message: None)
+        assert summary == 'SUCCESS: 1 of 1 events were successfully uploaded!'
+
+        # the malformed second chunk rolls back the event reported as uploaded by the first
+        reports = []
+        result = db.save_events_bulk([('exercise', '2024-01-05 07:00:00'), ('exercise',)], chunk_size=1,
+                                     on_result=lambda position, message: reports.append((position, message)))
+        assert isinstance(result, tuple) and [x[0] for x in reports] == [0, None]
+        assert 'rolled back' in reports[1][1]
+        assert len(self.habit.get_events()) == 4
+
+    def test_bulk_events_probe_batches(self, monkeypatch):
+        # two days are probed per query, so the duplicates span several batches
+        monkeypatch.setattr(db, '_MAX_VARIABLES', 5)
+        self.habit.add_events([f'2024-01-{x:02} 07:00:00' for x in range(1, 6)])
+        results = self.habit.add_events([f'2024-01-{x:02} 06:00:00' for x in range(1, 11)])
+        assert [x == 'ERROR: Event Already Exists!' for x in results] == [True] * 5 + [False] * 5
+        assert len(self.habit.get_events()) == 10
+
     def teardown_method(self):
         import sqlite3
         from contextlib import closing
-        import os
 
         dbname = 'test.db'
 
@@ -150,3 +322,502 @@ class TestCounter:
                 gc.collect(2)
 
         os.remove(dbname)
+
+
+class TestConnectionPool:
+    def test_connections_are_reused(self):
+        from connection import ConnectionPool
+
+        pool = ConnectionPool('test_pool.db', pool_size=2)
+        with pool.writer() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS items (value TEXT)')
+            conn.execute("INSERT INTO items VALUES ('one')")
+        with pool.reader() as first:
+            assert first.execute('SELECT count(*) FROM items').fetchone()[0] == 1
+        with pool.reader() as second:
+            assert second is first
+        with pool.reader() as outer, pool.reader() as inner:
+            assert inner is not outer
+        pool.close()
+        os.remove('test_pool.db')
+
+    def test_storage_profile(self):
+        from connection import ConnectionPool
+
+        pool = ConnectionPool('test_pool.db', profile='balanced')
+        with pool.writer() as conn:
+            assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        with pool.reader() as conn:
+            assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1
+        pool.close()
+        os.remove('test_pool.db')
+        assert 'ERROR' in create_data_storage('test_pool.db', profile='reckless')
+
+
+class TestMigrations:
+    def test_upgrade_in_place(self):
+        import sqlite3
+        from migrations import migrate, get_schema_version, SCHEMA_VERSION
+
+        with sqlite3.connect('test_migrate.db') as conn:
+            migrate(conn, target=1)
+            conn.execute("INSERT INTO habits VALUES('READ', '', '', '2024-01-01 00:00:00', 'Daily', 'IGNORE', "
+                         "'00:00:00', 'ACTIVE')")
+            conn.execute("INSERT INTO events VALUES('abc', 'READ', '2024-01-31 05:19:03')")
+        conn.close()
+
+        create_data_storage('test_migrate.db')
+        assert len(db.get_events('read')) == 1
+        close_data_storage()
+
+        with sqlite3.connect('test_migrate.db') as conn:
+            assert get_schema_version(conn) == SCHEMA_VERSION
+            assert conn.execute('SELECT event_epoch, event_day FROM events').fetchone() == (1706678343, 738916)
+        conn.close()
+        os.remove('test_migrate.db')
+
+    def test_integer_habit_ids(self):
+        import sqlite3
+        from migrations import migrate
+
+        with sqlite3.connect('test_migrate.db') as conn:
+            migrate(conn, target=6)
+            for name in ('WALK', 'READ'):
+                conn.execute("INSERT INTO habits (name, entry_date, start_date, periodicity, cut_off_style, "
+                             "cut_off_time, habit_status) VALUES(?, '2024-01-01 00:00:00', '2024-01-01 00:00:00', "
+                             "'Daily', 'IGNORE', '00:00:00', 'ACTIVE')", (name,))
+            conn.execute("INSERT INTO events VALUES('abc', 'READ', '2024-01-01 05:00:00', 1704085200, 738886)")
+            conn.execute("INSERT INTO events VALUES('def', 'GONE', '2024-01-01 05:00:00', 1704085200, 738886)")
+            conn.execute("INSERT INTO streaks VALUES('READ', 738886, 1, 1)")
+        conn.close()
+
+        try:
+            create_data_storage('test_migrate.db')
+            assert db.get_events('read') == [('abc', 'READ', '2024-01-01 05:00:00')]
+            assert db.get_streak_state('read') == (738886, 1, 1)
+            version = db.get_data_version('read')[1]
+            Counter('read', '').add_event('2024-01-02 05:00:00')
+            assert db.get_streak_state('read') == (738887, 2, 2)
+            assert db.get_data_version('read')[1] == version + 1
+        finally:
+            close_data_storage()
+        with sqlite3.connect('test_migrate.db') as conn:
+            assert conn.execute('SELECT habit_id FROM events WHERE event_id=?', ('def',)).fetchone() == (None,)
+            assert conn.execute('SELECT name FROM habits ORDER BY habit_id').fetchall() == [('READ',), ('WALK',)]
+        conn.close()
+        os.remove('test_migrate.db')
+
+    def test_rollups(self):
+        import sqlite3
+        from migrations import migrate
+
+        with sqlite3.connect('test_migrate.db') as conn:
+            migrate(conn, target=7)
+            conn.execute("INSERT INTO habits (name, start_date, periodicity, cut_off_style, cut_off_time, "
+                         "habit_status) VALUES('READ', '2024-01-01 00:00:00', 'Daily', 'BEFORE', '08:00:00', "
+                         "'ACTIVE')")
+            conn.execute("INSERT INTO events (event_id, habit_id, event_date, event_epoch, event_day) "
+                         "VALUES('abc', 1, '2024-01-03 07:00:00', 1704265200, 738888)")
+        conn.close()
+
+        try:
+            create_data_storage('test_migrate.db')
+            assert db.get_rollups('read') == [('2024-01', 1, 0b100, 0b100)]
+            Counter('read', '').add_events(['2024-01-01 09:00:00', '2024-02-29 07:00:00'])
+            assert db.get_rollups('read') == [('2024-01', 2, 0b101, 0b100), ('2024-02', 1, 1 << 28, 1 << 28)]
+            db.update_habit('read', cut_off_style='after')
+            assert db.get_rollups('read', '2024-01', '2024-01') == [('2024-01', 2, 0b101, 0b001)]
+            db.delete_event(db.get_events('read')[0].event_id)
+            assert db.get_rollups('read', until='2024-01') == [('2024-01', 1, 0b100, 0b000)]
+            assert 'deleted' in db.delete_habit('read')
+            db.save_habit('read', '', '2024-01-01 00:00:00')
+            assert db.get_rollups('read') == []
+        finally:
+            close_data_storage()
+        os.remove('test_migrate.db')
+
+
+class TestStreakEngines:
+    def test_numpy_engine_matches_python_loop(self):
+        import random
+        from datetime import datetime, timedelta
+        from analyse import set_streak_engine, _get_habit_streak
+
+        pytest.importorskip('numpy')
+        create_data_storage(':memory:')
+        generator = random.Random(7)
+        names = []
+        for x in range(40):
+            name = f'habit {x}'
+            names.append(name)
+            start = datetime(2024, 1, 1) + timedelta(days=generator.randint(0, 5),
+                                                     hours=generator.choice([6, 7, 8]))
+            db.save_habit(name, '', start.strftime('%Y-%m-%d %H:%M:%S'), generator.choice(['Daily', 'Weekly']),
+                       generator.choice(['IGNORE', 'ON', 'BEFORE', 'AFTER']), '07:00:00')
+            day = datetime(2023, 12, 28)
+            events = []
+            for y in range(generator.randint(0, 60)):
+                day += timedelta(days=generator.choice([1, 1, 1, 2, 6, 7, 7, 8]))
+                event_time = day + timedelta(hours=generator.choice([6, 7, 8]))
+                events.append((name, event_time.strftime('%Y-%m-%d %H:%M:%S')))
+            db.save_events_bulk(events)
+
+        try:
+            for name in names:
+                set_streak_engine('python')
+                expected = calculate_counter(name)
+                set_streak_engine('numpy')
+                assert calculate_counter(name) == expected
+
+            expected = [x for x in (_get_habit_streak(y.name) for y in get_all_habits()) if not isinstance(x, str)]
+            assert calculate_all_counters() == expected
+            set_streak_engine('python')
+            assert calculate_all_counters() == expected
+        finally:
+            set_streak_engine('python')
+            close_data_storage()
+
+    def test_unknown_engine(self):
+        from analyse import set_streak_engine, get_streak_engine
+
+        assert 'ERROR' in set_streak_engine('fortran')
+        assert get_streak_engine() == 'python'
+
+
+class TestParsing:
+    def test_cached_normalization(self):
+        from parsing import normalize_datetime, normalize_time, parse_cache_info, clear_parse_caches
+
+        clear_parse_caches()
+        assert normalize_datetime('2024-01-31 05:19:03 PM') == '2024-01-31 17:19:03'
+        assert normalize_datetime('2024-01-31 05:19:03 PM') == '2024-01-31 17:19:03'
+        assert normalize_datetime('2024-01-31 05:19:03') == '2024-01-31 05:19:03'
+        assert 'ERROR' in normalize_datetime('2024-13-31 05:19:03')
+        assert normalize_time('01:40:57 pm') == '13:40:57'
+
+        stats = parse_cache_info()
+        assert stats['datetime']['hits'] == 1
+        assert stats['datetime']['misses'] == 3
+        assert stats['time']['misses'] == 1
+
+
+class TestAsyncApi:
+    def test_concurrent_requests(self):
+        async def scenario():
+            habit = async_api.AsyncCounter('Read', '', '2024-01-01 07:00:00')
+            assert 'successfully' in await habit.add_habit()
+            saved = await asyncio.gather(*[habit.add_event(f'2024-01-{x:02} 08:00:00') for x in range(1, 11)])
+            assert all('successfully' in x for x in saved)
+
+            counters, events, _ = await asyncio.gather(async_api.calculate_all_counters(),
+                                                       async_api.get_events('read'),
+                                                       habit.calculate_streak())
+            assert counters[0].max_streak == 10
+            assert len(events) == 10
+            assert habit.highest_streak == 10
+
+            await async_api._write(db.update_habit, 'read', start_date='2024-01-02 07:00:00')
+            assert (await async_api.calculate_counter('read'))[1:] == (9, 9)
+            assert db.get_streak_state('read')[1:] == (9, 9)
+
+            with pytest.raises(asyncio.TimeoutError):
+                await async_api._read(time.sleep, 1, timeout=0.01)
+
+        create_data_storage('test_async.db')
+        try:
+            asyncio.run(scenario())
+        finally:
+            async_api.shutdown_executors()
+            close_data_storage()
+            os.remove('test_async.db')
+
+
+class TestService:
+    def test_etag_and_keep_alive(self):
+        service = create_service(port=0, database='test_service.db')
+        thread = threading.Thread(target=service.serve_forever, daemon=True)
+        thread.start()
+        client = http.client.HTTPConnection('127.0.0.1', service.server_address[1])
+
+        def request(method, path, body=None, headers=None):
+            client.request(method, path, json.dumps(body) if body is not None else None, headers or {})
+            response = client.getresponse()
+            data = response.read()
+            return response.status, response.getheader('ETag'), json.loads(data) if data else None
+
+        try:
+            status, _, _ = request('POST', '/habits', {'name': 'Walk', 'start_date': '2024-01-01 07:00:00'})
+            assert status == 201
+            assert request('POST', '/habits', {'name': 'walk'})[0] == 409
+            for x in range(1, 4):
+                status, _, _ = request('POST', '/habits/walk/events', {'event_date': f'2024-01-0{x} 08:00:00'})
+                assert status == 201
+
+            status, etag, streak = request('GET', '/habits/walk/streak')
+            assert status == 200 and streak['max_streak'] == 3
+            assert 'ERROR' in db.get_streak_state('walk')
+            assert request('GET', '/habits/walk/streak', headers={'If-None-Match': etag})[0] == 304
+
+            request('POST', '/habits/walk/events', {'event_date': '2024-01-04 08:00:00'})
+            status, new_etag, streak = request('GET', '/habits/walk/streak', headers={'If-None-Match': etag})
+            assert status == 200 and new_etag != etag and streak['streak'] == 4
+
+            status, etag, streaks = request('GET', '/streaks')
+            assert status == 200 and streaks[0]['name'] == 'WALK'
+            assert request('GET', '/streaks', headers={'If-None-Match': etag})[0] == 304
+            assert request('GET', '/streaks', headers={'If-None-Match': f'"other", W/{etag}'})[0] == 304
+            assert request('GET', '/streaks', headers={'If-None-Match': '*'})[0] == 304
+            assert request('GET', '/streaks', headers={'If-None-Match': f'"x{etag[1:]}'})[0] == 200
+            assert request('GET', '/habits/nothing/streak')[0] == 404
+            assert request('GET', '/habits/nothing')[0] == 404
+            assert request('POST', '/habits/nothing/events', {'event_date': '2024-01-01 08:00:00'})[0] == 404
+            assert request('GET', '/nothing')[0] == 404
+            assert request('GET', '/streaks/top?by=unknown')[0] == 400
+            assert request('GET', '/streaks/top?k=ten')[0] == 400
+        finally:
+            client.close()
+            service.shutdown()
+            service.server_close()
+            close_data_storage()
+            os.remove('test_service.db')
+
+
+class TestBatch:
+    def test_import_export_streaks(self, tmp_path, capsys):
+        database = str(tmp_path / 'batch.db')
+        events = tmp_path / 'events.csv'
+        events.write_text('habit_name,event_date\nswim,2024-01-01 07:00:00\nswim,2024-01-02 07:00:00\n'
+                          'swim,not a date\n')
+
+        assert batch.main(['--database', database, 'add-habit', 'swim', '--start-date', '2024-01-01 06:00:00']) == 0
+        assert not os.path.exists(database + '-wal')
+        assert batch.main(['--database', database, 'import-events', str(events)]) == 1
+        captured = capsys.readouterr()
+        assert 'SUCCESS: 2 of 3 events' in captured.out
+        assert 'line 4: ERROR' in captured.err
+
+        assert batch.main(['--database', database, 'export', '--format', 'jsonl']) == 0
+        exported = [json.loads(x) for x in capsys.readouterr().out.splitlines()]
+        assert [x['event_date'] for x in exported] == ['2024-01-01 07:00:00', '2024-01-02 07:00:00']
+
+        assert batch.main(['--database', database, 'streaks', '--all', '--format', 'jsonl']) == 0
+        assert json.loads(capsys.readouterr().out) == {'name': 'SWIM', 'streak': 2, 'max_streak': 2}
+        assert batch.main(['--database', database, 'streaks', '--habit', 'unknown']) == 1
+        lines = tmp_path / 'events.jsonl'
+        lines.write_text('{"habit_name": 5, "event_date": "2024-01-03 07:00:00"}\n'
+                         '{"habit_name": "swim", "event_date": 20240104}\n'
+                         '{"habit_name": "swim", "event_date": "2024-01-05 07:00:00"}\n')
+        assert batch.main(['--database', database, 'import-events', str(lines), '--format', 'jsonl']) == 1
+        captured = capsys.readouterr()
+        assert 'SUCCESS: 1 of 1 events' in captured.out
+        assert 'line 1: ERROR' in captured.err and 'line 2: ERROR' in captured.err
+
+        with pytest.raises(SystemExit) as exit_info:
+            batch.main(['--database', database, '--profile', 'reckless', 'export'])
+        assert exit_info.value.code == 2
+
+
+class TestSnapshot:
+    def test_export_and_analyse_offline(self, tmp_path, capsys):
+        from analyse import calculate_snapshot_counters, load_snapshot, set_streak_engine
+        from benchmarks.generators import populate
+        from snapshot import export_snapshot
+
+        pytest.importorskip('numpy')
+        database = str(tmp_path / 'snapshot.db')
+        habits = populate(database, 30, 40, seed=3)
+        create_data_storage(database)
+        try:
+            db.save_habit('undescribed', None, '2024-01-01 07:00:00')
+            expected = calculate_all_counters()
+            events = db.get_events(habits[0].name)
+            stored_habits = db.get_habits()
+            assert 'SUCCESS: 31 habits and 1200 events' in export_snapshot(str(tmp_path / 'copy'), 'npz')
+        finally:
+            close_data_storage()
+
+        snapshot = load_snapshot(str(tmp_path / 'copy.npz'))
+        assert snapshot.get_habits() == stored_habits
+        assert snapshot.get_habit('undescribed').description is None
+        assert snapshot.get_events(habits[0].name) == events
+        assert snapshot.get_event(events[1].event_id) == events[1]
+        assert 'read-only' in snapshot.save_event(habits[0].name)
+        try:
+            for engine in ('python', 'numpy'):
+                set_streak_engine(engine)
+                assert calculate_snapshot_counters(snapshot) == expected
+                assert calculate_counter(habits[0].name, snapshot) in expected
+        finally:
+            set_streak_engine('python')
+
+        assert batch.main(['--database', str(tmp_path / 'other.db'), 'streaks', '--all',
+                           '--snapshot', str(tmp_path / 'copy.npz')]) == 0
+        assert len(capsys.readouterr().out.splitlines()) == len(expected)
+
+
+@pytest.fixture(params=['sqlite', 'memory', 'eventlog'])
+def backend(request, tmp_path):
+    """Every storage backend, each against an empty store."""
+    if request.param == 'sqlite':
+        create_data_storage(':memory:')
+        yield SQLiteBackend()
+        close_data_storage()
+    elif request.param == 'eventlog':
+        create_data_storage(':memory:')
+        log = EventLogBackend(str(tmp_path / 'events.log'))
+        yield log
+        log.close()
+        close_data_storage()
+    else:
+        yield MemoryBackend()
+
+
+class TestStorageContract:
+    def test_habits(self, backend):
+        assert 'successfully created' in backend.save_habit('walk', '', '2024-01-01 07:00:00', 'Weekly')
+        assert 'successfully created' in backend.save_habit('read', 'books', '2024-01-01 07:00:00')
+        assert isinstance(backend.save_habit('walk', ''), tuple)
+        assert 'ERROR' in backend.save_habit('swim', '', '', 'Monthly')
+
+        assert [x.name for x in backend.get_habits()] == ['READ', 'WALK']
+        assert [x.name for x in backend.get_habits_by_periodicity('weekly')] == ['WALK']
+        assert backend.get_habit('read').description == 'books'
+
+        assert 'SUCCESS' in backend.update_habit('read', description='novels', cut_off_style='before',
+                                                 cut_off_time='08:00:00 AM')
+        assert backend.get_habit('read')[1:] == ('novels', backend.get_habit('read').entry_date,
+                                                 '2024-01-01 07:00:00', 'Daily', 'BEFORE', '08:00:00', 'ACTIVE')
+        assert backend.update_habit('nothing', description='x') == 'ERROR: Habit nothing does not exist!'
+        backend.update_habit('walk', habit_status='COMPLETED')
+        assert [x.name for x in backend.get_habits()] == ['READ']
+
+        assert backend.delete_habit('read') == 'Habit read has been deleted!'
+        assert 'ERROR' in backend.get_habit('read')
+        assert backend.delete_habit('read') == 'ERROR: Habit read does not exist!'
+
+    def test_events(self, backend):
+        backend.save_habit('walk', '', '2024-01-01 07:00:00')
+        for event_date in ['2024-01-02 08:00:00', '2024-01-01 08:00:00 PM', '2024-01-03 07:00:00']:
+            assert 'successfully uploaded' in backend.save_event('walk', event_date)
+        assert backend.save_event('walk', '2024-01-02 11:00:00') == 'ERROR: Event Already Exists!'
+        assert backend.save_event('run', '2024-01-02 11:00:00') == 'ERROR: Habit run does not exist'
+        assert 'ERROR' in backend.save_event('walk', '2024-02-30 11:00:00')
+
+        events = backend.get_events('walk')
+        assert [x.event_date for x in events] == ['2024-01-01 20:00:00', '2024-01-02 08:00:00', '2024-01-03 07:00:00']
+        assert backend.get_event(events[0].event_id) == events[0]
+        assert backend.get_events_by_name_event_date('walk', '2024-01-02 00:00:00') == [events[1]]
+        assert [x[0] for x in backend.get_event_days('walk')] == [738886, 738887, 738888]
+
+        assert 'has been updated' in backend.update_event(events[0].event_id, 'walk', '2023-12-31 20:00:00')
+        assert backend.update_event(events[0].event_id, 'walk', '2024-01-02 20:00:00') == \
+            'ERROR: Event Already Exists!'
+        assert 'ERROR' in backend.update_event('unknown', 'walk', '2024-01-09 20:00:00')
+        assert backend.get_events('walk')[0].event_date == '2023-12-31 20:00:00'
+
+        assert 'has been deleted' in backend.delete_event(events[1].event_id)
+        assert 'ERROR' in backend.delete_event(events[1].event_id)
+        assert len(backend.get_events('walk')) == 2
+        assert backend.delete_events('walk') == 'event records for habit walk have been deleted!'
+        assert 'ERROR' in backend.get_events('walk')
+        assert 'ERROR' in backend.delete_events('walk')
+
+        backend.save_event('walk', '2024-01-05 07:00:00')
+        backend.delete_habit('walk')
+        backend.save_habit('walk', '', '2024-01-01 07:00:00')
+        assert 'ERROR' in backend.get_events('walk')
+
+    def test_bulk_events(self, backend):
+        backend.save_habit('walk', '', '2024-01-01 07:00:00')
+        messages = backend.save_events_bulk([('walk', '2024-01-01 08:00:00'), ('walk', '2024-01-01 09:00:00'),
+                                             ('run', '2024-01-01 08:00:00'), ('walk', '2024-01-02 08:00:00')])
+        assert ['successfully' in x for x in messages] == [True, False, False, True]
+        assert backend.save_events_bulk([('walk', '2024-01-03 08:00:00')], on_result=lambda *x: None) == \
+            'SUCCESS: 1 of 1 events were successfully uploaded!'
+
+    def test_streaks_and_transactions(self, backend):
+        habit = Counter('walk', '', '2024-01-01 07:00:00', backend=backend)
+        habit.add_habit()
+        habit.add_events(['2024-01-01 08:00:00', '2024-01-02 08:00:00', '2024-01-04 08:00:00'])
+        habit.calculate_streak()
+        assert (habit.streak, habit.highest_streak) == (0, 2)
+        habit.add_event('2024-01-05 08:00:00')
+        assert backend.get_streak_state('walk')[1:] == (1, 2)
+        assert calculate_all_counters(backend=backend)[0][1:] == (1, 2)
+        assert top_streaks(1, backend=backend)[0].name == 'WALK'
+
+        with pytest.raises(RuntimeError):
+            with backend.transaction():
+                backend.save_event('walk', '2024-01-06 08:00:00')
+                with backend.transaction():
+                    backend.update_habit('walk', periodicity='Weekly')
+                raise RuntimeError
+        assert len(backend.get_events('walk')) == 4
+        assert backend.get_habit('walk').periodicity == 'Daily'
+        assert backend.get_streak_state('walk')[1:] == (1, 2)
+
+        backend.update_habit('walk', start_date='2024-01-02 07:00:00')
+        counter, version = read_counter('walk', backend)
+        backend.save_event('walk', '2024-01-07 08:00:00')
+        assert store_counter(counter, version, backend) is False
+        assert 'ERROR' in backend.get_streak_state('walk')
+        assert store_counter(*read_counter('walk', backend), backend) is True
+        assert backend.get_streak_state('walk')[1:] == (0, 1)
+
+    def test_windowed_analytics(self, backend):
+        backend.save_habit('walk', '', '2024-01-01 07:00:00')
+        backend.save_events_bulk([('walk', x) for x in ['2024-01-01 07:00:00', '2024-01-02 07:30:00',
+                                                         '2024-01-03 09:00:00', '2024-01-04 07:00:00',
+                                                         '2024-01-05 07:00:00', '2024-02-01 07:00:00',
+                                                         '2024-02-02 07:00:00']])
+        backend.update_habit('walk', cut_off_style='before', cut_off_time='08:00:00 AM')
+
+        assert calculate_counter('walk', backend)[1:] == (1, 2)
+        assert calculate_counter('walk', backend, since='2024-01-04', until='2024-01-31')[1:] == (2, 2)
+        assert calculate_counter('walk', backend, since='2024-01-01', until='2024-01-03')[1:] == (0, 2)
+        assert 'no events' in calculate_counter('walk', backend, since='2024-01-10', until='2024-01-31')
+
+        assert compliance_rate('walk', '2024-01-01', '2024-01-10', backend)[1:] == (4, 10, 0.4)
+        assert [tuple(x) for x in monthly_rollup('walk', '2024-01-15', '2024-02-10', backend)] == \
+            [('2024-01', 5, 4, 31, 4 / 31), ('2024-02', 2, 2, 29, 2 / 29)]
+        assert 'ERROR' in compliance_rate('walk', '2024-02-01', '2024-01-01', backend)
+        assert 'ERROR' in monthly_rollup('walk', 'soon', backend=backend)
+        assert 'ERROR' in compliance_rate('nothing', backend=backend)
+
+    def test_process_backend(self, backend):
+        previous = set_backend(backend)
+        try:
+            habit = Counter('walk', '', '2024-01-01 07:00:00')
+            habit.add_habit()
+            habit.add_event('2024-01-01 08:00:00')
+            assert len(backend.get_events('walk')) == 1
+            assert calculate_counter('walk')[1:] == (1, 1)
+        finally:
+            set_backend(previous)
+
+
+class TestEventLog:
+    def test_reopen_and_compact(self, tmp_path):
+        path = str(tmp_path / 'events.log')
+        create_data_storage(':memory:')
+        try:
+            log = EventLogBackend(path)
+            log.save_habit('walk', '', '2024-01-01 07:00:00')
+            log.save_events_bulk([('walk', f'2024-01-{x:02} 08:00:00') for x in range(1, 11)])
+            event = log.get_events('walk')[0]
+            assert 'updated' in log.update_event(event.event_id, 'walk', '2024-02-01 08:00:00')
+            assert 'deleted' in log.delete_event(log.get_events('walk')[0].event_id)
+            log.close()
+
+            log = EventLogBackend(path)
+            assert (log.log.count, log.log.tombstones) == (11, 2)
+            events = log.get_events('walk')
+            assert len(events) == 9 and events[-1] == (event.event_id, 'WALK', '2024-02-01 08:00:00')
+            assert log.get_event(event.event_id) == events[-1]
+            log.log.compact()
+            assert (log.log.count, log.log.tombstones) == (9, 0)
+            assert log.get_events('walk') == events
+            assert log.get_event_days('walk')[0][0] == datetime(2024, 1, 3).toordinal()
+            log.close()
+        finally:
+            close_data_storage()
@@ -0,0 +1,63 @@
+from parsing import normalize_datetime, normalize_time
+
+# habit columns the stored streak state depends on
+STREAK_COLUMNS = {'start_date', 'periodicity', 'cut_off_style', 'cut_off_time'}
+
+
+def validate_habit(name: str, description="", start_date="", periodicity="",
+                   cut_off_style="", cut_off_time="", habit_status=""):
+    """Validate the fields for a habit.
+
+    :params: name: is the name of the habit
+    :params: description: is the description of the habit
+    :params: start_date: is the datetime the app starts analyzing events for
+                        the habit.
+    :params: periodicity: is the expected frequency for the habit - Daily
+                        or Weekly.
+    :params: cut_off_style: this shows if the time the habit is undertaken
+        is significant. Values include IGNORE/ON/BEFORE/AFTER.
+    :params: cut_off_time: is the threshold time for the habit.
+    :params: habit_status: is the status of the habit. Values include
+            ACTIVE/COMPLETED.
+    :return: returns a habit with a list of all its valid properties -
+        [name, description, start_date, periodicity, cut_off_style,
+        cut_off_time, habit_status] or an error stating any invalid property
+        value encountered
+    """
+    if not name:
+        return 'ERROR: habit name is required'
+    else:
+        name = name.upper()
+
+    if start_date:
+        result = normalize_datetime(start_date)
+        if 'ERROR' in result:
+            return result
+        else:
+            start_date = result
+
+    if periodicity:
+        periodicity = periodicity.capitalize()
+        if not (periodicity == 'Daily' or periodicity == 'Weekly'):
+            return f'ERROR: Allowed periodicity are Daily or Weekly NOT [{periodicity}]'
+
+    if cut_off_style:
+        cut_off_style = cut_off_style.upper()
+        if not (cut_off_style == 'IGNORE' or cut_off_style == 'ON' or
+                cut_off_style == 'BEFORE' or cut_off_style == 'AFTER'):
+            return f'ERROR: Allowed cut_off_style are IGNORE/ON/BEFORE/AFTER not [{cut_off_style}]'
+
+    if cut_off_time:
+        result = normalize_time(cut_off_time)
+        if 'ERROR' in result:
+            return result
+        else:
+            cut_off_time = result
+
+    if habit_status:
+        habit_status = habit_status.upper()
+        if not (habit_status == 'ACTIVE' or habit_status == 'COMPLETED'):
+            return f'ERROR:Allowed habit_status are ACTIVE/COMPLETED not [{habit_status}]'
+
+    return [name, description, start_date, periodicity, cut_off_style,
+            cut_off_time, habit_status]